@@ -0,0 +1,349 @@
+"""
+ASGI entry point serving the same routes and JSON contracts as app.py.
+
+Views run on an asyncio event loop and upstream calls go through the
+non-blocking client in async_upstream.py, so a single worker can keep many
+slow Gemini requests in flight. Run with:
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port $PORT
+"""
+import asyncio
+import json
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.datastructures import UploadFile
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Match, Route
+
+import config  # noqa: F401  loads .env before the modules below read their settings
+import async_upstream
+import cache
+import circuit
+import governor
+import handlers
+import health
+import jobs
+import metrics
+import price_store
+import prompts
+import scheme_index
+import search_fallback
+import stale
+import store_registry
+import structured
+import triage
+import uploads
+import warmer
+import weather_cache
+
+
+async def arun(flow):
+    """Async counterpart of ``handlers.run``."""
+    timer = metrics.FlowTimer()
+    try:
+        call = timer.resume(flow.send)
+        while True:
+            try:
+                with timer.waiting(call):
+                    result = await async_upstream.execute(call)
+            except circuit.Unavailable:
+                # Fail the whole request fast rather than let the flow fall back.
+                flow.close()
+                raise
+            except Exception as exc:
+                call = timer.resume(flow.throw, exc)
+            else:
+                call = timer.resume(flow.send, result)
+    except StopIteration as stop:
+        return stop.value
+    finally:
+        timer.finish()
+
+
+async def respond(flow):
+    try:
+        body, status, *headers = await arun(flow)
+        if isinstance(body, handlers.ChatStream):
+            # Admitted before the 200 goes out, so a busy Gemini is still a 503.
+            return stream_response(body, await async_upstream.admit(body.call))
+    except circuit.Unavailable as exc:
+        body, status, *headers = circuit.unavailable_response(exc)
+    with metrics.stage("serialize"):
+        return JSONResponse(body, status_code=status, headers=headers[0] if headers else None)
+
+
+class MetricsMiddleware:
+    """Counts and times every request under its route template."""
+
+    def __init__(self, app, routes):
+        self.app = app
+        self.routes = routes
+
+    def route_path(self, scope):
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+        return "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = metrics.request_started(self.route_path(scope))
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            metrics.request_finished(token, status)
+
+
+def stream_response(chat_stream, admission=None):
+    async def events():
+        try:
+            async for chunk in async_upstream.stream_events(chat_stream.call, admission):
+                event = chat_stream.feed(chunk)
+                if event:
+                    yield event
+            yield chat_stream.finish()
+        except Exception as exc:
+            yield chat_stream.fail(exc)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(admission.abandon) if admission is not None else None,
+    )
+
+
+async def get_json(request):
+    """Mirror Flask's ``request.get_json(silent=True) or {}``."""
+    if "json" not in request.headers.get("content-type", ""):
+        return {}
+    try:
+        return json.loads(await request.body()) or {}
+    except ValueError:
+        return {}
+
+
+def job_requested(request):
+    return jobs.wants_job(request.query_params.get("mode"), request.headers.get("prefer"))
+
+
+def queue_job(endpoint, body):
+    body, status, headers = jobs.submit(endpoint, body)
+    return JSONResponse(body, status_code=status, headers=headers)
+
+
+async def health_check(request):
+    return JSONResponse({"message": "Crop Disease Detection API is running"})
+
+
+async def liveness(request):
+    body, status = health.liveness()
+    return JSONResponse(body, status_code=status)
+
+
+async def readiness(request):
+    body, status = health.readiness()
+    return JSONResponse(body, status_code=status)
+
+
+async def cache_stats(request):
+    return JSONResponse(cache.stats())
+
+
+async def upstream_stats(request):
+    return JSONResponse(
+        {
+            "search_variants": search_fallback.stats(),
+            "single_flight": async_upstream.flights.stats(),
+            "weather_refresh": weather_cache.refreshes,
+            "jobs": jobs.stats(),
+            "structured_output": structured.stats(),
+            "governor": governor.stats(),
+            "circuits": circuit.stats(),
+            "stale": stale.stats(),
+            "scheme_index": scheme_index.stats(),
+            "store_registry": store_registry.stats(),
+            "price_store": price_store.stats(),
+            "triage": triage.stats(),
+            "prompt_cache": prompts.stats(),
+            "warmer": warmer.stats(),
+            "health": health.stats(),
+        }
+    )
+
+
+async def prometheus_metrics(request):
+    return Response(
+        metrics.render(single_flight=async_upstream.flights.stats()), headers={"Content-Type": metrics.CONTENT_TYPE}
+    )
+
+
+async def test_api_keys(request):
+    return JSONResponse(health.api_key_report())
+
+
+async def read_form(request, max_bytes):
+    """``request.form()`` that stops receiving once the body exceeds ``max_bytes``."""
+    length = request.headers.get("content-length", "")
+    if length.isdigit() and int(length) > max_bytes:
+        raise uploads.TooLarge()
+    received = 0
+
+    async def receive():
+        nonlocal received
+        message = await request.receive()
+        received += len(message.get("body", b""))
+        if received > max_bytes:
+            raise uploads.TooLarge()
+        return message
+
+    return await Request(request.scope, receive).form()
+
+
+async def detect_disease(request):
+    try:
+        form = await read_form(request, uploads.MAX_BYTES)
+    except uploads.TooLarge:
+        return JSONResponse(*uploads.too_large(uploads.MAX_BYTES))
+    try:
+        image_file = form.get("file")
+        if not isinstance(image_file, UploadFile):
+            return await respond(handlers.detect_disease(None, None))
+        mimetype = (image_file.content_type or "").split(";")[0].strip()
+        image = image_file.file if uploads.STREAMING else await image_file.read()
+        return await respond(handlers.detect_disease(image, mimetype))
+    finally:
+        await form.close()
+
+
+async def detect_disease_batch(request):
+    try:
+        form = await read_form(request, handlers.BATCH_MAX_BYTES)
+    except uploads.TooLarge:
+        return JSONResponse(*uploads.too_large(handlers.BATCH_MAX_BYTES))
+    files = [
+        (upload.filename, await upload.read(), (upload.content_type or "").split(";")[0].strip())
+        for upload in form.getlist("files") + form.getlist("file")
+        if isinstance(upload, UploadFile)
+    ]
+    await form.close()
+    items, error = handlers.batch_items(files)
+    if error:
+        return JSONResponse(error[0], status_code=error[1])
+
+    limit = asyncio.Semaphore(handlers.BATCH_CONCURRENCY)
+
+    async def run_chunk(chunk):
+        async with limit:
+            try:
+                return await arun(handlers.detect_disease_chunk(chunk))
+            except circuit.Unavailable as exc:
+                return handlers.failed_rows(chunk, exc)
+
+    async def rows():
+        done = []
+        tasks = [asyncio.ensure_future(run_chunk(chunk)) for chunk in handlers.batch_chunks(items)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                for row in await next_done:
+                    done.append(row)
+                    yield handlers.ndjson_line(row)
+            yield handlers.ndjson_line(handlers.batch_summary(done))
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(rows(), media_type="application/x-ndjson")
+
+
+async def chatbot(request):
+    body = await get_json(request)
+    stream = handlers.wants_stream(body, request.headers.get("accept"))
+    return await respond(handlers.chatbot(body, stream=stream))
+
+
+async def gov_schemes(request):
+    body = await get_json(request)
+    if job_requested(request):
+        return queue_job("gov-schemes", body)
+    return await respond(handlers.gov_schemes(body))
+
+
+async def weather_crop_advisory(request):
+    body = await get_json(request)
+    if job_requested(request):
+        return queue_job("weather-crop-advisory", body)
+    return await respond(handlers.weather_crop_advisory(body))
+
+
+async def market_prices(request):
+    body = await get_json(request)
+    if job_requested(request):
+        return queue_job("market-prices", body)
+    return await respond(handlers.market_prices(body))
+
+
+async def nearby_stores(request):
+    body = await get_json(request)
+    if job_requested(request):
+        return queue_job("nearby-stores", body)
+    return await respond(handlers.nearby_stores(body))
+
+
+async def job_status(request):
+    job_id = request.path_params["job_id"]
+    job = await jobs.wait_async(job_id, jobs.wait_seconds(request.query_params.get("wait")))
+    body, status = jobs.response(job_id, job)
+    return JSONResponse(body, status_code=status)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    health.start()
+    warmer.start()
+    yield
+    await async_upstream.aclose()
+
+
+routes = [
+    Route("/", health_check, methods=["GET"]),
+    Route("/metrics", prometheus_metrics, methods=["GET"]),
+    Route("/healthz", liveness, methods=["GET"]),
+    Route("/readyz", readiness, methods=["GET"]),
+    Route("/cache-stats", cache_stats, methods=["GET"]),
+    Route("/upstream-stats", upstream_stats, methods=["GET"]),
+    Route("/test-api-keys", test_api_keys, methods=["GET"]),
+    Route("/detect-disease", detect_disease, methods=["POST"]),
+    Route("/detect-disease/batch", detect_disease_batch, methods=["POST"]),
+    Route("/chatbot", chatbot, methods=["POST"]),
+    Route("/gov-schemes", gov_schemes, methods=["POST"]),
+    Route("/weather-crop-advisory", weather_crop_advisory, methods=["POST"]),
+    Route("/market-prices", market_prices, methods=["POST"]),
+    Route("/nearby-stores", nearby_stores, methods=["POST"]),
+    Route("/jobs/{job_id}", job_status, methods=["GET"]),
+]
+
+app = Starlette(
+    routes=routes,
+    middleware=[
+        Middleware(MetricsMiddleware, routes=routes),
+        Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]),
+    ],
+    lifespan=lifespan,
+)
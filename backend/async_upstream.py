@@ -0,0 +1,179 @@
+"""
+Non-blocking counterpart of upstream.py for the ASGI server.
+
+A single ``httpx.AsyncClient`` per process keeps a keep-alive pool for every
+upstream host, so hundreds of slow Gemini calls can be in flight at once
+without holding a thread each.
+"""
+import asyncio
+import json
+import os
+import time
+
+import httpx
+import requests
+
+import governor
+import metrics
+import upstream
+from singleflight import AsyncGroup
+
+MAX_CONNECTIONS = int(os.getenv("ASYNC_UPSTREAM_MAX_CONNECTIONS", "500"))
+
+_client = None
+flights = AsyncGroup()
+
+
+class _ErrorResponse:
+    """Minimal response attached to ``requests.HTTPError`` so handlers can
+    read ``status_code`` and ``text`` regardless of the client in use."""
+
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=upstream.POOL_SIZE,
+            ),
+            transport=httpx.AsyncHTTPTransport(retries=upstream.RETRIES),
+        )
+    return _client
+
+
+async def execute(call):
+    """Async version of ``upstream.execute``."""
+    if isinstance(call, upstream.Blocking):
+        return await asyncio.to_thread(call.fn, *call.args)
+    if isinstance(call, upstream.Race):
+        return await race(call.calls)
+    if upstream.SINGLE_FLIGHT:
+        return await flights.do(call.key(), lambda: _send(call))
+    return await _send(call)
+
+
+async def admit(call):
+    """Async version of ``upstream.admit``."""
+    admission = upstream.Admission(call)
+    try:
+        admission.ticket = await governor.admit_async(call)
+    except BaseException as exc:
+        admission.finish(exc)
+        raise
+    return admission
+
+
+async def _send(call):
+    admission = await admit(call)
+    try:
+        result = await _send_admitted(call)
+    except BaseException as exc:
+        admission.finish(exc)
+        raise
+    admission.finish()
+    return result
+
+
+async def _send_admitted(call):
+    timeout = httpx.Timeout(upstream.read_timeout(call.timeout), connect=upstream.CONNECT_TIMEOUT)
+    for attempt in range(upstream.RETRIES + 1):
+        started = time.perf_counter()
+        try:
+            response = await get_client().request(
+                call.method,
+                call.url,
+                params=call.params,
+                headers=call.send_headers(),
+                json=call.json,
+                content=_stream_body(call.body) if call.body is not None else None,
+                timeout=timeout,
+            )
+        except httpx.HTTPError:
+            metrics.record_upstream(call.url, "error", time.perf_counter() - started)
+            raise
+        metrics.record_upstream(call.url, response.status_code, time.perf_counter() - started, response.request.headers)
+        if response.status_code in upstream.RETRY_STATUSES and attempt < upstream.RETRIES:
+            await asyncio.sleep(upstream.RETRY_BACKOFF * (2 ** attempt))
+            continue
+        break
+
+    if response.status_code >= 400:
+        raise requests.HTTPError(
+            f"{response.status_code} Error for url: {response.url}",
+            response=_ErrorResponse(response.status_code, response.text),
+        )
+    return response.json()
+
+
+async def _stream_body(body):
+    """Iterate a streamed request body with the file reads off the event loop."""
+    chunks = iter(body)
+    while True:
+        chunk = await asyncio.to_thread(next, chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+async def race(calls):
+    """Async version of ``upstream.Race``; losing calls are cancelled."""
+    tasks = [asyncio.ensure_future(execute(call)) for call in calls]
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in sorted(done, key=tasks.index):
+                if task.exception() is None:
+                    return tasks.index(task), task.result()
+        raise tasks[0].exception()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def stream_events(call, admission=None):
+    """Async version of ``upstream.stream_events``."""
+    if admission is None:
+        admission = await admit(call)
+    try:
+        async for event in _stream_admitted(call):
+            yield event
+    except BaseException as exc:
+        admission.finish(exc)
+        raise
+    admission.finish()
+
+
+async def _stream_admitted(call):
+    timeout = httpx.Timeout(upstream.read_timeout(call.timeout), connect=upstream.CONNECT_TIMEOUT)
+    started = time.perf_counter()
+    async with get_client().stream(
+        call.method,
+        call.url,
+        params=call.params,
+        headers=call.headers,
+        json=call.json,
+        timeout=timeout,
+    ) as response:
+        metrics.record_upstream(call.url, response.status_code, time.perf_counter() - started, response.request.headers)
+        if response.status_code >= 400:
+            text = (await response.aread()).decode("utf-8", "replace")
+            raise requests.HTTPError(
+                f"{response.status_code} Error for url: {response.url}",
+                response=_ErrorResponse(response.status_code, text),
+            )
+        async for line in response.aiter_lines():
+            if line.startswith("data:"):
+                yield json.loads(line[5:])
+
+
+async def aclose():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
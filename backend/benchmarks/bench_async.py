@@ -0,0 +1,127 @@
+"""
+Concurrency benchmark: sync Flask worker vs. ASGI worker.
+
+Starts the fake Gemini server, then serves the backend once with
+``gunicorn app:app --workers 1`` (as in render.yaml) and once with
+``uvicorn asgi_app:app``, firing the same burst of concurrent /chatbot
+requests at each. Run from the backend directory::
+
+    python benchmarks/bench_async.py --requests 200 --latency 0.5
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from fake_upstream import FakeUpstream
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Files the backend persists; benchmark servers write them to a scratch directory
+# so fake-upstream answers never land in data/ and every run starts empty.
+STATE_PATHS = {
+    "PRICE_STORE_PATH": "prices.sqlite3",
+    "SCHEME_INDEX_PATH": "scheme_index.json",
+    "STORE_REGISTRY_PATH": "stores.json",
+    "JOB_STORE_PATH": "jobs.sqlite3",
+    "WARM_STATE_PATH": "warm_keys.json",
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def scratch_env(**settings):
+    """``os.environ`` plus ``settings`` with every persisted path in a new
+    temporary directory; returns ``(env, directory)``. Remove the directory
+    with ``shutil.rmtree`` when the benchmark is done."""
+    directory = tempfile.mkdtemp(prefix="krishi-bench-")
+    paths = {name: os.path.join(directory, filename) for name, filename in STATE_PATHS.items()}
+    return dict(os.environ, **settings, **paths), directory
+
+
+def start_server(name, port, env):
+    if name == "asgi":
+        cmd = ["uvicorn", "asgi_app:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+    else:
+        cmd = ["gunicorn", "app:app", "--workers", "1", "--timeout", "180", "--bind", f"127.0.0.1:{port}"]
+    proc = subprocess.Popen(cmd, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            requests.get(url + "/", timeout=1)
+            return proc, url
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"{name} server did not start")
+
+
+def burst(url, total, concurrency):
+    def one(i):
+        start = time.perf_counter()
+        response = requests.post(
+            url + "/chatbot",
+            json={"message": f"How do I treat leaf spots? #{i}"},
+            timeout=600,
+        )
+        return time.perf_counter() - start, response.status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(total)))
+    wall = time.perf_counter() - start
+
+    latencies = sorted(latency for latency, _ in results)
+    return {
+        "requests": total,
+        "ok": sum(1 for _, status in results if status == 200),
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(total / wall, 2),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync vs. ASGI concurrency benchmark")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.5, help="fake Gemini latency in seconds")
+    parser.add_argument("--servers", default="flask-sync,asgi")
+    args = parser.parse_args()
+
+    fake = FakeUpstream(latency=args.latency).start()
+    env, state_dir = scratch_env(
+        GEMINI_API_KEY="fake", GEMINI_URL=fake.gemini_url, WEATHER_FORECAST_URL=fake.weather_url
+    )
+
+    report = {"latency_s": args.latency, "results": {}}
+    try:
+        for name in args.servers.split(","):
+            proc, url = start_server(name, free_port(), env)
+            try:
+                report["results"][name] = burst(url, args.requests, args.concurrency)
+            finally:
+                proc.terminate()
+                proc.wait()
+            print(f"{name:>10}: {report['results'][name]}", file=sys.stderr)
+    finally:
+        fake.shutdown()
+        shutil.rmtree(state_dir, ignore_errors=True)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
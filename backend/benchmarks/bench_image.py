@@ -0,0 +1,91 @@
+"""
+Benchmark for the upload preprocessing in imaging.py.
+
+Runs the bundled sample JPEGs plus synthetic phone-sized photos through
+``imaging.preprocess`` and reports bytes before/after, base64 payload size
+and time per image. Run from the backend directory::
+
+    python benchmarks/bench_image.py --max-edge 1024 --quality 85
+"""
+import argparse
+import glob
+import io
+import json
+import os
+import statistics
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import imaging  # noqa: E402
+
+SYNTHETIC_SIZES = [(4000, 3000), (4032, 3024), (3000, 4000)]
+
+
+def synthetic_photo(width, height, quality=95):
+    """Textured JPEG roughly the size of a phone camera shot, with EXIF."""
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(width * height)
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([
+        120 + 60 * np.sin(x / 37.0),
+        150 + 50 * np.cos(y / 53.0),
+        80 + 40 * np.sin((x + y) / 71.0),
+    ], axis=-1)
+    noise = rng.normal(0, 18, size=(height, width, 3))
+    pixels = np.clip(base + noise, 0, 255).astype("uint8")
+    img = Image.fromarray(pixels, "RGB")
+    exif = Image.Exif()
+    exif[0x0112] = 1  # orientation
+    exif[0x010F] = "BenchCam"  # make
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=quality, exif=exif)
+    return out.getvalue()
+
+
+def measure(name, data, repeat, max_edge, quality):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out, _, stats = imaging.preprocess(data, "image/jpeg", max_edge=max_edge, quality=quality)
+        timings.append(time.perf_counter() - start)
+    b64_in = (len(data) + 2) // 3 * 4
+    b64_out = (len(out) + 2) // 3 * 4
+    return {
+        "image": name,
+        "bytes_in": stats["bytes_in"],
+        "bytes_out": stats["bytes_out"],
+        "bytes_saved": stats["bytes_saved"],
+        "b64_payload_in": b64_in,
+        "b64_payload_out": b64_out,
+        "ms_median": round(statistics.median(timings) * 1000, 2),
+        "ms_max": round(max(timings) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Image preprocessing benchmark")
+    parser.add_argument("--max-edge", type=int, default=imaging.MAX_EDGE)
+    parser.add_argument("--quality", type=int, default=imaging.JPEG_QUALITY)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--no-synthetic", action="store_true")
+    args = parser.parse_args()
+
+    samples = [(os.path.basename(path), open(path, "rb").read())
+               for path in sorted(glob.glob(os.path.join(BACKEND_DIR, "*.jpg")))]
+    if not args.no_synthetic:
+        samples += [(f"synthetic_{w}x{h}.jpg", synthetic_photo(w, h)) for w, h in SYNTHETIC_SIZES]
+
+    results = [measure(name, data, args.repeat, args.max_edge, args.quality) for name, data in samples]
+    for row in results:
+        print(f"{row['image']:>28}: {row['bytes_in']:>9} -> {row['bytes_out']:>8} bytes "
+              f"in {row['ms_median']:>7} ms", file=sys.stderr)
+    print(json.dumps({"max_edge": args.max_edge, "quality": args.quality, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+Load-test suite covering every route against the local fake upstream.
+
+Each scenario starts a fresh backend process (gunicorn as in render.yaml,
+or uvicorn with ``--server asgi``) pointed at ``fake_upstream.py``, fires
+``--requests`` requests at ``--concurrency`` and records throughput,
+p50/p95/p99 latency, peak RSS of the serving process and upstream calls.
+Request inputs are derived from ``--seed`` so runs are repeatable; with
+``--distinct N`` only N different inputs are cycled, so caches get hits.
+
+The report is JSON (``--output`` writes it to a file). Passing a previous
+report with ``--baseline`` compares against it and exits non-zero when a
+scenario's p95 or throughput regressed by more than ``--tolerance``::
+
+    python benchmarks/bench_suite.py --output before.json
+    python benchmarks/bench_suite.py --baseline before.json --tolerance 0.2
+"""
+import argparse
+import glob
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from bench_async import BACKEND_DIR, free_port, scratch_env, start_server
+from bench_upload_memory import peak_rss_mb
+from fake_upstream import FakeUpstream
+
+CITIES = ["Pune", "Nashik", "Nagpur", "Ludhiana", "Amritsar", "Indore", "Bhopal", "Guntur", "Mysuru", "Patna"]
+STATES = ["Maharashtra", "Punjab", "Madhya Pradesh", "Andhra Pradesh", "Karnataka", "Bihar", "All States"]
+COMMODITIES = ["tomato", "onion", "potato", "wheat", "rice", "cotton", "soybean", ""]
+
+
+def sample_images():
+    images = []
+    for path in sorted(glob.glob(os.path.join(BACKEND_DIR, "*.jpg"))):
+        with open(path, "rb") as image_file:
+            images.append((os.path.basename(path), image_file.read()))
+    return images
+
+
+def chat_history(turns):
+    history = []
+    for turn in range(turns):
+        history.append({"role": "user", "content": f"My wheat leaves show yellow stripes in field {turn}. What now?"})
+        history.append({"role": "assistant", "content": "That looks like stripe rust; spray propiconazole early."})
+    return history
+
+
+def scenarios(images):
+    """name -> function(i, rng) returning ``(method, path, requests kwargs)``."""
+    return {
+        "detect-disease": lambda i, rng: (
+            "POST", "/detect-disease",
+            # The trailing tag makes each input a distinct image for the cache.
+            {"files": {"file": (images[i % len(images)][0], images[i % len(images)][1] + i.to_bytes(4, "big"),
+                                "image/jpeg")}},
+        ),
+        "chatbot": lambda i, rng: (
+            "POST", "/chatbot",
+            {"json": {"message": f"Question {i}: when should I irrigate?", "history": chat_history(i % 20)}},
+        ),
+        "gov-schemes": lambda i, rng: (
+            "POST", "/gov-schemes", {"json": {"state": f"{rng.choice(STATES)} {i}", "type": "All Types"}},
+        ),
+        "market-prices": lambda i, rng: (
+            "POST", "/market-prices", {"json": {"location": f"{rng.choice(CITIES)} {i}", "commodity": rng.choice(COMMODITIES)}},
+        ),
+        "nearby-stores": lambda i, rng: (
+            "POST", "/nearby-stores",
+            {"json": {"latitude": round(rng.uniform(8, 35), 4), "longitude": round(rng.uniform(68, 95), 4)}},
+        ),
+        "weather-crop-advisory": lambda i, rng: (
+            "POST", "/weather-crop-advisory", {"json": {"city": f"{rng.choice(CITIES)} {i}", "country": "IN"}},
+        ),
+    }
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+def serving_pids(pid):
+    """The server process and its children (the gunicorn worker)."""
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as children:
+            pids.extend(int(child) for child in children.read().split())
+    except OSError:
+        pass
+    return pids
+
+
+def run_scenario(name, build, args, env, fake):
+    proc, url = start_server(args.server, free_port(), env)
+    calls_before = sum(fake.calls.values())
+    rng = random.Random(f"{args.seed}:{name}")
+    inputs = [build(i, rng) for i in range(min(args.distinct or args.requests, args.requests))]
+    plan = [inputs[i % len(inputs)] for i in range(args.requests)]
+
+    def one(request_spec):
+        method, path, kwargs = request_spec
+        start = time.perf_counter()
+        try:
+            status = requests.request(method, url + path, timeout=600, **kwargs).status_code
+        except requests.RequestException:
+            status = None
+        return time.perf_counter() - start, status
+
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(one, plan))
+        wall = time.perf_counter() - start
+        peak = max(peak_rss_mb(pid) for pid in serving_pids(proc.pid))
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    latencies = sorted(latency for latency, _ in results)
+    return {
+        "requests": len(results),
+        "ok": sum(1 for _, status in results if status == 200),
+        "errors": sum(1 for _, status in results if status != 200),
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(len(results) / wall, 2),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "peak_rss_mb": round(peak, 1),
+        "upstream_calls": sum(fake.calls.values()) - calls_before,
+    }
+
+
+def compare(report, baseline, tolerance):
+    """Return the regressions of ``report`` against ``baseline``."""
+    regressions = []
+    for name, result in report["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        if result["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {before['p95_ms']} -> {result['p95_ms']} ms")
+        if result["throughput_rps"] < before["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {before['throughput_rps']} -> {result['throughput_rps']} rps")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test suite against the fake upstream")
+    parser.add_argument("--server", choices=["flask-sync", "asgi"], default="flask-sync")
+    parser.add_argument("--scenarios", default="all", help="comma-separated scenario names")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--distinct", type=int, default=0, help="distinct inputs per scenario (0 = all)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.2, help="fake upstream latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--padding", type=int, default=0, help="extra bytes in each Gemini reply")
+    parser.add_argument("--max-concurrent", type=int, default=0,
+                        help="fake Gemini answers 429 beyond this many calls in flight (0 = no quota)")
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--baseline", help="previous report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    fake = FakeUpstream(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                        padding=args.padding, max_concurrent=args.max_concurrent).start()
+    env, state_dir = scratch_env(
+        GEMINI_API_KEY="fake",
+        WEATHER_API_KEY="fake",
+        GEMINI_URL=fake.gemini_url,
+        WEATHER_FORECAST_URL=fake.weather_url,
+    )
+
+    available = scenarios(sample_images())
+    names = list(available) if args.scenarios == "all" else args.scenarios.split(",")
+    report = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        "scenarios": {},
+    }
+    try:
+        for name in names:
+            report["scenarios"][name] = run_scenario(name, available[name], args, env, fake)
+            print(f"{name:>22}: {report['scenarios'][name]}", file=sys.stderr)
+    finally:
+        fake.shutdown()
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as report_file:
+            report_file.write(output + "\n")
+    print(output)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(report, json.load(baseline_file), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
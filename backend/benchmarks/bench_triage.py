@@ -0,0 +1,157 @@
+"""
+Benchmark for the /detect-disease triage stage in triage.py.
+
+Builds a sample set of synthetic leaf photos (healthy, leaf blight with
+brown lesions, powdery mildew with white patches, lightly spotted leaves
+that should stay uncertain) plus unusable shots (blurred, dark, no plant)
+and the bundled sample JPEGs. A model is trained on one half of the
+synthetic leaves and evaluated on the other. Reports triage time per image,
+single and batched, and the fraction of requests that would skip Gemini.
+Run from the backend directory::
+
+    python benchmarks/bench_triage.py --per-class 40
+"""
+import argparse
+import glob
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import triage  # noqa: E402
+
+CURES = {
+    "Leaf Blight": "Remove infected leaves and apply a copper-based fungicide.",
+    "Powdery Mildew": "Spray wettable sulphur or potassium bicarbonate and improve air circulation.",
+}
+
+
+def synthetic_leaf(rng, kind, size=640):
+    """JPEG of a textured leaf on soil; ``kind`` decides the lesions."""
+    import numpy as np
+    from PIL import Image, ImageFilter
+
+    y, x = np.mgrid[0:size, 0:size] / size
+    soil = np.stack([0.45 + 0.05 * rng.random((size, size)), 0.35 + 0.05 * rng.random((size, size)),
+                     0.25 + 0.05 * rng.random((size, size))], axis=-1)
+    cx, cy = 0.5 + rng.uniform(-0.05, 0.05), 0.5 + rng.uniform(-0.05, 0.05)
+    leaf = ((x - cx) / rng.uniform(0.35, 0.45)) ** 2 + ((y - cy) / rng.uniform(0.25, 0.35)) ** 2 < 1
+    veins = (np.abs(np.sin((x - cx) * 40 + (y - cy) * 10)) < 0.08) | (np.abs(y - cy) < 0.006)
+    tone = rng.uniform(0.9, 1.1)
+    green = np.stack([0.18 * tone, 0.48 * tone, 0.12 * tone], axis=-1) + 0.05 * rng.random((size, size, 3))
+    green[veins] += 0.12
+    pixels = np.where(leaf[..., None], green, soil)
+
+    spots = {"healthy": 0, "Leaf Blight": rng.integers(12, 20), "Powdery Mildew": rng.integers(15, 25),
+             "uncertain": rng.integers(2, 4)}[kind]
+    for _ in range(spots):
+        sx, sy, radius = rng.uniform(0.2, 0.8), rng.uniform(0.3, 0.7), rng.uniform(0.02, 0.06)
+        spot = leaf & ((x - sx) ** 2 + (y - sy) ** 2 < radius ** 2)
+        if kind == "Powdery Mildew":
+            pixels[spot] = 0.8 + 0.1 * rng.random((int(spot.sum()), 3))
+        else:
+            pixels[spot] = [0.5, 0.32, 0.1] + 0.05 * rng.random((int(spot.sum()), 3))
+    img = Image.fromarray((np.clip(pixels, 0, 1) * 255).astype("uint8"), "RGB").filter(ImageFilter.GaussianBlur(0.6))
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=88)
+    return out.getvalue()
+
+
+def degraded(data, how, rng):
+    import numpy as np
+    from PIL import Image, ImageEnhance, ImageFilter
+
+    img = Image.open(io.BytesIO(data)).convert("RGB")
+    if how == "blurred":
+        img = img.filter(ImageFilter.GaussianBlur(rng.uniform(6, 10)))
+    elif how == "dark":
+        img = ImageEnhance.Brightness(img).enhance(rng.uniform(0.05, 0.12))
+    else:
+        # No plant: a grey wall, sky or sand gradient with noise.
+        base = np.array([(0.55, 0.55, 0.55), (0.45, 0.6, 0.8), (0.8, 0.72, 0.55)][int(rng.integers(3))])
+        gradient = np.linspace(0, 0.2, img.size[1])[:, None, None]
+        pixels = base + gradient + 0.08 * rng.random((img.size[1], img.size[0], 3))
+        img = Image.fromarray((np.clip(pixels, 0, 1) * 255).astype("uint8"), "RGB")
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=88)
+    return out.getvalue()
+
+
+def sample_set(per_class, seed):
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    leaves = [(kind, synthetic_leaf(rng, kind)) for kind in ("healthy", "Leaf Blight", "Powdery Mildew", "uncertain")
+              for _ in range(per_class)]
+    unusable = [(f"unusable:{how}", degraded(leaves[int(rng.integers(len(leaves)))][1], how, rng))
+                for how in ("blurred", "dark", "no-plant") for _ in range(per_class // 2)]
+    bundled = [(f"bundled:{os.path.basename(path)}", open(path, "rb").read())
+               for path in sorted(glob.glob(os.path.join(BACKEND_DIR, "*.jpg")))]
+    return leaves, unusable, bundled
+
+
+def timed(images, batch):
+    timings = []
+    for start in range(0, len(images), batch):
+        chunk = images[start:start + batch]
+        began = time.perf_counter()
+        triage.classify_batch(chunk)
+        timings.append((time.perf_counter() - began) / len(chunk))
+    return round(statistics.median(timings) * 1000, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Triage latency and Gemini skip-rate benchmark")
+    parser.add_argument("--per-class", type=int, default=40)
+    parser.add_argument("--batch", type=int, default=8)
+    parser.add_argument("--confidence", type=float, default=triage.CONFIDENCE)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    leaves, unusable, bundled = sample_set(args.per_class, args.seed)
+    train_set = [(kind, data) for position, (kind, data) in enumerate(leaves)
+                 if position % 2 == 0 and kind != "uncertain"]
+    test_set = [item for position, item in enumerate(leaves) if position % 2 == 1] + unusable + bundled
+
+    trained, report = triage.train(train_set, CURES)
+    with tempfile.TemporaryDirectory() as folder:
+        triage.MODEL_PATH = os.path.join(folder, "triage_model.npz")
+        trained.save(triage.MODEL_PATH)
+        triage.CONFIDENCE = args.confidence
+        triage._model_loaded = False
+        triage.model()
+
+    images = [data for _, data in test_set]
+    verdicts = triage.classify_batch(images)
+    rows = {}
+    for (kind, _), verdict in zip(test_set, verdicts):
+        group = kind.split(":")[0] if ":" in kind else kind
+        row = rows.setdefault(group, {"images": 0, "rejected": 0, "local": 0, "escalate": 0, "correct_local": 0})
+        row["images"] += 1
+        row[verdict["verdict"]] += 1
+        row["correct_local"] += verdict["verdict"] == "local" and verdict["label"] == kind
+    skipped = sum(verdict["verdict"] != "escalate" for verdict in verdicts)
+
+    result = {
+        "train": report,
+        "confidence": args.confidence,
+        "test_images": len(images),
+        "skip_gemini_fraction": round(skipped / len(images), 3),
+        "by_group": rows,
+        "ms_per_image_single": timed(images, 1),
+        f"ms_per_image_batch_{args.batch}": timed(images, args.batch),
+    }
+    for group, row in rows.items():
+        print(f"{group:>16}: {row['images']:>3} images, {row['rejected']:>3} rejected, {row['local']:>3} local "
+              f"({row['correct_local']} correct), {row['escalate']:>3} to Gemini", file=sys.stderr)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Memory benchmark for /detect-disease uploads.
+
+Serves the Flask app in a child process once with ``UPLOAD_STREAMING=0``
+(upload read into memory, base64 string and ``json=`` body built in full) and
+once with ``UPLOAD_STREAMING=1`` (spooled upload, chunked base64 request
+body), sends a burst of concurrent large uploads to each and reports the
+child's peak RSS (``VmHWM``, so Linux only). Image preprocessing is off by
+default so the upload path itself is measured. Run from the backend
+directory::
+
+    python benchmarks/bench_upload_memory.py --concurrency 8 --megapixels 24
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from bench_async import BACKEND_DIR, free_port, scratch_env
+from bench_image import synthetic_photo
+from fake_upstream import FakeUpstream
+
+MODES = {"read": "0", "stream": "1"}
+
+
+def serve(port):
+    sys.path.insert(0, BACKEND_DIR)
+    from werkzeug.serving import make_server
+
+    import app
+
+    make_server("127.0.0.1", port, app.app, threaded=True).serve_forever()
+
+
+def peak_rss_mb(pid):
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    raise RuntimeError("VmHWM not available")
+
+
+def start_server(mode, port, env):
+    env = dict(env, UPLOAD_STREAMING=MODES[mode])
+    proc = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", str(port)],
+        cwd=BACKEND_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            requests.get(url + "/", timeout=1)
+            return proc, url
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"{mode} server did not start")
+
+
+def upload(url, photo, tag):
+    # A distinct trailing byte per upload keeps the result cache and
+    # single-flight from collapsing the burst into one call.
+    data = photo + tag.to_bytes(4, "big")
+    response = requests.post(
+        url + "/detect-disease", files={"file": ("photo.jpg", data, "image/jpeg")}, timeout=600
+    )
+    return response.status_code
+
+
+def burst(mode, env, photo, concurrency):
+    proc, url = start_server(mode, free_port(), env)
+    try:
+        upload(url, photo[: len(photo) // 64], 0)
+        baseline = peak_rss_mb(proc.pid)
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            statuses = list(pool.map(lambda i: upload(url, photo, i + 1), range(concurrency)))
+        peak = peak_rss_mb(proc.pid)
+    finally:
+        proc.terminate()
+        proc.wait()
+    return {
+        "uploads": concurrency,
+        "ok": statuses.count(200),
+        "baseline_rss_mb": round(baseline, 1),
+        "peak_rss_mb": round(peak, 1),
+        "per_upload_mb": round((peak - baseline) / concurrency, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upload memory benchmark (read vs. stream)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--megapixels", type=float, default=24, help="size of the synthetic upload")
+    parser.add_argument("--latency", type=float, default=1.0, help="fake Gemini latency in seconds")
+    parser.add_argument("--preprocess", action="store_true", help="keep IMAGE_PREPROCESS on")
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve)
+        return
+
+    width = int((args.megapixels * 1e6 * 4 / 3) ** 0.5)
+    photo = synthetic_photo(width, width * 3 // 4)
+    fake = FakeUpstream(latency=args.latency).start()
+    env, state_dir = scratch_env(
+        GEMINI_API_KEY="fake",
+        GEMINI_URL=fake.gemini_url,
+        IMAGE_PREPROCESS="1" if args.preprocess else "0",
+        UPLOAD_MAX_BYTES=str(len(photo) * 2),
+    )
+
+    report = {"upload_mb": round(len(photo) / 1024 / 1024, 2), "preprocess": args.preprocess, "results": {}}
+    try:
+        for mode in MODES:
+            report["results"][mode] = burst(mode, env, photo, args.concurrency)
+            print(f"{mode:>7}: {report['results'][mode]}", file=sys.stderr)
+    finally:
+        fake.shutdown()
+        shutil.rmtree(state_dir, ignore_errors=True)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+"""
+Local stand-in for the Gemini and WeatherAPI endpoints used by the backend.
+
+Point the backend at it with::
+
+    GEMINI_URL=http://127.0.0.1:9100/v1beta/models/fake:generateContent
+    WEATHER_FORECAST_URL=http://127.0.0.1:9100/v1/forecast.json
+
+Responses are shaped after the prompt so every route gets JSON it can parse.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+CANNED = [
+    ("crop image", {"disease": "Leaf Blight", "cure": "Remove infected leaves and apply copper fungicide.", "confidence": "high"}),
+    ("government schemes", {"state": "All States", "type": "All Types", "schemes": [
+        {"name": "PM-KISAN", "state": "All States", "type": "Income Support", "summary": "Rs 6000 per year.",
+         "eligibility": "Small and marginal farmers", "benefits": ["Rs 6000/year"],
+         "how_to_apply": "pmkisan.gov.in", "official_links": ["https://pmkisan.gov.in"]},
+    ]}),
+    ("market prices", {"location": "India", "date": "today", "prices": [
+        {"commodity": "Tomato", "variety": "Local", "unit": "quintal", "min_price": 1200, "max_price": 1800,
+         "modal_price": 1500, "market": "Azadpur", "trend": "stable"},
+    ], "source": "fake", "last_updated": "today"}),
+    ("agricultural stores", {"stores": [
+        {"name": "Kisan Seva Kendra", "distance": "1.2 km", "address": "Main Road", "rating": 4.2, "is_open": True,
+         "phone": "+91 9000000000", "latitude": 28.61, "longitude": 77.21},
+    ], "location": "fake", "total_stores": 1}),
+    ("weather forecast", {"weather_summary": "Warm and dry.", "recommended_crops": [
+        {"crop": "Millet", "reason": "Tolerates heat", "suitability": "high"},
+    ], "farm_actions": ["Irrigate in the evening"], "risk_alerts": [], "other_suggestions": []}),
+]
+
+
+def forecast(query=None, days=5):
+    location = {"name": "Pune", "region": "Maharashtra", "country": "India", "lat": 18.52, "lon": 73.86}
+    if query and query.split(",")[0].strip().lower() != "pune":
+        # Spread other places over India deterministically, one grid cell each.
+        seed = zlib.crc32(query.split(",")[0].strip().lower().encode())
+        location = {"name": query.split(",")[0].strip().title(), "region": "", "country": "India",
+                    "lat": round(8 + seed % 2800 / 100, 2), "lon": round(68 + seed // 2800 % 2700 / 100, 2)}
+    return {
+        "location": location,
+        "forecast": {"forecastday": [
+            {"date": f"2026-01-0{i + 1}", "day": {
+                "mintemp_c": 18.0, "maxtemp_c": 31.0, "avghumidity": 55.0, "totalprecip_mm": 0.0,
+                "condition": {"text": "Sunny"},
+            }} for i in range(days)
+        ]},
+    }
+
+
+def gemini_reply(payload, padding=0):
+    prompt = " ".join(
+        part.get("text", "")
+        for content in [payload.get("systemInstruction") or {}, *payload.get("contents", [])]
+        for part in content.get("parts", [])
+    ).lower()
+    images = sum(
+        1
+        for content in payload.get("contents", [])
+        for part in content.get("parts", [])
+        if "inline_data" in part
+    )
+    text = "Water the field early in the morning and check leaves for spots."
+    for keyword, body in CANNED:
+        if keyword in prompt:
+            state = re.search(r"run by the state of ([a-z ]+),", prompt)
+            if state:
+                # Scheme-index crawl of one state: answer with a scheme of that state.
+                name = state.group(1).title()
+                body = {"schemes": [{**body["schemes"][0], "name": f"{name} Krishi Bima", "state": name,
+                                     "type": "Crop Insurance", "eligibility": "Tenant and small farmers"}]}
+            point = re.search(r"latitude: (-?[\d.]+), longitude: (-?[\d.]+)", prompt)
+            if point:
+                # Store search: a few stores around the requested point.
+                lat, lon = float(point.group(1)), float(point.group(2))
+                body = {**body, "stores": [
+                    {**body["stores"][0], "name": f"Kisan Seva Kendra {n}",
+                     "latitude": round(lat + 0.01 * n, 4), "longitude": round(lon - 0.01 * n, 4)}
+                    for n in range(1, 4)
+                ], "total_stores": 3}
+            if images > 1:
+                body = [{"image": number, **body} for number in range(1, images + 1)]
+            text = json.dumps(body)
+            break
+    if padding:
+        text += " " * padding
+    return {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"}}]}
+
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _delay_or_fail(self):
+        server = self.server
+        server.count(self.path)
+        if server.latency:
+            time.sleep(server.latency * random.uniform(1 - server.jitter, 1 + server.jitter))
+        if server.error_rate and random.random() < server.error_rate:
+            self._send(503, {"error": {"code": 503, "message": "fake upstream error"}})
+            return True
+        return False
+
+    def do_GET(self):
+        if self._delay_or_fail():
+            return
+        if urlsplit(self.path).path.endswith("forecast.json"):
+            self._send(200, forecast(parse_qs(urlsplit(self.path).query).get("q", [None])[0]))
+        elif "/models/" in urlsplit(self.path).path:
+            # models.get, used by the health probes.
+            self._send(200, {"name": "models/" + urlsplit(self.path).path.rsplit("/models/", 1)[1]})
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        if urlsplit(self.path).path.endswith("/cachedContents"):
+            if not self._delay_or_fail():
+                self._send(*self.server.create_cache(payload))
+            return
+        if not self.server.enter():
+            self.server.count(self.path)
+            self._send(429, {"error": {"code": 429, "message": "Resource has been exhausted (fake quota)"}})
+            return
+        try:
+            self._answer(payload)
+        finally:
+            self.server.leave()
+
+    def do_PATCH(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        if not self._delay_or_fail():
+            name = urlsplit(self.path).path.split("/v1beta/", 1)[-1]
+            self._send(*self.server.renew_cache(name, payload))
+
+    def _answer(self, payload):
+        if self._delay_or_fail():
+            return
+        if "cachedContent" in payload:
+            if "systemInstruction" in payload or "tools" in payload:
+                self._send(400, {"error": {"code": 400, "message": "CachedContent can not be used with "
+                                                                   "system_instruction, tools or tool_config"}})
+                return
+            cached = self.server.cached(payload["cachedContent"])
+            if cached is None:
+                self._send(404, {"error": {"code": 404, "message": "CachedContent not found"}})
+                return
+            payload = {**cached, **payload}
+        rejected = [name for tool in payload.get("tools", []) for name in tool if name in self.server.rejected_tools]
+        if rejected:
+            self._send(400, {"error": {"code": 400, "message": f"{rejected[0]} is not supported"}})
+        elif ":generateContent" in self.path:
+            self._send(200, gemini_reply(payload, self.server.padding))
+        elif ":streamGenerateContent" in self.path:
+            self._stream(gemini_reply(payload, self.server.padding))
+        else:
+            self._send(404, {"error": "not found"})
+
+    def _stream(self, reply, chunks=4):
+        """Send ``reply`` as SSE chunks, the way ``alt=sse`` streaming does."""
+        text = reply["candidates"][0]["content"]["parts"][0]["text"]
+        step = max(1, -(-len(text) // chunks))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for start in range(0, len(text), step):
+            chunk = {"candidates": [{"content": {"parts": [{"text": text[start:start + step]}], "role": "model"}}]}
+            data = f"data: {json.dumps(chunk)}\r\n\r\n".encode()
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+            if self.server.stream_interval:
+                time.sleep(self.server.stream_interval)
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class FakeUpstream(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, error_rate=0.0, padding=0,
+                 stream_interval=0.0, rejected_tools=(), max_concurrent=0, cache_min_tokens=0):
+        super().__init__((host, port), FakeUpstreamHandler)
+        # cachedContents stand-in: name -> (content, expiry); smaller prompts are refused.
+        self.cache_min_tokens = cache_min_tokens
+        self.caches = {}
+        self.cache_serial = 0
+        self.cache_hits = 0
+        # Above this many concurrent POSTs, answer 429 like an exhausted quota.
+        self.max_concurrent = max_concurrent
+        self.in_flight = 0
+        self.throttled = 0
+        self.rejected_tools = set(rejected_tools)
+        self.stream_interval = stream_interval
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.padding = padding
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def count(self, path):
+        key = urlsplit(path).path
+        with self._lock:
+            self.calls[key] = self.calls.get(key, 0) + 1
+
+    def create_cache(self, body):
+        text = json.dumps(body.get("systemInstruction", {})) + json.dumps(body.get("contents", []))
+        if not body.get("model"):
+            return 400, {"error": {"code": 400, "message": "model is required"}}
+        if len(text) // 4 < self.cache_min_tokens:
+            return 400, {"error": {"code": 400, "message": f"Cached content is too small. "
+                                                           f"min_total_token_count={self.cache_min_tokens}"}}
+        rejected = [name for tool in body.get("tools", []) for name in tool if name in self.rejected_tools]
+        if rejected:
+            return 400, {"error": {"code": 400, "message": f"{rejected[0]} is not supported"}}
+        ttl = float(str(body.get("ttl", "3600s")).rstrip("s"))
+        content = {key: body[key] for key in ("systemInstruction", "contents", "tools") if key in body}
+        with self._lock:
+            self.cache_serial += 1
+            name = f"cachedContents/fake{self.cache_serial}"
+            self.caches[name] = (content, time.time() + ttl)
+        return 200, {"name": name, "model": body["model"], "usageMetadata": {"totalTokenCount": len(text) // 4}}
+
+    def renew_cache(self, name, body):
+        with self._lock:
+            entry = self.caches.get(name)
+            if entry is None or entry[1] < time.time():
+                return 404, {"error": {"code": 404, "message": "CachedContent not found"}}
+            self.caches[name] = (entry[0], time.time() + float(str(body.get("ttl", "3600s")).rstrip("s")))
+        return 200, {"name": name}
+
+    def cached(self, name):
+        with self._lock:
+            entry = self.caches.get(name)
+            if entry is None or entry[1] < time.time():
+                return None
+            self.cache_hits += 1
+            return entry[0]
+
+    def enter(self):
+        with self._lock:
+            if self.max_concurrent and self.in_flight >= self.max_concurrent:
+                self.throttled += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def gemini_url(self):
+        return f"{self.base_url}/v1beta/models/fake:generateContent"
+
+    @property
+    def gemini_stream_url(self):
+        return f"{self.base_url}/v1beta/models/fake:streamGenerateContent"
+
+    @property
+    def weather_url(self):
+        return f"{self.base_url}/v1/forecast.json"
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds per upstream call")
+    parser.add_argument("--jitter", type=float, default=0.0, help="relative latency jitter, e.g. 0.2")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with 503")
+    parser.add_argument("--padding", type=int, default=0, help="extra bytes appended to Gemini replies")
+    parser.add_argument("--reject-tool", action="append", default=[],
+                        help="answer 400 to payloads using this tool (e.g. google_search)")
+    parser.add_argument("--max-concurrent", type=int, default=0,
+                        help="answer 429 to POSTs beyond this many in flight (0 = no quota)")
+    parser.add_argument("--cache-min-tokens", type=int, default=0,
+                        help="refuse to cache prompts smaller than this (Gemini's explicit-cache minimum)")
+    parser.add_argument("--stream-interval", type=float, default=0.1, help="seconds between streamed chunks")
+    args = parser.parse_args()
+
+    server = FakeUpstream(port=args.port, latency=args.latency, jitter=args.jitter,
+                          error_rate=args.error_rate, padding=args.padding,
+                          stream_interval=args.stream_interval, rejected_tools=args.reject_tool,
+                          max_concurrent=args.max_concurrent, cache_min_tokens=args.cache_min_tokens)
+    print(f"Fake Gemini:     {server.gemini_url}")
+    print(f"Fake WeatherAPI: {server.weather_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+Response caches for upstream-backed endpoints.
+
+Values are stored as JSON text, so callers always get a fresh copy and the
+in-process backend can bound memory by bytes as well as by entry count.
+Set ``CACHE_REDIS_URL`` to share entries between gunicorn workers.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "2048"))
+MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+REDIS_URL = os.getenv("CACHE_REDIS_URL", "")
+# Decimal places kept when lat/lon are part of a key (2 ~ 1.1 km).
+GEO_PRECISION = int(os.getenv("CACHE_GEO_PRECISION", "2"))
+
+
+class MemoryBackend:
+    """Thread-safe LRU map with per-entry expiry, bounded by entries and by the
+    UTF-8 size of the stored text."""
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, data, _ = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return data
+
+    def set(self, key, data, ttl):
+        size = len(data.encode("utf-8")) if isinstance(data, str) else len(data)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl, data, size)
+            self.size_bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self.size_bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self.size_bytes -= size
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisBackend:
+    """Shared backend; expiry is native and eviction follows the server's
+    ``maxmemory-policy`` (use ``allkeys-lru``)."""
+
+    def __init__(self, url):
+        import redis
+
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        try:
+            data = self._client.get(key)
+        except Exception as exc:
+            logger.warning("Redis cache read failed: %s", exc)
+            return None
+        return data.decode("utf-8") if data is not None else None
+
+    def set(self, key, data, ttl):
+        try:
+            self._client.set(key, data, ex=max(1, int(ttl)))
+        except Exception as exc:
+            logger.warning("Redis cache write failed: %s", exc)
+
+    def delete(self, key):
+        try:
+            self._client.delete(key)
+        except Exception as exc:
+            logger.warning("Redis cache delete failed: %s", exc)
+
+
+def _default_backend():
+    if REDIS_URL:
+        try:
+            return RedisBackend(REDIS_URL)
+        except ImportError:
+            logger.warning("CACHE_REDIS_URL is set but the redis package is missing; using in-process cache")
+    return MemoryBackend()
+
+
+shared_backend = _default_backend()
+
+
+class ResponseCache:
+    """Named cache with a TTL and hit/miss counters.
+
+    Keys are tuples of normalized request fields; a TTL of 0 disables the cache.
+    """
+
+    def __init__(self, name, ttl, backend=None):
+        self.name = name
+        self.ttl = ttl
+        self.backend = shared_backend if backend is None else backend
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, parts):
+        digest = hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        return f"krishi:{self.name}:{digest}"
+
+    def get(self, parts, count=True):
+        if self.ttl <= 0:
+            return None
+        data = self.backend.get(self._key(parts))
+        if count:
+            self.record(data is not None)
+        return json.loads(data) if data is not None else None
+
+    def record(self, hit):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def set(self, parts, value, ttl=None):
+        if self.ttl <= 0:
+            return
+        self.backend.set(self._key(parts), json.dumps(value), ttl or self.ttl)
+
+    def delete(self, parts):
+        self.backend.delete(self._key(parts))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "ttl_s": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+def normalize(value):
+    """Lower-case and collapse whitespace so equivalent inputs share a key."""
+    return " ".join(str(value or "").lower().split())
+
+
+def geo_key(latitude, longitude, precision=GEO_PRECISION):
+    """Round coordinates to a grid cell so nearby requests share a key."""
+    try:
+        return (round(float(latitude), precision), round(float(longitude), precision))
+    except (TypeError, ValueError):
+        return (str(latitude), str(longitude))
+
+
+def ttl_setting(name, default):
+    return float(os.getenv(f"CACHE_TTL_{name.upper().replace('-', '_')}", str(default)))
+
+
+market_prices = ResponseCache("market-prices", ttl_setting("market-prices", 6 * 3600))
+gov_schemes = ResponseCache("gov-schemes", ttl_setting("gov-schemes", 3 * 24 * 3600))
+nearby_stores = ResponseCache("nearby-stores", ttl_setting("nearby-stores", 24 * 3600))
+
+_caches = [market_prices, gov_schemes, nearby_stores]
+
+
+def register(response_cache):
+    _caches.append(response_cache)
+    return response_cache
+
+
+def stats():
+    result = {c.name: c.stats() for c in _caches}
+    backend = shared_backend
+    if isinstance(backend, MemoryBackend):
+        result["_backend"] = {
+            "type": "memory",
+            "entries": len(backend),
+            "size_bytes": backend.size_bytes,
+            "evictions": backend.evictions,
+        }
+    else:
+        result["_backend"] = {"type": "redis"}
+    return result
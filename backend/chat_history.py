@@ -0,0 +1,141 @@
+"""
+History management for /chatbot.
+
+The last ``CHAT_MAX_TURNS`` turns are sent verbatim as long as they fit in
+``CHAT_TOKEN_BUDGET`` (estimated at ~4 characters per token). Older turns are
+folded into a short summary produced by Gemini. Summaries are cached under a
+hash chain of the turns they cover, so the next request in the same session
+finds the summary of its prefix and only needs to fold in the turns that
+scrolled out since. Folding happens in batches of ``CHAT_SUMMARY_BATCH``
+turns; until a batch is full the newly scrolled-out turns stay verbatim.
+"""
+import hashlib
+import logging
+import os
+
+import cache
+
+logger = logging.getLogger(__name__)
+
+MAX_TURNS = int(os.getenv("CHAT_MAX_TURNS", "8"))
+TOKEN_BUDGET = int(os.getenv("CHAT_TOKEN_BUDGET", "2000"))
+SUMMARY_BATCH = int(os.getenv("CHAT_SUMMARY_BATCH", "4"))
+SUMMARY_WORDS = int(os.getenv("CHAT_SUMMARY_WORDS", "120"))
+
+summaries = cache.register(cache.ResponseCache("chat-summary", cache.ttl_setting("chat-summary", 24 * 3600)))
+
+
+def estimate_tokens(text):
+    return (len(text) + 3) // 4
+
+
+def turn_lines(history):
+    """Convert the client-supplied history into ``"Speaker: text"`` lines."""
+    lines = []
+    for item in history:
+        if not isinstance(item, dict):
+            continue
+        role = str(item.get("role") or "user").strip().lower()
+        content = str(item.get("content") or "").strip()
+        if content:
+            speaker = "Farmer" if role == "user" else "Assistant"
+            lines.append(f"{speaker}: {content}")
+    return lines
+
+
+def prefix_hashes(lines):
+    """``hashes[i]`` identifies ``lines[:i + 1]``; each extends the previous one."""
+    hashes = []
+    digest = ""
+    for line in lines:
+        digest = hashlib.sha1(f"{digest}\n{line}".encode("utf-8")).hexdigest()
+        hashes.append(digest)
+    return hashes
+
+
+def summary_payload(previous_summary, lines):
+    prompt = (
+        "Summarize this conversation between a farmer and an agriculture assistant "
+        f"in at most {SUMMARY_WORDS} words. Keep crop names, locations, symptoms, quantities "
+        "and advice already given. Reply with the summary text only."
+    )
+    text = "\n".join(lines)
+    if previous_summary:
+        text = f"Summary so far: {previous_summary}\n\nLater turns:\n{text}"
+    return {
+        "contents": [{"parts": [{"text": prompt}, {"text": text}]}],
+        "generationConfig": {"temperature": 0.1},
+    }
+
+
+def local_summary(previous_summary, lines, width=80):
+    """Fallback when the summary call fails: clip each folded turn."""
+    clipped = [line if len(line) <= width else line[: width - 3] + "..." for line in lines]
+    return " ".join(filter(None, [previous_summary, " | ".join(clipped)]))
+
+
+def split(lines, max_turns=MAX_TURNS, token_budget=TOKEN_BUDGET):
+    """Return the index where verbatim turns start."""
+    start = max(0, len(lines) - max_turns)
+    tokens = sum(estimate_tokens(line) for line in lines[start:])
+    while start < len(lines) - 1 and tokens > token_budget:
+        tokens -= estimate_tokens(lines[start])
+        start += 1
+    return start
+
+
+def build_context(lines, gemini_call):
+    """Handler sub-flow returning ``(context_lines, meta)`` for the prompt.
+
+    Use with ``yield from``; it yields a Gemini call when a new batch of
+    turns has to be folded into the summary.
+    """
+    start = split(lines)
+    hashes = prefix_hashes(lines[:start])
+
+    # Longest already-summarized prefix of the turns that scrolled out.
+    covered, summary = 0, None
+    for i in range(start, 0, -1):
+        found = summaries.get((hashes[i - 1],), count=False)
+        if found is not None:
+            covered, summary = i, found["summary"]
+            break
+    if start:
+        summaries.record(summary is not None)
+
+    summarized_now = False
+    verbatim_tokens = sum(estimate_tokens(line) for line in lines[covered:])
+    if start > covered and (start - covered >= SUMMARY_BATCH or verbatim_tokens > TOKEN_BUDGET):
+        pending = lines[covered:start]
+        try:
+            response_json = yield gemini_call(summary_payload(summary, pending), timeout=30)
+            new_summary = (
+                response_json.get("candidates", [{}])[0]
+                .get("content", {})
+                .get("parts", [{}])[0]
+                .get("text", "")
+                .strip()
+            )
+            if not new_summary:
+                raise ValueError("Empty summary")
+            summaries.set((hashes[start - 1],), {"summary": new_summary})
+            summarized_now = True
+        except Exception as exc:
+            logger.warning("Chat history summary failed: %s", exc)
+            new_summary = local_summary(summary, pending)
+        covered, summary = start, new_summary
+
+    context = lines[covered:]
+    if summary:
+        context = [f"Summary of earlier conversation: {summary}"] + context
+
+    meta = {
+        "turns_received": len(lines),
+        "turns_verbatim": len(lines) - covered,
+        "turns_summarized": covered,
+        "summary_updated": summarized_now,
+        "estimated_tokens": sum(estimate_tokens(line) for line in context),
+        "token_budget": TOKEN_BUDGET,
+        "max_turns": MAX_TURNS,
+    }
+    return context, meta
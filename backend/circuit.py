@@ -0,0 +1,159 @@
+"""
+Per-host circuit breakers for upstream calls.
+
+After ``CIRCUIT_FAILURES`` consecutive failures (connection errors,
+timeouts, 5xx) a host's breaker opens and calls to it fail at once with
+``CircuitOpen`` instead of waiting for another timeout. After
+``CIRCUIT_OPEN_SECONDS`` one probe call is let through (half-open): success
+closes the breaker, failure opens it for another period. 4xx answers (a
+rejected search tool, an exhausted quota) show the host is up and count as
+successes. Health probes (health.py) are folded in through ``observe``.
+
+``Unavailable`` is the base for every "no upstream capacity" refusal
+(open breaker, full governor queue); the drivers turn it into a 503 with
+``Retry-After`` instead of letting the handler treat it as a failed call.
+"""
+import math
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+
+ENABLED = os.getenv("CIRCUIT_BREAKER", "1") == "1"
+FAILURES = int(os.getenv("CIRCUIT_FAILURES", "5"))
+OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+
+class Unavailable(Exception):
+    """An upstream call was refused locally; retry after ``retry_after`` s."""
+
+    detail = "The service is temporarily unavailable. Please try again shortly."
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpen(Unavailable):
+    detail = "An upstream service is failing. Please try again shortly."
+
+    def __init__(self, host, retry_after):
+        super().__init__(f"Circuit open for {host}; retry in {retry_after} s", retry_after)
+        self.host = host
+
+
+def unavailable_response(exc):
+    return (
+        {"detail": exc.detail, "retry_after": exc.retry_after},
+        503,
+        {"Retry-After": str(exc.retry_after)},
+    )
+
+
+def is_failure(exc):
+    """Whether ``exc`` says the host is unhealthy (as opposed to the request
+    being refused locally or cancelled)."""
+    if exc is None or isinstance(exc, Unavailable) or not isinstance(exc, Exception):
+        return False
+    if isinstance(exc, requests.HTTPError):
+        return getattr(exc.response, "status_code", 500) >= 500
+    # Connection errors and timeouts of either HTTP client.
+    return True
+
+
+class Breaker:
+    def __init__(self, host):
+        self.host = host
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.opened = 0
+        self.rejected = 0
+
+    def check(self):
+        """Raise ``CircuitOpen`` unless a call may be sent now."""
+        if not ENABLED:
+            return self
+        with self.lock:
+            if self.state == CLOSED:
+                return self
+            remaining = self.opened_at + OPEN_SECONDS - time.monotonic()
+            if self.state == OPEN and remaining <= 0:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self.probing:
+                self.probing = True
+                return self
+            self.rejected += 1
+            raise CircuitOpen(self.host, max(1, math.ceil(remaining)))
+
+    def record(self, exc=None):
+        if not ENABLED:
+            return
+        with self.lock:
+            if is_failure(exc):
+                self.failures += 1
+                if self.state == HALF_OPEN or self.failures >= FAILURES:
+                    if self.state != OPEN:
+                        self.opened += 1
+                    self.state = OPEN
+                    self.opened_at = time.monotonic()
+            elif exc is None or isinstance(exc, requests.HTTPError):
+                self.failures = 0
+                self.state = CLOSED
+            self.probing = False
+
+    def observe(self, failed):
+        """Fold in a health probe (health.py) without disturbing a call's half-open probe."""
+        if not ENABLED:
+            return
+        with self.lock:
+            if failed and self.state == CLOSED:
+                self.failures += 1
+                if self.failures >= FAILURES:
+                    self.opened += 1
+                    self.state = OPEN
+                    self.opened_at = time.monotonic()
+            elif not failed and self.state == OPEN:
+                # The host answers again: let the next call through as the probe.
+                self.opened_at = time.monotonic() - OPEN_SECONDS
+
+    def stats(self):
+        with self.lock:
+            retry_in = self.opened_at + OPEN_SECONDS - time.monotonic() if self.state == OPEN else 0
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "opened": self.opened,
+                "rejected": self.rejected,
+                "retry_in_s": round(max(0.0, retry_in), 1),
+            }
+
+
+_breakers = {}
+_lock = threading.Lock()
+
+
+def for_url(url):
+    host = urlsplit(url).netloc
+    breaker = _breakers.get(host)
+    if breaker is None:
+        with _lock:
+            breaker = _breakers.setdefault(host, Breaker(host))
+    return breaker
+
+
+def check(url):
+    """Return the breaker for ``url``'s host, or raise ``CircuitOpen``."""
+    return for_url(url).check()
+
+
+def stats():
+    with _lock:
+        breakers = list(_breakers.values())
+    return {breaker.host: breaker.stats() for breaker in breakers}
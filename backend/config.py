@@ -0,0 +1,21 @@
+"""
+Shared settings for the Flask and ASGI entry points.
+
+Import this module before any other local module so values from ``.env``
+are visible to modules that read their settings at import time.
+"""
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+api_key = os.getenv("GEMINI_API_KEY", "")
+weather_api_key = os.getenv("WEATHER_API_KEY", "")
+MODEL_NAME = "gemini-2.5-flash"
+GEMINI_URL = os.getenv(
+    "GEMINI_URL",
+    f"https://generativelanguage.googleapis.com/v1beta/models/{MODEL_NAME}:generateContent",
+)
+GEMINI_STREAM_URL = os.getenv("GEMINI_STREAM_URL", GEMINI_URL.replace(":generateContent", ":streamGenerateContent"))
+WEATHER_FORECAST_URL = os.getenv("WEATHER_FORECAST_URL", "http://api.weatherapi.com/v1/forecast.json")
@@ -0,0 +1,383 @@
+"""
+Admission control for Gemini calls, shared by the sync and async clients.
+
+Every Gemini request passes through one ``Governor`` per process before it
+is sent:
+
+* two token buckets hold it to the configured quota, ``GEMINI_RPM``
+  requests and ``GEMINI_TPM`` tokens per minute (0 disables a bucket);
+  request tokens are estimated from the payload and a fixed reply allowance;
+* an AIMD concurrency limit caps calls in flight. Each success within the
+  latency baseline raises the limit by ``1/limit``; a 429, a 503, a timeout
+  or a reply slower than ``GOVERNOR_LATENCY_FACTOR`` times the endpoint's
+  usual latency multiplies it by ``GOVERNOR_BACKOFF``, at most once per
+  round trip (the usual latency, capped at ``GOVERNOR_COOLDOWN`` seconds)
+  so one burst of failures counts once;
+* calls that cannot go yet wait in a short priority queue ordered by the
+  route being served (``PRIORITIES``, interactive /chatbot first, queued
+  jobs last). When the queue is full, or a call has waited
+  ``GOVERNOR_QUEUE_TIMEOUT`` seconds, ``Overloaded`` (a
+  ``circuit.Unavailable``) is raised and the client gets a 503 with ``Retry-After`` instead of hanging until the
+  upstream timeout.
+
+Limits are per process; divide the quota by the number of workers.
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+
+import circuit
+import metrics
+from config import GEMINI_STREAM_URL, GEMINI_URL
+
+ENABLED = os.getenv("GOVERNOR", "1") == "1"
+RPM = int(os.getenv("GEMINI_RPM", "0"))
+TPM = int(os.getenv("GEMINI_TPM", "0"))
+INITIAL_LIMIT = float(os.getenv("GOVERNOR_CONCURRENCY", "16"))
+MIN_LIMIT = float(os.getenv("GOVERNOR_MIN_CONCURRENCY", "1"))
+MAX_LIMIT = float(os.getenv("GOVERNOR_MAX_CONCURRENCY", "64"))
+QUEUE_SIZE = int(os.getenv("GOVERNOR_QUEUE_SIZE", "32"))
+QUEUE_TIMEOUT = float(os.getenv("GOVERNOR_QUEUE_TIMEOUT", "5"))
+BACKOFF = float(os.getenv("GOVERNOR_BACKOFF", "0.7"))
+COOLDOWN = float(os.getenv("GOVERNOR_COOLDOWN", "1"))
+LATENCY_FACTOR = float(os.getenv("GOVERNOR_LATENCY_FACTOR", "3"))
+# Tokens charged for the reply, which is unknown when the call is admitted.
+REPLY_TOKENS = int(os.getenv("GOVERNOR_REPLY_TOKENS", "512"))
+# Gemini bills an inline image as a fixed number of tokens.
+IMAGE_TOKENS = 258
+THROTTLE_STATUSES = (429, 503)
+
+# Lower runs first; routes not listed (and background work) use DEFAULT_PRIORITY.
+PRIORITIES = {
+    "/chatbot": 0,
+    "/detect-disease": 1,
+    "/detect-disease/batch": 2,
+    "/weather-crop-advisory": 2,
+    "/market-prices": 3,
+    "/nearby-stores": 3,
+    "/gov-schemes": 4,
+}
+DEFAULT_PRIORITY = 5
+JOB_PRIORITY = 6
+
+GOVERNED_HOSTS = {urlsplit(GEMINI_URL).netloc, urlsplit(GEMINI_STREAM_URL).netloc}
+
+
+class Overloaded(circuit.Unavailable):
+    """No capacity for a Gemini call within the queue limits."""
+
+    detail = "The AI service is busy. Please try again shortly."
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Gemini is busy ({reason}); retry in {retry_after} s", retry_after)
+        self.reason = reason
+
+
+def governs(call):
+    return ENABLED and urlsplit(call.url).netloc in GOVERNED_HOSTS
+
+
+def priority():
+    route = metrics.endpoint.get()
+    if route.startswith("job:"):
+        return JOB_PRIORITY
+    return PRIORITIES.get(route, DEFAULT_PRIORITY)
+
+
+def estimate_tokens(call):
+    """Rough token count of a Gemini request (about four characters per token)."""
+    if call.body is not None:
+        text = len(call.body.head) + len(call.body.tail)
+        return text // 4 + IMAGE_TOKENS + REPLY_TOKENS
+    chars = images = 0
+    for content in (call.json or {}).get("contents", []):
+        for part in content.get("parts", []):
+            if "inline_data" in part:
+                images += 1
+            else:
+                chars += len(part.get("text", ""))
+    return chars // 4 + images * IMAGE_TOKENS + REPLY_TOKENS
+
+
+def throttled(exc):
+    """Whether an upstream error means Gemini wants less traffic."""
+    if isinstance(exc, (requests.Timeout, TimeoutError)) or type(exc).__name__.endswith("Timeout"):
+        return True
+    response = getattr(exc, "response", None)
+    return getattr(response, "status_code", None) in THROTTLE_STATUSES
+
+
+class TokenBucket:
+    """``per_minute`` units refilled continuously, bursting up to one
+    minute's worth. A rate of 0 never limits."""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def delay(self, cost, now):
+        """Seconds until ``cost`` units are available (0 when they are)."""
+        if not self.capacity:
+            return 0.0
+        self._refill(now)
+        # A request larger than the whole bucket waits for a full bucket.
+        missing = min(cost, self.capacity) - self.level
+        return max(0.0, missing * 60 / self.capacity)
+
+    def take(self, cost):
+        if self.capacity:
+            self.level -= min(cost, self.capacity)
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "cost", "admitted", "cancelled", "notify")
+
+    def __init__(self, priority, seq, cost, notify):
+        self.priority = priority
+        self.seq = seq
+        self.cost = cost
+        self.admitted = False
+        self.cancelled = False
+        self.notify = notify
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class Governor:
+    def __init__(self, rpm=RPM, tpm=TPM, limit=INITIAL_LIMIT):
+        self.lock = threading.Lock()
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.limit = limit
+        self.in_flight = 0
+        self.queue = []
+        self.queued = 0
+        self.seq = itertools.count()
+        self.last_backoff = 0.0
+        self.baselines = {}
+        self.counters = {"admitted": 0, "queued": 0, "rejected": 0, "timed_out": 0, "throttled": 0, "slow": 0}
+
+    # All methods below ending in ``_locked`` expect ``self.lock`` to be held.
+
+    def _delay_locked(self, cost, now):
+        """0 if a call costing ``cost`` can start now, else the seconds until the
+        buckets allow it, or None when only the concurrency limit is in the way."""
+        bucket_delay = max(self.requests.delay(1, now), self.tokens.delay(cost, now))
+        if bucket_delay:
+            return bucket_delay
+        return 0.0 if self.in_flight < max(1, int(self.limit)) else None
+
+    def _admit_locked(self, cost):
+        self.requests.take(1)
+        self.tokens.take(cost)
+        self.in_flight += 1
+        self.counters["admitted"] += 1
+
+    def _dispatch_locked(self):
+        """Admit queued calls in priority order while there is capacity."""
+        now = time.monotonic()
+        while self.queue:
+            head = self.queue[0]
+            if head.cancelled:
+                heapq.heappop(self.queue)
+                continue
+            if self._delay_locked(head.cost, now) != 0.0:
+                return
+            heapq.heappop(self.queue)
+            self.queued -= 1
+            self._admit_locked(head.cost)
+            head.admitted = True
+            head.notify()
+
+    def retry_after(self, cost=0):
+        """Whole seconds a rejected client should wait before retrying."""
+        now = time.monotonic()
+        bucket_delay = max(self.requests.delay(1, now), self.tokens.delay(cost, now))
+        typical = max(self.baselines.values(), default=1.0)
+        return max(1, math.ceil(max(bucket_delay, typical)))
+
+    def _enqueue(self, cost, notify):
+        """Admit now (returns None) or return a queued ``_Waiter``."""
+        prio = priority()
+        with self.lock:
+            if self.queued == 0 and self._delay_locked(cost, time.monotonic()) == 0.0:
+                self._admit_locked(cost)
+                return None
+            if self.queued >= QUEUE_SIZE:
+                self.counters["rejected"] += 1
+                raise Overloaded("queue full", self.retry_after(cost))
+            waiter = _Waiter(prio, next(self.seq), cost, notify)
+            heapq.heappush(self.queue, waiter)
+            self.queued += 1
+            self.counters["queued"] += 1
+            return waiter
+
+    def _poll(self, waiter, deadline):
+        """Re-check a waiter after a wake-up; returns the seconds to wait next
+        (None once admitted) or raises ``Overloaded`` past the deadline."""
+        with self.lock:
+            if not waiter.admitted:
+                self._dispatch_locked()
+            if waiter.admitted:
+                return None
+            now = time.monotonic()
+            if now >= deadline:
+                waiter.cancelled = True
+                self.queued -= 1
+                self.counters["timed_out"] += 1
+                raise Overloaded("queue timeout", self.retry_after(waiter.cost))
+            # Token refills wake nobody, so poll at least that often.
+            delay = self._delay_locked(waiter.cost, now)
+            return min(deadline - now, delay or deadline - now)
+
+    def acquire(self, cost):
+        """Block until a call costing ``cost`` tokens may start."""
+        event = threading.Event()
+        waiter = self._enqueue(cost, event.set)
+        if waiter is None:
+            return
+        deadline = time.monotonic() + QUEUE_TIMEOUT
+        while True:
+            timeout = self._poll(waiter, deadline)
+            if timeout is None:
+                return
+            event.wait(timeout)
+            event.clear()
+
+    async def acquire_async(self, cost):
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        waiter = self._enqueue(cost, lambda: loop.call_soon_threadsafe(event.set))
+        if waiter is None:
+            return
+        deadline = time.monotonic() + QUEUE_TIMEOUT
+        while True:
+            timeout = self._poll(waiter, deadline)
+            if timeout is None:
+                return
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                self.cancel(waiter)
+                raise
+            event.clear()
+
+    def cancel(self, waiter):
+        with self.lock:
+            if waiter.admitted:
+                self._release_locked()
+            elif not waiter.cancelled:
+                waiter.cancelled = True
+                self.queued -= 1
+
+    def abandon(self):
+        """Free the slot of a call that was cancelled, without judging Gemini by it."""
+        with self.lock:
+            self._release_locked()
+
+    def release(self, route, seconds, exc=None):
+        """Record the outcome of an admitted call and admit the next ones."""
+        with self.lock:
+            now = time.monotonic()
+            baseline = self.baselines.get(route)
+            congested = exc is not None and throttled(exc)
+            if congested:
+                self.counters["throttled"] += 1
+            elif exc is None and baseline is not None and seconds > baseline * LATENCY_FACTOR:
+                self.counters["slow"] += 1
+                congested = True
+            if congested:
+                # One cut per round trip: the calls that were in flight
+                # together report the same congestion.
+                window = min(COOLDOWN, baseline) if baseline else COOLDOWN
+                if now - self.last_backoff >= window:
+                    self.limit = max(MIN_LIMIT, self.limit * BACKOFF)
+                    self.last_backoff = now
+            elif exc is None:
+                self.limit = min(MAX_LIMIT, self.limit + 1 / self.limit)
+            if exc is None:
+                # Slow moving average, so a gradual slowdown shifts the baseline.
+                self.baselines[route] = seconds if baseline is None else baseline * 0.9 + seconds * 0.1
+            self._release_locked()
+
+    def _release_locked(self):
+        self.in_flight -= 1
+        self._dispatch_locked()
+
+    def stats(self):
+        with self.lock:
+            now = time.monotonic()
+            return {
+                "enabled": ENABLED,
+                "limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "queue_depth": self.queued,
+                "rpm": self.requests.capacity,
+                "tpm": self.tokens.capacity,
+                "rpm_available": round(self.requests.level, 1) if self.requests.capacity else None,
+                "tpm_available": round(self.tokens.level, 1) if self.tokens.capacity else None,
+                "latency_baselines": {route: round(value, 3) for route, value in sorted(self.baselines.items())},
+                **self.counters,
+                "next_slot_s": round(self._delay_locked(REPLY_TOKENS, now) or 0.0, 3),
+            }
+
+
+gemini = Governor()
+
+
+class Ticket:
+    """Admission of one governed call; ``release`` reports how it went."""
+
+    def __init__(self, call):
+        self.cost = estimate_tokens(call)
+        self.route = metrics.endpoint.get()
+        self.started = None
+
+    def admitted(self):
+        self.started = time.perf_counter()
+        return self
+
+    def release(self, exc=None):
+        if exc is not None and not isinstance(exc, Exception):
+            # Cancelled or closed (a lost race, a client that went away).
+            gemini.abandon()
+        else:
+            gemini.release(self.route, time.perf_counter() - self.started, exc)
+
+
+def admit(call):
+    """Wait for capacity for ``call``; returns a ``Ticket`` or None if ungoverned."""
+    if not governs(call):
+        return None
+    ticket = Ticket(call)
+    with metrics.stage("governor"):
+        gemini.acquire(ticket.cost)
+    return ticket.admitted()
+
+
+async def admit_async(call):
+    if not governs(call):
+        return None
+    ticket = Ticket(call)
+    with metrics.stage("governor"):
+        await gemini.acquire_async(ticket.cost)
+    return ticket.admitted()
+
+
+def stats():
+    return gemini.stats()
@@ -0,0 +1,787 @@
+"""
+Endpoint logic shared by the Flask (app.py) and ASGI (asgi_app.py) servers.
+
+Each handler is a generator: it yields an ``upstream.Call`` whenever it needs
+an upstream response and receives the decoded JSON body back (or the raised
+exception). CPU-heavy steps are yielded as ``upstream.Blocking``. A handler
+finally returns ``(body, status)`` or ``(body, status, headers)``. The servers
+only differ in how they execute the yielded work: ``run`` below does it with
+the pooled blocking client, ``asgi_app.arun`` with a non-blocking one.
+"""
+import base64
+import io
+import json
+import mimetypes
+import os
+import zipfile
+
+import requests
+
+import cache
+import chat_history
+import circuit
+import image_cache
+import imaging
+import metrics
+import price_store
+import prompts
+import scheme_index
+import search_fallback
+import stale
+import store_registry
+import structured
+import triage
+import upstream
+import uploads
+import warmer
+import weather_cache
+from config import GEMINI_STREAM_URL, GEMINI_URL, WEATHER_FORECAST_URL, api_key, weather_api_key
+
+BATCH_IMAGES_PER_CALL = int(os.getenv("BATCH_IMAGES_PER_CALL", "4"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_MAX_IMAGES = int(os.getenv("BATCH_MAX_IMAGES", "200"))
+BATCH_MAX_BYTES = int(os.getenv("BATCH_MAX_BYTES", str(512 * 1024 * 1024)))
+ZIP_MIMETYPES = ("application/zip", "application/x-zip-compressed")
+
+DISEASE_PROMPT = (
+    "You are an agriculture expert. Analyze this crop image and detect disease if present. "
+    "Return strictly valid JSON with this schema: "
+    "{\"disease\":\"...\",\"cure\":\"...\",\"confidence\":\"low|medium|high\"}. "
+    "If healthy, set disease to 'No disease detected' and give preventive care in cure."
+)
+BATCH_DISEASE_PROMPT = (
+    "You are an agriculture expert. You will receive {count} crop images, each preceded by its label "
+    "(\"Image 1:\", \"Image 2:\", ...). Analyze each image on its own and detect disease if present. "
+    "Return strictly valid JSON: an array with one object per image, in the same order, with this schema: "
+    "{{\"image\":1,\"disease\":\"...\",\"cure\":\"...\",\"confidence\":\"low|medium|high\"}}. "
+    "If an image is healthy, set disease to 'No disease detected' and give preventive care in cure."
+)
+
+
+def run(flow):
+    """Drive a handler flow synchronously and return its final result."""
+    timer = metrics.FlowTimer()
+    try:
+        call = timer.resume(flow.send)
+        while True:
+            try:
+                with timer.waiting(call):
+                    result = upstream.execute(call)
+            except circuit.Unavailable:
+                # Fail the whole request fast rather than let the flow fall back.
+                flow.close()
+                raise
+            except Exception as exc:
+                call = timer.resume(flow.throw, exc)
+            else:
+                call = timer.resume(flow.send, result)
+    except StopIteration as stop:
+        return stop.value
+    finally:
+        timer.finish()
+
+
+def gemini_call(payload, timeout, body=None):
+    return upstream.Call(
+        "POST",
+        GEMINI_URL,
+        timeout,
+        params={"key": api_key},
+        headers={"Content-Type": "application/json"},
+        json=payload,
+        body=body,
+    )
+
+
+def gemini_stream_call(payload, timeout):
+    return upstream.Call(
+        "POST",
+        GEMINI_STREAM_URL,
+        timeout,
+        params={"key": api_key, "alt": "sse"},
+        headers={"Content-Type": "application/json"},
+        json=payload,
+    )
+
+
+def weather_call(params, timeout):
+    return upstream.Call("GET", WEATHER_FORECAST_URL, timeout, params={"key": weather_api_key, **params})
+
+
+def wants_stream(body, accept):
+    """Streaming is opt-in: ``"stream": true`` in the body or an SSE Accept header."""
+    return body.get("stream") is True or "text/event-stream" in (accept or "")
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class ChatStream:
+    """Streaming /chatbot reply returned by ``chatbot(..., stream=True)``.
+
+    The server iterates the Gemini SSE chunks for ``call`` and passes each one
+    to ``feed``; the resulting events are forwarded to the client as
+    ``chunk`` events, followed by a ``done`` event carrying the full reply
+    (same shape as the non-streaming response) or an ``error`` event.
+    """
+
+    def __init__(self, call, meta=None):
+        self.call = call
+        self.meta = meta
+        self.parts = []
+
+    def feed(self, chunk):
+        text = "".join(
+            part.get("text", "")
+            for candidate in chunk.get("candidates", [])[:1]
+            for part in candidate.get("content", {}).get("parts", [])
+        )
+        if not text:
+            return ""
+        self.parts.append(text)
+        return sse_event("chunk", {"text": text})
+
+    def finish(self):
+        reply = "".join(self.parts).strip()
+        if not reply:
+            return sse_event("error", {"detail": "Empty response from model."})
+        done = {"reply": reply}
+        if self.meta is not None:
+            done["meta"] = self.meta
+        return sse_event("done", done)
+
+    def fail(self, exc):
+        return sse_event("error", {"detail": f"Gemini request failed: {exc}"})
+
+
+def detect_disease(image, mimetype):
+    """``image`` is the upload as bytes or as a binary file (see uploads.py)."""
+    if not api_key:
+        return {"detail": "GEMINI_API_KEY is not set on the server."}, 500
+
+    if image is None:
+        return {"detail": "Image file field 'file' is required."}, 400
+
+    if not mimetype or not mimetype.startswith("image/"):
+        return {"detail": "Please upload a valid image file."}, 400
+
+    if not uploads.size(image):
+        return {"detail": "Uploaded image is empty."}, 400
+
+    digest, phash = yield upstream.Blocking(image_cache.fingerprint, image)
+    cached, match = image_cache.lookup(digest, phash)
+    if cached is not None:
+        return cached, 200, {"X-Cache": "HIT", "X-Cache-Match": match}
+
+    if triage.ENABLED:
+        verdict = yield upstream.Blocking(triage.classify, image)
+        answer = triage.answer(verdict)
+        if answer is not None:
+            return answer, 200, {"X-Cache": "MISS", "X-Triage": verdict["verdict"]}
+
+    try:
+        image, mimetype, image_stats = yield upstream.Blocking(imaging.preprocess, image, mimetype)
+        payload = {
+            "contents": [
+                {
+                    "parts": [
+                        {"text": DISEASE_PROMPT},
+                        {
+                            "inline_data": {
+                                "mime_type": mimetype,
+                                "data": uploads.INLINE_DATA,
+                            }
+                        },
+                    ]
+                }
+            ],
+            "generationConfig": {
+                "temperature": 0.2,
+                "responseMimeType": "application/json",
+            },
+        }
+
+        if uploads.STREAMING:
+            call = gemini_call(None, timeout=90, body=uploads.StreamedBody(payload, image, digest))
+        else:
+            with metrics.stage("encode"):
+                data = uploads.open_source(image).read()
+                payload["contents"][0]["parts"][1]["inline_data"]["data"] = base64.b64encode(data).decode("utf-8")
+            call = gemini_call(payload, timeout=90)
+        response_json = yield call
+
+        try:
+            result = structured.parse(response_json, "disease")
+            image_cache.store(digest, phash, result)
+            return result, 200, {
+                "X-Cache": "MISS",
+                "X-Image-Bytes-Saved": str(image_stats["bytes_saved"]),
+                "X-Image-Preprocess-Ms": str(image_stats["ms"]),
+            }
+        except structured.ParseError as exc:
+            return (
+                {
+                    "disease": "Unknown",
+                    "cure": "Could not parse structured output. Please retry with a clearer crop image.",
+                    "raw_response": exc.raw_text,
+                },
+                200,
+            )
+
+    except Exception as exc:
+        return {"detail": f"Gemini request failed: {exc}"}, 500
+
+
+def batch_items(uploads):
+    """Expand ``(filename, bytes, mimetype)`` uploads, unpacking zip archives.
+
+    Returns ``(items, None)`` or ``(None, (error_body, status))``.
+    """
+    if not api_key:
+        return None, ({"detail": "GEMINI_API_KEY is not set on the server."}, 500)
+
+    items = []
+    total_bytes = 0
+    for filename, data, mimetype in uploads:
+        filename = filename or f"image-{len(items) + 1}"
+        if mimetype in ZIP_MIMETYPES or filename.lower().endswith(".zip"):
+            try:
+                with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                    for entry in archive.infolist():
+                        guessed = mimetypes.guess_type(entry.filename)[0] or ""
+                        if entry.is_dir() or not guessed.startswith("image/"):
+                            continue
+                        total_bytes += entry.file_size
+                        if total_bytes > BATCH_MAX_BYTES:
+                            return None, ({"detail": "Batch is too large."}, 413)
+                        items.append((entry.filename, archive.read(entry), guessed))
+            except zipfile.BadZipFile:
+                return None, ({"detail": f"'{filename}' is not a valid zip archive."}, 400)
+        else:
+            total_bytes += len(data)
+            if total_bytes > BATCH_MAX_BYTES:
+                return None, ({"detail": "Batch is too large."}, 413)
+            items.append((filename, data, mimetype))
+        if len(items) > BATCH_MAX_IMAGES:
+            return None, ({"detail": f"At most {BATCH_MAX_IMAGES} images are allowed per batch."}, 413)
+
+    if not items:
+        return None, ({"detail": "Upload images in field 'files' or as a zip archive."}, 400)
+    return [(index, *item) for index, item in enumerate(items)], None
+
+
+def batch_chunks(items, size=None):
+    size = size or BATCH_IMAGES_PER_CALL
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+def ndjson_line(row):
+    return json.dumps(row) + "\n"
+
+
+def batch_summary(rows):
+    return {
+        "summary": {
+            "images": len(rows),
+            "cached": sum(1 for row in rows if row.get("cached")),
+            "failed": sum(1 for row in rows if "detail" in row),
+        }
+    }
+
+
+def failed_rows(chunk, exc):
+    """Rows for a chunk whose calls were refused (see circuit.Unavailable)."""
+    body, status, _ = circuit.unavailable_response(exc)
+    return [{"index": index, "filename": filename, **body, "status": status} for index, filename, *_ in chunk]
+
+
+def detect_disease_chunk(chunk):
+    """Handler flow for a group of batch images; returns one row per image.
+
+    Cached images are answered locally; the rest are sent to Gemini together
+    in one request. Images missing from a multi-image answer are retried on
+    their own with the single-image flow.
+    """
+    rows = {}
+    pending = []
+    for index, filename, data, mimetype in chunk:
+        row = {"index": index, "filename": filename}
+        if not mimetype or not mimetype.startswith("image/"):
+            rows[index] = {**row, "detail": "Please upload a valid image file."}
+            continue
+        if not data:
+            rows[index] = {**row, "detail": "Uploaded image is empty."}
+            continue
+        digest, phash = yield upstream.Blocking(image_cache.fingerprint, data)
+        cached, _ = image_cache.lookup(digest, phash)
+        if cached is not None:
+            rows[index] = {**row, **cached, "cached": True}
+        else:
+            pending.append((row, data, mimetype, digest, phash))
+
+    if pending and triage.ENABLED:
+        verdicts = yield upstream.Blocking(triage.classify_batch, [data for _, data, *_ in pending])
+        escalated = []
+        for item, verdict in zip(pending, verdicts):
+            answer = triage.answer(verdict)
+            if answer is None:
+                escalated.append(item)
+            else:
+                rows[item[0]["index"]] = {**item[0], **answer, "cached": False}
+        pending = escalated
+
+    results = []
+    if len(pending) > 1:
+        parts = [{"text": BATCH_DISEASE_PROMPT.format(count=len(pending))}]
+        try:
+            for number, (_, data, mimetype, _, _) in enumerate(pending, start=1):
+                data, mimetype, _ = yield upstream.Blocking(imaging.preprocess, data, mimetype)
+                parts.append({"text": f"Image {number}:"})
+                parts.append({"inline_data": {"mime_type": mimetype, "data": base64.b64encode(data).decode("utf-8")}})
+            payload = {
+                "contents": [{"parts": parts}],
+                "generationConfig": {"temperature": 0.2, "responseMimeType": "application/json"},
+            }
+            response_json = yield gemini_call(payload, timeout=120)
+            results = structured.parse(response_json, "disease-batch")
+        except Exception:
+            results = []
+
+    by_number = {}
+    for position, result in enumerate(results, start=1):
+        by_number[result.pop("image", position)] = result
+
+    for number, (row, data, mimetype, digest, phash) in enumerate(pending, start=1):
+        result = by_number.get(number)
+        if result is not None:
+            image_cache.store(digest, phash, result)
+            rows[row["index"]] = {**row, **result, "cached": False}
+            continue
+        body, status, *_ = yield from detect_disease(data, mimetype)
+        rows[row["index"]] = {**row, **body, "cached": False}
+        if status != 200:
+            rows[row["index"]]["status"] = status
+
+    return [rows[index] for index, *_ in chunk]
+
+
+def chatbot(body, stream=False):
+    if not api_key:
+        return {"detail": "GEMINI_API_KEY is not set on the server."}, 500
+
+    message = (body.get("message") or "").strip()
+    history = body.get("history") or []
+
+    if not message:
+        return {"detail": "Field 'message' is required."}, 400
+
+    if not isinstance(history, list):
+        return {"detail": "Field 'history' must be a list if provided."}, 400
+
+    conversation_lines, history_meta = yield from chat_history.build_context(
+        chat_history.turn_lines(history), gemini_call
+    )
+    conversation_lines.append(f"Farmer: {message}")
+    conversation_text = "\n".join(conversation_lines)
+
+    base_payload = {
+        "contents": [
+            {
+                "parts": [
+                    {"text": conversation_text},
+                ]
+            }
+        ],
+        "generationConfig": {
+            "temperature": 0.4,
+        },
+    }
+
+    meta = {"history": history_meta}
+    if stream:
+        payload, _ = prompts.CHATBOT.payload(base_payload)
+        return ChatStream(gemini_stream_call(payload, timeout=90), meta), 200
+
+    try:
+        response_json = yield from prompts.CHATBOT.send(base_payload, gemini_call, timeout=90)
+        raw_text = (
+            response_json.get("candidates", [{}])[0]
+            .get("content", {})
+            .get("parts", [{}])[0]
+            .get("text", "")
+            .strip()
+        )
+
+        if not raw_text:
+            return {"detail": "Empty response from model."}, 502
+
+        return {"reply": raw_text, "meta": meta}, 200
+
+    except Exception as exc:
+        return {"detail": f"Gemini request failed: {exc}"}, 500
+
+
+def gov_schemes(body):
+    if not api_key:
+        return {"detail": "GEMINI_API_KEY is not set on the server."}, 500
+
+    state = str(body.get("state") or "All States").strip()
+    scheme_type = str(body.get("type") or "All Types").strip()
+    keyword = str(body.get("keyword") or "").strip()
+    eligibility = str(body.get("eligibility") or "").strip()
+
+    indexed = scheme_index.lookup(state, scheme_type, keyword, eligibility)
+    if indexed is not None:
+        return indexed, 200
+
+    cache_key = (cache.normalize(state), cache.normalize(scheme_type))
+    if keyword or eligibility:
+        cache_key += (cache.normalize(keyword), cache.normalize(eligibility))
+    cached = cache.gov_schemes.get(cache_key)
+    if cached is not None:
+        return cached, 200
+
+    return (
+        yield from stale.serve(
+            "gov-schemes", cache_key, fetch_gov_schemes(state, scheme_type, keyword, eligibility, cache_key)
+        )
+    )
+
+
+def fetch_gov_schemes(state, scheme_type, keyword, eligibility, cache_key):
+    """Upstream part of ``gov_schemes``, run under ``stale.serve``."""
+    filters = f"Filter preference: state='{state}', type='{scheme_type}'. "
+    if keyword:
+        filters += f"Only include schemes about '{keyword}'. "
+    if eligibility:
+        filters += f"Only include schemes whose eligibility fits '{eligibility}'. "
+    base_payload = {
+        "contents": [
+            {
+                "parts": [
+                    {"text": filters.strip()},
+                ]
+            }
+        ],
+        "generationConfig": {
+            "temperature": 0.2,
+            "responseMimeType": "application/json",
+        },
+    }
+
+    try:
+        response_json = yield from search_fallback.generate(
+            base_payload, gemini_call, timeout=120, prompt=prompts.GOV_SCHEMES
+        )
+
+        try:
+            result = structured.parse(response_json, "schemes")
+            cache.gov_schemes.set(cache_key, result)
+            return result, 200
+        except structured.ParseError as exc:
+            return (
+                {
+                    "state": state,
+                    "type": scheme_type,
+                    "schemes": [],
+                    "raw_response": exc.raw_text,
+                    "detail": "Could not parse structured JSON."
+                },
+                200,
+            )
+
+    except Exception as exc:
+        return {"detail": f"Gemini request failed: {exc}"}, 500
+
+
+def weather_crop_advisory(body):
+    if not weather_api_key:
+        return {"detail": "WEATHER_API_KEY is not set on the server."}, 500
+    if not api_key:
+        return {"detail": "GEMINI_API_KEY is not set on the server."}, 500
+
+    city = str(body.get("city") or "").strip()
+    state = str(body.get("state") or "").strip()
+    country = str(body.get("country") or "IN").strip()
+
+    if not city:
+        return {"detail": "Field 'city' is required."}, 400
+
+    query = ",".join(part for part in [city, state, country] if part)
+
+    return (
+        yield from stale.serve(
+            "weather-crop-advisory",
+            (cache.normalize(query),),
+            fetch_weather_crop_advisory(city, state, country, query),
+        )
+    )
+
+
+def forecast_call(query):
+    return weather_call(
+        {
+            "q": query,
+            "days": 5,
+            "aqi": "no",
+            "alerts": "yes",
+        },
+        timeout=30,
+    )
+
+
+def fetch_weather_crop_advisory(city, state, country, query):
+    """Upstream part of ``weather_crop_advisory``, run under ``stale.serve``."""
+    forecast_request = forecast_call(query)
+
+    try:
+        forecast_json = weather_cache.lookup(query, forecast_request)
+        forecast_cached = forecast_json is not None
+        if not forecast_cached:
+            forecast_json = yield forecast_request
+
+        location = forecast_json.get("location", {})
+        forecast_days = forecast_json.get("forecast", {}).get("forecastday", [])
+
+        if not forecast_days:
+            return {"detail": "Weather forecast data not available for this location."}, 502
+        if not forecast_cached:
+            weather_cache.store(query, forecast_json)
+
+        lat = location.get("lat")
+        lon = location.get("lon")
+        resolved_name = location.get("name", city)
+        resolved_state = location.get("region", state)
+        resolved_country = location.get("country", country)
+
+        daily_forecast = []
+        for forecast_day in forecast_days[:5]:
+            day_info = forecast_day.get("day", {})
+            date_key = forecast_day.get("date", "")
+            daily_forecast.append(
+                {
+                    "date": date_key,
+                    "temp_min_c": round(day_info.get("mintemp_c", 0), 1),
+                    "temp_max_c": round(day_info.get("maxtemp_c", 0), 1),
+                    "humidity_avg": round(day_info.get("avghumidity", 0), 1),
+                    "rain_mm_total": round(day_info.get("totalprecip_mm", 0), 1),
+                    "condition": day_info.get("condition", {}).get("text", "unknown"),
+                }
+            )
+
+        advisory_key = weather_cache.advisory_key(
+            forecast_json, daily_forecast, [resolved_name, resolved_state, resolved_country]
+        )
+        advisory = weather_cache.advisories.get(advisory_key)
+        warmer.observe(
+            "weather-crop-advisory",
+            {"city": city, "state": state, "country": country},
+            hit=forecast_cached and advisory is not None,
+        )
+        if advisory is None:
+            request_text = (
+                f"Location: {resolved_name}, {resolved_state}, {resolved_country}. "
+                f"Forecast data: {json.dumps(daily_forecast)}"
+            )
+
+            gemini_payload = {
+                "contents": [
+                    {
+                        "parts": [
+                            {"text": request_text},
+                        ]
+                    }
+                ],
+                "generationConfig": {
+                    "temperature": 0.3,
+                    "responseMimeType": "application/json",
+                },
+            }
+
+            gemini_json = yield from prompts.WEATHER_ADVISORY.send(gemini_payload, gemini_call, timeout=90)
+
+            try:
+                advisory = structured.parse(gemini_json, "advisory")
+                weather_cache.advisories.set(advisory_key, advisory)
+            except structured.ParseError as exc:
+                advisory = {
+                    "weather_summary": "Could not parse structured advisory.",
+                    "recommended_crops": [],
+                    "farm_actions": [],
+                    "risk_alerts": [],
+                    "other_suggestions": [],
+                    "raw_response": exc.raw_text,
+                }
+
+        return (
+            {
+                "location": {
+                    "city": resolved_name,
+                    "state": resolved_state,
+                    "country": resolved_country,
+                    "lat": lat,
+                    "lon": lon,
+                },
+                "forecast": daily_forecast,
+                "advisory": advisory,
+            },
+            200,
+        )
+
+    except requests.HTTPError as http_exc:
+        status_code = getattr(http_exc.response, "status_code", 500)
+        error_text = getattr(http_exc.response, "text", str(http_exc))
+        return {"detail": f"Weather/Gemini request failed: {error_text}"}, status_code
+    except Exception as exc:
+        return {"detail": f"Weather advisory failed: {exc}"}, 500
+
+
+def market_prices(body):
+    location = str(body.get("location") or "India").strip()
+    commodity = str(body.get("commodity") or "").strip()
+
+    if not location:
+        return {"detail": "Field 'location' is required."}, 400
+
+    try:
+        history_days = int(body.get("history_days") or 0)
+    except (TypeError, ValueError):
+        return {"detail": "Field 'history_days' must be a number of days."}, 400
+    history_days = max(0, min(history_days, price_store.MAX_HISTORY_DAYS))
+
+    # Recent prices already in the local store are answered without Gemini.
+    params = {"location": location, "commodity": commodity}
+    stored = yield upstream.Blocking(price_store.lookup, location, commodity, history_days)
+    if stored is not None:
+        warmer.observe("market-prices", params, hit=True)
+        return stored, 200
+
+    if not api_key:
+        return {"detail": "GEMINI_API_KEY is not set on the server."}, 500
+
+    cache_key = (cache.normalize(location), cache.normalize(commodity))
+    cached = cache.market_prices.get(cache_key)
+    warmer.observe("market-prices", params, hit=cached is not None)
+    if cached is not None:
+        return cached, 200
+
+    return (yield from stale.serve("market-prices", cache_key, fetch_market_prices(location, commodity, cache_key)))
+
+
+def fetch_market_prices(location, commodity, cache_key):
+    """Upstream part of ``market_prices``, run under ``stale.serve``."""
+    # Build search query
+    if commodity:
+        search_query = f"Current market price of {commodity} in {location} today"
+    else:
+        search_query = f"Current market prices of vegetables and agricultural commodities in {location} today"
+
+    request_text = (
+        f"Location: {location}. "
+        f"Search query: {search_query}. "
+        f"Focus on: {commodity if commodity else 'common vegetables and crops like tomato, onion, potato, rice, wheat'}."
+    )
+
+    base_payload = {
+        "contents": [
+            {
+                "parts": [
+                    {"text": request_text},
+                ]
+            }
+        ],
+        "generationConfig": {
+            "temperature": 0.2,
+            "responseMimeType": "application/json",
+        },
+    }
+
+    try:
+        response_json = yield from search_fallback.generate(
+            base_payload, gemini_call, timeout=120, prompt=prompts.MARKET_PRICES
+        )
+
+        try:
+            result = structured.parse(response_json, "prices")
+            cache.market_prices.set(cache_key, result)
+            yield upstream.Blocking(price_store.ingest_result, result, location, commodity)
+            return result, 200
+        except structured.ParseError as exc:
+            return (
+                {
+                    "location": location,
+                    "commodity": commodity,
+                    "prices": [],
+                    "raw_response": exc.raw_text,
+                    "detail": "Could not parse structured JSON. The response may contain useful information in raw_response field."
+                },
+                200,
+            )
+
+    except Exception as exc:
+        return {"detail": f"Market price request failed: {exc}"}, 500
+
+
+def nearby_stores(body):
+    latitude = body.get("latitude")
+    longitude = body.get("longitude")
+    city = body.get("city", "")
+    state = body.get("state", "")
+
+    if not latitude or not longitude:
+        return {"detail": "Fields 'latitude' and 'longitude' are required."}, 400
+
+    location_str = f"{city}, {state}" if city and state else f"coordinates {latitude}, {longitude}"
+
+    # Covered areas are answered from the local registry; Gemini only
+    # enriches areas with too few known stores.
+    point = store_registry.coordinates(latitude, longitude)
+    local = store_registry.lookup(*point) if point else None
+    if local is not None:
+        return {"stores": local, "location": location_str, "total_stores": len(local), "source": "registry"}, 200
+
+    if not api_key:
+        return {"detail": "GEMINI_API_KEY is not set on the server."}, 500
+
+    cache_key = (*cache.geo_key(latitude, longitude), cache.normalize(city), cache.normalize(state))
+    cached = cache.nearby_stores.get(cache_key)
+    if cached is not None:
+        return cached, 200
+
+    # The instructions and schema are in prompts.NEARBY_STORES.
+    request_text = f"Location: {location_str} (Latitude: {latitude}, Longitude: {longitude})."
+
+    base_payload = {
+        "contents": [{"parts": [{"text": request_text}]}],
+        "generationConfig": {
+            "temperature": 0.2,
+            "responseMimeType": "application/json",
+        },
+    }
+
+    try:
+        response_json = yield from search_fallback.generate(
+            base_payload, gemini_call, timeout=120, prompt=prompts.NEARBY_STORES
+        )
+
+        try:
+            result = structured.parse(response_json, "stores")
+            cache.nearby_stores.set(cache_key, result)
+            if point and isinstance(result.get("stores"), list):
+                yield upstream.Blocking(store_registry.add_stores, result["stores"], "gemini", point)
+            return result, 200
+        except structured.ParseError as exc:
+            return (
+                {
+                    "stores": [],
+                    "location": location_str,
+                    "total_stores": 0,
+                    "raw_response": exc.raw_text,
+                    "detail": "Could not parse structured JSON. The response may contain useful information in raw_response field."
+                },
+                200,
+            )
+
+    except Exception as exc:
+        return {"detail": f"Nearby stores request failed: {exc}"}, 500
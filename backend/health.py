@@ -0,0 +1,228 @@
+"""
+Background health probes of the upstream APIs.
+
+A thread checks each upstream on its own interval and keeps the last
+``HEALTH_WINDOW`` results: Gemini every ``HEALTH_INTERVAL`` seconds with a
+``models.get`` request (free, but it validates the key and reaches the same
+host), WeatherAPI every ``HEALTH_WEATHER_INTERVAL`` seconds with a one-day
+forecast. Probes bypass the governor and the circuit breakers, so they never
+take a request's slot and still reach a host whose breaker is open.
+
+``/test-api-keys``, ``/readyz`` and ``/healthz`` answer from this state
+without any upstream call. The state also feeds the rest of the backend:
+
+* Circuit breakers: a failing probe counts towards opening the host's
+  breaker, and a passing one lets an open breaker try a call at once.
+* ``stale.serve`` returns the last good answer without waiting for the
+  deadline while Gemini is down, and the cache warmer pauses.
+
+An upstream is ``down`` after ``HEALTH_DOWN_AFTER`` consecutive failed
+probes (transport errors, 5xx), ``rejected`` when it answers 4xx (bad key,
+exhausted quota), ``degraded`` while recent probes failed, otherwise ``up``.
+"""
+import logging
+import os
+import statistics
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+import requests
+
+import circuit
+import metrics
+import prompts
+import upstream
+from config import GEMINI_URL, WEATHER_FORECAST_URL, api_key, weather_api_key
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("HEALTH_PROBES", "1") == "1"
+INTERVAL = float(os.getenv("HEALTH_INTERVAL", "60"))
+WEATHER_INTERVAL = float(os.getenv("HEALTH_WEATHER_INTERVAL", "300"))
+TIMEOUT = float(os.getenv("HEALTH_TIMEOUT", "5"))
+WINDOW = int(os.getenv("HEALTH_WINDOW", "20"))
+DOWN_AFTER = int(os.getenv("HEALTH_DOWN_AFTER", "2"))
+DEGRADED_ERROR_RATE = 0.2
+
+UP, DEGRADED, DOWN, REJECTED, UNKNOWN, DISABLED = "up", "degraded", "down", "rejected", "unknown", "disabled"
+
+
+class Probe:
+    """Periodic check of one upstream with a rolling window of results."""
+
+    def __init__(self, name, url, params, interval, configured):
+        self.name = name
+        self.url = url
+        self.params = params
+        self.interval = interval
+        self.configured = configured
+        self.lock = threading.Lock()
+        # (checked_at, latency_s, status_code or None, error text or None)
+        self.results = deque(maxlen=WINDOW)
+        self.consecutive_failures = 0
+        self.next_at = 0.0
+
+    def check(self):
+        started = time.perf_counter()
+        status, error = None, None
+        try:
+            response = upstream.request("GET", self.url, timeout=TIMEOUT, params=self.params)
+            status = response.status_code
+            if status >= 400:
+                error = response.text[:200]
+        except requests.RequestException as exc:
+            error = str(exc)[:200]
+        latency = time.perf_counter() - started
+        failed = status is None or status >= 500
+        with self.lock:
+            self.results.append((time.time(), latency, status, error))
+            self.consecutive_failures = self.consecutive_failures + 1 if failed else 0
+            self.next_at = time.monotonic() + self.interval
+        circuit.for_url(self.url).observe(failed)
+        if failed:
+            logger.warning("Health probe of %s failed: %s", self.name, error or status)
+
+    def state(self):
+        if not self.configured:
+            return DISABLED
+        with self.lock:
+            if not self.results:
+                return UNKNOWN
+            _, _, status, _ = self.results[-1]
+            failures = sum(1 for result in self.results if result[2] is None or result[2] >= 500)
+            if self.consecutive_failures >= DOWN_AFTER:
+                return DOWN
+            if status is not None and 400 <= status < 500:
+                return REJECTED
+            if self.consecutive_failures or failures / len(self.results) >= DEGRADED_ERROR_RATE:
+                return DEGRADED
+            return UP
+
+    def summary(self):
+        state = self.state()
+        with self.lock:
+            results = list(self.results)
+            consecutive = self.consecutive_failures
+        if not results:
+            return {"state": state, "checked_at": None}
+        checked_at, latency, status, error = results[-1]
+        latencies = sorted(result[1] for result in results)
+        failures = sum(1 for result in results if result[2] is None or result[2] >= 500)
+        return {
+            "state": state,
+            "checked_at": datetime.fromtimestamp(checked_at, timezone.utc).isoformat(timespec="seconds"),
+            "age_s": round(time.time() - checked_at, 1),
+            "status_code": status,
+            "error": error,
+            "latency_ms": round(latency * 1000, 1),
+            "latency_p50_ms": round(statistics.median(latencies) * 1000, 1),
+            "latency_max_ms": round(latencies[-1] * 1000, 1),
+            "error_rate": round(failures / len(results), 3),
+            "probes": len(results),
+            "consecutive_failures": consecutive,
+        }
+
+
+def _gemini_probe_url():
+    # models.get for the configured model; a custom GEMINI_URL without a
+    # model path is probed as is (any answer below 500 shows the host is up).
+    if "/models/" in GEMINI_URL:
+        return f"{prompts.API_ROOT}/{prompts.MODEL}"
+    return GEMINI_URL
+
+
+probes = {
+    "gemini": Probe("gemini", _gemini_probe_url(), {"key": api_key}, INTERVAL, bool(api_key)),
+    "weather": Probe(
+        "weather", WEATHER_FORECAST_URL, {"key": weather_api_key, "q": "London", "days": 1},
+        WEATHER_INTERVAL, bool(weather_api_key),
+    ),
+}
+
+_wake = threading.Event()
+_lock = threading.Lock()
+_thread = None
+
+
+def state(name):
+    return probes[name].state()
+
+
+def down(name):
+    """Whether ``name`` failed its last ``HEALTH_DOWN_AFTER`` probes."""
+    return ENABLED and probes[name].state() == DOWN
+
+
+def _loop():
+    metrics.endpoint.set("job:health")
+    while True:
+        now = time.monotonic()
+        for probe in probes.values():
+            if probe.configured and probe.next_at <= now:
+                probe.check()
+        due = [probe.next_at for probe in probes.values() if probe.configured]
+        _wake.wait(max(1.0, min(due, default=INTERVAL) - time.monotonic()))
+        _wake.clear()
+
+
+def start():
+    """Start the probe thread once per process (lazily, so it survives forking)."""
+    global _thread
+    if not ENABLED or _thread is not None:
+        return
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_loop, name="health", daemon=True)
+            _thread.start()
+
+
+def liveness():
+    return {"status": "ok"}, 200
+
+
+def readiness():
+    """Ready unless Gemini, which every AI route needs, is missing or down."""
+    states = {name: probe.state() for name, probe in probes.items()}
+    ready = states["gemini"] not in (DISABLED, DOWN)
+    return {"status": "ready" if ready else "not ready", "upstreams": states}, 200 if ready else 503
+
+
+def _status_text(probe):
+    summary = probe.summary()
+    state = summary["state"]
+    if state == DISABLED:
+        return "❌ API key not set", summary
+    if state == UNKNOWN:
+        return "⏳ Not checked yet", summary
+    if state in (UP, DEGRADED):
+        return "✅ Working", summary
+    if summary["status_code"] is not None:
+        return f"❌ Failed: {summary['status_code']}", summary
+    return f"❌ Error: {(summary['error'] or '')[:100]}", summary
+
+
+def api_key_report():
+    """The ``/test-api-keys`` body, from the latest probes."""
+    gemini_status, gemini = _status_text(probes["gemini"])
+    weather_status, weather = _status_text(probes["weather"])
+    report = {
+        "gemini_api_key_loaded": bool(api_key),
+        "gemini_api_key_preview": f"{api_key[:20]}..." if api_key else "Not set",
+        "weather_api_key_loaded": bool(weather_api_key),
+        "weather_api_key_preview": f"{weather_api_key[:10]}..." if weather_api_key else "Not set",
+        "gemini_api_status": gemini_status,
+        "weather_api_status": weather_status,
+        "gemini_health": gemini,
+        "weather_health": weather,
+    }
+    if gemini.get("error") and gemini_status.startswith("❌ Failed"):
+        report["gemini_error"] = gemini["error"]
+    if weather.get("error") and weather_status.startswith("❌ Failed"):
+        report["weather_error"] = weather["error"]
+    return report
+
+
+def stats():
+    return {"enabled": ENABLED, **{name: probe.summary() for name, probe in probes.items()}}
@@ -0,0 +1,102 @@
+"""
+Result cache for /detect-disease keyed by the uploaded image.
+
+Entries are addressed by the SHA-256 of the image bytes. When
+``DISEASE_CACHE_PERCEPTUAL=1`` (and Pillow is installed) a 64-bit difference
+hash is also kept, so a re-encoded or resized copy of a cached photo within
+``DISEASE_CACHE_PHASH_DISTANCE`` bits is answered from the cache too.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import cache
+import uploads
+
+PERCEPTUAL = os.getenv("DISEASE_CACHE_PERCEPTUAL", "0") == "1"
+PHASH_DISTANCE = int(os.getenv("DISEASE_CACHE_PHASH_DISTANCE", "6"))
+MAX_ENTRIES = int(os.getenv("DISEASE_CACHE_MAX_ENTRIES", "4096"))
+
+results = cache.register(
+    cache.ResponseCache("detect-disease", cache.ttl_setting("detect-disease", 7 * 24 * 3600))
+)
+
+
+def dhash(image, size=8):
+    """64-bit difference hash of the image, or None if it cannot be decoded."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    try:
+        with Image.open(uploads.open_source(image)) as img:
+            img.draft("L", (size * 8, size * 8))
+            pixels = list(img.convert("L").resize((size + 1, size), Image.BILINEAR).getdata())
+    except Exception:
+        return None
+    value = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+class PerceptualIndex:
+    """Bounded map of perceptual hash -> content digest with nearest lookup."""
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_distance=PHASH_DISTANCE):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, phash, digest):
+        with self._lock:
+            self._entries[phash] = digest
+            self._entries.move_to_end(phash)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def find(self, phash):
+        with self._lock:
+            candidates = list(self._entries.items())
+        best_digest, best_distance = None, self.max_distance + 1
+        for other, digest in candidates:
+            distance = bin(phash ^ other).count("1")
+            if distance < best_distance:
+                best_digest, best_distance = digest, distance
+        return best_digest
+
+
+index = PerceptualIndex()
+perceptual_hits = 0
+
+
+def fingerprint(image):
+    """``(sha256, dhash)`` of an image given as bytes or a binary file."""
+    digest = uploads.sha256(image)
+    phash = dhash(image) if PERCEPTUAL else None
+    return digest, phash
+
+
+def lookup(digest, phash):
+    """Return ``(result, match)`` where match is "exact" or "perceptual"."""
+    global perceptual_hits
+    result = results.get((digest,), count=False)
+    match = "exact"
+    if result is None and phash is not None:
+        similar = index.find(phash)
+        if similar is not None:
+            result = results.get((similar,), count=False)
+            match = "perceptual"
+            if result is not None:
+                perceptual_hits += 1
+    results.record(result is not None)
+    return result, match
+
+
+def store(digest, phash, result):
+    results.set((digest,), result)
+    if phash is not None:
+        index.add(phash, digest)
@@ -0,0 +1,75 @@
+"""
+Image preprocessing applied to uploads before they are sent to Gemini.
+
+Phone photos are decoded, rotated upright from their EXIF orientation,
+downscaled so the longest edge is at most ``IMAGE_MAX_EDGE`` pixels and
+re-encoded as JPEG without metadata. The re-encoded image is sent even when
+it is larger than the upload, so EXIF (GPS position, device) never reaches
+Gemini; the original bytes are kept only when they cannot be decoded.
+"""
+import io
+import logging
+import os
+import threading
+import time
+
+import uploads
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("IMAGE_PREPROCESS", "1") == "1"
+MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1024"))
+JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+
+totals = {"images": 0, "bytes_in": 0, "bytes_out": 0, "seconds": 0.0}
+_totals_lock = threading.Lock()
+
+
+def _reencode(image, max_edge, quality):
+    from PIL import Image, ImageOps
+
+    with Image.open(uploads.open_source(image)) as img:
+        # JPEG draft mode lets libjpeg decode at 1/2, 1/4 or 1/8 scale, which
+        # is much cheaper than decoding a 12 MP photo at full size.
+        img.draft("RGB", (max_edge, max_edge))
+        img = ImageOps.exif_transpose(img)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, format="JPEG", quality=quality)
+        return out.getvalue()
+
+
+def preprocess(image, mimetype, max_edge=None, quality=None):
+    """Return ``(image, mimetype, stats)`` ready for the Gemini payload.
+
+    ``image`` is bytes or a binary file (see uploads.py); the returned image
+    is the re-encoded bytes, or ``image`` itself when it was kept.
+    """
+    start = time.perf_counter()
+    data, out_mimetype = image, mimetype
+    bytes_in = uploads.size(image)
+    if ENABLED:
+        try:
+            data = _reencode(image, max_edge or MAX_EDGE, quality or JPEG_QUALITY)
+            out_mimetype = "image/jpeg"
+        except ImportError:
+            logger.warning("Pillow is not installed; sending images unprocessed")
+        except Exception as exc:
+            logger.info("Image preprocessing skipped: %s", exc)
+    elapsed = time.perf_counter() - start
+
+    bytes_out = uploads.size(data)
+    stats = {
+        "bytes_in": bytes_in,
+        "bytes_out": bytes_out,
+        "bytes_saved": bytes_in - bytes_out,
+        "ms": round(elapsed * 1000, 2),
+    }
+    with _totals_lock:
+        totals["images"] += 1
+        totals["bytes_in"] += stats["bytes_in"]
+        totals["bytes_out"] += stats["bytes_out"]
+        totals["seconds"] += elapsed
+    return data, out_mimetype, stats
@@ -0,0 +1,281 @@
+"""
+Background jobs for the slow search-grounded endpoints.
+
+``POST /gov-schemes?mode=job`` (or any request sent with
+``Prefer: respond-async``) returns ``202`` with a job id straight away; a
+worker pool runs the handler flow and stores the result for ``JOB_TTL``
+seconds, where ``GET /jobs/<id>`` picks it up (``?wait=N`` long-polls).
+
+Job ids are derived from the endpoint and the normalized request body, so a
+client that retries a submission gets the same job back instead of starting
+the upstream work again. Records live in their own SQLite file
+(``JOB_STORE_PATH``) rather than the response cache, so cache pressure can
+never evict a queued or running job; expired records are swept on
+submission. Every worker on the host reads the same file, so any of them can
+answer the poll.
+
+A heartbeat thread refreshes the queued and running jobs of its process every
+``JOB_HEARTBEAT`` seconds. A queued or running record whose heartbeat is
+three intervals old belongs to a worker that restarted or crashed; it reads
+as failed, so the next submission runs it again.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cache
+import circuit
+import handlers
+import metrics
+
+logger = logging.getLogger(__name__)
+
+WORKERS = int(os.getenv("JOB_WORKERS", "8"))
+TTL = float(os.getenv("JOB_TTL", "3600"))
+MAX_PENDING = int(os.getenv("JOB_MAX_PENDING", "256"))
+MAX_WAIT = float(os.getenv("JOB_MAX_WAIT", "30"))
+PATH = os.getenv("JOB_STORE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "jobs.sqlite3"))
+HEARTBEAT = float(os.getenv("JOB_HEARTBEAT", "10"))
+STALE_AFTER = 3 * HEARTBEAT
+POLL_INTERVAL = 0.25
+SWEEP_INTERVAL = 60
+
+ENDPOINTS = {
+    "gov-schemes": handlers.gov_schemes,
+    "market-prices": handlers.market_prices,
+    "nearby-stores": handlers.nearby_stores,
+    "weather-crop-advisory": handlers.weather_crop_advisory,
+}
+FINISHED = ("done", "failed")
+
+
+class JobStore:
+    """Job records by id in SQLite; entries expire ``ttl`` seconds after their
+    last update and are never evicted before that. An unfinished record whose
+    heartbeat is older than ``stale_after`` seconds is returned as failed."""
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, expires_at REAL NOT NULL, "
+        "record TEXT NOT NULL, heartbeat_at REAL NOT NULL DEFAULT 0)"
+    )
+
+    def __init__(self, path, ttl, stale_after=STALE_AFTER):
+        self.path = path
+        self.ttl = ttl
+        self.stale_after = stale_after
+        self.local = threading.local()
+        self.swept_at = 0.0
+
+    def connection(self):
+        """This thread's connection, creating the database on first use."""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(self.SCHEMA)
+            if "heartbeat_at" not in [row[1] for row in conn.execute("PRAGMA table_info(jobs)")]:
+                conn.execute("ALTER TABLE jobs ADD COLUMN heartbeat_at REAL NOT NULL DEFAULT 0")
+            self.local.conn = conn
+        return conn
+
+    def get(self, job_id):
+        now = time.time()
+        row = self.connection().execute(
+            "SELECT record, heartbeat_at FROM jobs WHERE job_id = ? AND expires_at > ?", (job_id, now)
+        ).fetchone()
+        if row is None:
+            return None
+        record = json.loads(row[0])
+        if record["status"] not in FINISHED and now - row[1] > self.stale_after:
+            return {**record, "status": "failed", "detail": "The worker running this job stopped. Submit it again."}
+        return record
+
+    def put(self, job_id, record):
+        now = time.time()
+        self.connection().execute(
+            "INSERT OR REPLACE INTO jobs (job_id, expires_at, record, heartbeat_at) VALUES (?, ?, ?, ?)",
+            (job_id, now + self.ttl, json.dumps(record, default=str), now),
+        )
+
+    def touch(self, job_ids):
+        """Refresh the heartbeat of ``job_ids``."""
+        if job_ids:
+            self.connection().execute(
+                f"UPDATE jobs SET heartbeat_at = ? WHERE job_id IN ({', '.join('?' * len(job_ids))})",
+                [time.time(), *job_ids],
+            )
+
+    def sweep(self):
+        """Delete expired records, at most every ``SWEEP_INTERVAL`` seconds."""
+        now = time.time()
+        if now - self.swept_at < SWEEP_INTERVAL:
+            return
+        self.swept_at = now
+        self.connection().execute("DELETE FROM jobs WHERE expires_at <= ?", (now,))
+
+    def __len__(self):
+        return self.connection().execute("SELECT COUNT(*) FROM jobs WHERE expires_at > ?", (time.time(),)).fetchone()[0]
+
+
+records = JobStore(PATH, TTL)
+
+_pool = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="job")
+_lock = threading.Lock()
+_events = {}
+_heartbeat = None
+counters = {"submitted": 0, "reused": 0, "done": 0, "failed": 0, "rejected": 0}
+
+
+def wants_job(mode, prefer):
+    return (mode or "").lower() == "job" or "respond-async" in (prefer or "").lower()
+
+
+def job_id(endpoint, body):
+    normalized = json.dumps(
+        {k: cache.normalize(v) if isinstance(v, str) else v for k, v in body.items()},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha1(f"{endpoint}\n{normalized}".encode("utf-8")).hexdigest()[:24]
+
+
+def get(job_id):
+    return records.get(job_id)
+
+
+def view(job):
+    return {**job, "poll": f"/jobs/{job['job_id']}"}
+
+
+def submit(endpoint, body):
+    """Queue ``endpoint`` with ``body``; returns ``(body, status, headers)``.
+
+    A job that is queued, running or done is returned as is; a failed,
+    expired or stale one is started again.
+    """
+    key = job_id(endpoint, body)
+    start_heartbeat()
+    with _lock:
+        records.sweep()
+        job = get(key)
+        if job is not None and job["status"] != "failed":
+            counters["reused"] += 1
+            return view(job), 202, {"Location": f"/jobs/{key}"}
+        if len(_events) >= MAX_PENDING:
+            counters["rejected"] += 1
+            return {"detail": "Too many jobs in progress. Please retry later."}, 503, {"Retry-After": "5"}
+        job = {"job_id": key, "endpoint": endpoint, "status": "queued", "created_at": time.time()}
+        records.put(key, job)
+        _events[key] = threading.Event()
+        counters["submitted"] += 1
+
+    _pool.submit(_run, job, body)
+    return view(job), 202, {"Location": f"/jobs/{key}", "Retry-After": "2"}
+
+
+def _run(job, body):
+    key = job["job_id"]
+    metrics.endpoint.set(f"job:{job['endpoint']}")
+    records.put(key, {**job, "status": "running", "started_at": time.time()})
+    try:
+        result, status_code, *_ = handlers.run(ENDPOINTS[job["endpoint"]](body))
+        outcome = "done" if status_code < 500 else "failed"
+    except circuit.Unavailable as exc:
+        (result, status_code, _), outcome = circuit.unavailable_response(exc), "failed"
+    except Exception as exc:
+        logger.exception("Job %s (%s) failed", key, job["endpoint"])
+        result, status_code, outcome = {"detail": f"Job failed: {exc}"}, 500, "failed"
+    records.put(
+        key,
+        {
+            **job,
+            "status": outcome,
+            "finished_at": time.time(),
+            "status_code": status_code,
+            "result": result,
+        },
+    )
+    with _lock:
+        counters[outcome] += 1
+        event = _events.pop(key, None)
+    if event is not None:
+        event.set()
+
+
+def _beat():
+    metrics.endpoint.set("job:heartbeat")
+    while True:
+        time.sleep(HEARTBEAT)
+        with _lock:
+            pending = list(_events)
+        try:
+            records.touch(pending)
+        except sqlite3.Error as exc:
+            logger.warning("Job heartbeat failed: %s", exc)
+
+
+def start_heartbeat():
+    """Start the heartbeat thread once per process (lazily, so it survives forking)."""
+    global _heartbeat
+    if _heartbeat is not None:
+        return
+    with _lock:
+        if _heartbeat is None:
+            _heartbeat = threading.Thread(target=_beat, name="job-heartbeat", daemon=True)
+            _heartbeat.start()
+
+
+def wait(job_id, timeout):
+    """Return the job once it has finished or ``timeout`` seconds passed."""
+    deadline = time.monotonic() + min(timeout, MAX_WAIT)
+    while True:
+        job = get(job_id)
+        remaining = deadline - time.monotonic()
+        if job is None or job["status"] in FINISHED or remaining <= 0:
+            return job
+        event = _events.get(job_id)
+        if event is not None:
+            event.wait(remaining)
+        else:
+            # Running in another worker process; poll the shared backend.
+            time.sleep(min(POLL_INTERVAL, remaining))
+
+
+async def wait_async(job_id, timeout):
+    """``wait`` for the event loop; polls instead of blocking a thread."""
+    deadline = time.monotonic() + min(timeout, MAX_WAIT)
+    while True:
+        job = get(job_id)
+        remaining = deadline - time.monotonic()
+        if job is None or job["status"] in FINISHED or remaining <= 0:
+            return job
+        await asyncio.sleep(min(POLL_INTERVAL, remaining))
+
+
+def response(job_id, job):
+    """``(body, status)`` for ``GET /jobs/<id>``."""
+    if job is None:
+        return {"detail": f"Job '{job_id}' not found or expired."}, 404
+    return view(job), 200
+
+
+def stats():
+    with _lock:
+        pending = len(_events)
+        totals = dict(counters)
+    return {**totals, "pending": pending, "stored": len(records), "workers": WORKERS, "ttl_s": TTL}
+
+
+def wait_seconds(value):
+    try:
+        return max(0.0, float(value or 0))
+    except (TypeError, ValueError):
+        return 0.0
@@ -0,0 +1,332 @@
+"""
+Prometheus-style metrics for both servers, served at ``GET /metrics``.
+
+Requests are counted and timed per route; the handler drivers time every
+stage a flow goes through (its own code as ``handler``, each upstream call,
+each ``Blocking`` step by function name), and the upstream clients record
+status codes, latency and request bytes per host. Counters kept elsewhere
+(caches, search variants, structured output, governor, circuit breakers,
+serve-stale, scheme index, single-flight) are read at scrape time, so they
+add nothing to the request path.
+
+Metrics are per process; with several gunicorn workers, scrape each one or
+aggregate in Prometheus. Observations take one short lock, so the overhead
+stays in the microseconds.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Route template of the request being served, used to label stage timings.
+endpoint = contextvars.ContextVar("metrics_endpoint", default="other")
+
+_lock = threading.Lock()
+_metrics = []
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.values = {}
+        _metrics.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with _lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        return [(self.name, _labels(self.labels, key), value) for key, value in sorted(self.values.items())]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *label_values):
+        self.inc(*label_values, amount=-1)
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}
+        _metrics.append(self)
+
+    def observe(self, seconds, *label_values):
+        with _lock:
+            entry = self.values.get(label_values)
+            if entry is None:
+                entry = self.values[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += seconds
+            entry[2] += 1
+
+    def samples(self):
+        lines = []
+        for key, (counts, total, count) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _labels(self.labels + ("le",), key + (_number(bound),))
+                lines.append((f"{self.name}_bucket", labels, cumulative))
+            lines.append((f"{self.name}_bucket", _labels(self.labels + ("le",), key + ("+Inf",)), count))
+            lines.append((f"{self.name}_sum", _labels(self.labels, key), total))
+            lines.append((f"{self.name}_count", _labels(self.labels, key), count))
+        return lines
+
+
+requests_total = Counter("krishi_requests_total", "HTTP requests served.", ("endpoint", "status"))
+request_seconds = Histogram("krishi_request_duration_seconds", "Time to produce a response.", ("endpoint",))
+in_flight = Gauge("krishi_requests_in_flight", "Requests currently being served.", ("endpoint",))
+stage_seconds = Histogram(
+    "krishi_stage_duration_seconds", "Time spent per stage of a request.", ("endpoint", "stage")
+)
+upstream_total = Counter("krishi_upstream_requests_total", "Upstream HTTP requests.", ("host", "status"))
+upstream_seconds = Histogram("krishi_upstream_duration_seconds", "Upstream request latency.", ("host",))
+upstream_bytes = Counter("krishi_upstream_request_bytes_total", "Request body bytes sent upstream.", ("host",))
+
+
+def request_started(route):
+    """Start timing a request; returns the token for ``request_finished``."""
+    in_flight.inc(route)
+    return route, endpoint.set(route), time.perf_counter()
+
+
+def request_finished(token, status):
+    route, context_token, started = token
+    request_seconds.observe(time.perf_counter() - started, route)
+    requests_total.inc(route, status)
+    in_flight.dec(route)
+    try:
+        endpoint.reset(context_token)
+    except ValueError:
+        # Finished in another context (e.g. after a streamed response).
+        pass
+
+
+def observe_stage(name, seconds):
+    stage_seconds.observe(seconds, endpoint.get(), name)
+
+
+@contextmanager
+def stage(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - started)
+
+
+def stage_name(call):
+    """Stage label for an item yielded by a handler flow."""
+    fn = getattr(call, "fn", None)
+    if fn is not None:
+        return fn.__name__
+    return "race" if hasattr(call, "calls") else "upstream"
+
+
+class FlowTimer:
+    """Splits a handler flow's time into its own code (``handler``) and the
+    work it yields, for the drivers in handlers.run and asgi_app.arun."""
+
+    def __init__(self):
+        self.handler = 0.0
+
+    def resume(self, step, value=None):
+        started = time.perf_counter()
+        try:
+            return step(value)
+        finally:
+            self.handler += time.perf_counter() - started
+
+    def waiting(self, call):
+        return stage(stage_name(call))
+
+    def finish(self):
+        observe_stage("handler", self.handler)
+
+
+def record_upstream(url, status, seconds, request_headers=None):
+    """``request_headers`` is the case-insensitive header map of the sent request."""
+    host = urlsplit(url).netloc
+    upstream_total.inc(host, status)
+    upstream_seconds.observe(seconds, host)
+    length = request_headers.get("Content-Length") if request_headers is not None else None
+    if length:
+        upstream_bytes.inc(host, amount=int(length))
+
+
+def _stats_families(single_flight):
+    """``(name, kind, help, [(labels, value)])`` for counters kept by other modules."""
+    # Imported here: these modules import upstream, which imports this one.
+    import cache
+    import circuit
+    import governor
+    import health
+    import imaging
+    import price_store
+    import prompts
+    import scheme_index
+    import search_fallback
+    import stale
+    import store_registry
+    import structured
+    import triage
+    import warmer
+
+    cache_stats = cache.stats()
+    backend = cache_stats.pop("_backend")
+    families = [
+        ("krishi_cache_hits_total", "counter", "Response cache hits.",
+         [({"cache": name}, entry["hits"]) for name, entry in cache_stats.items()]),
+        ("krishi_cache_misses_total", "counter", "Response cache misses.",
+         [({"cache": name}, entry["misses"]) for name, entry in cache_stats.items()]),
+        ("krishi_search_variant_attempts_total", "counter", "Gemini search-tool variant attempts.",
+         [({"variant": name, "outcome": outcome}, entry[outcome])
+          for name, entry in search_fallback.stats()["variants"].items()
+          for outcome in ("ok", "rejected", "errors")]),
+        ("krishi_structured_output_total", "counter", "Structured output parses by outcome.",
+         [({"schema": name, "outcome": outcome}, entry[outcome])
+          for name, entry in structured.stats()["schemas"].items()
+          for outcome in ("ok", "repaired", "failed")]),
+        ("krishi_image_bytes_in_total", "counter", "Upload bytes before preprocessing.",
+         [({}, imaging.totals["bytes_in"])]),
+        ("krishi_image_bytes_out_total", "counter", "Image bytes after preprocessing.",
+         [({}, imaging.totals["bytes_out"])]),
+    ]
+    governor_stats = governor.stats()
+    families.extend([
+        ("krishi_governor_concurrency_limit", "gauge", "Adaptive limit on concurrent Gemini calls.",
+         [({}, governor_stats["limit"])]),
+        ("krishi_governor_in_flight", "gauge", "Gemini calls admitted and not finished.",
+         [({}, governor_stats["in_flight"])]),
+        ("krishi_governor_queue_depth", "gauge", "Gemini calls waiting for admission.",
+         [({}, governor_stats["queue_depth"])]),
+        ("krishi_governor_events_total", "counter", "Governor admissions, rejections and congestion signals.",
+         [({"event": event}, governor_stats[event])
+          for event in ("admitted", "queued", "rejected", "timed_out", "throttled", "slow")]),
+    ])
+    stale_stats = stale.stats()
+    families.extend([
+        ("krishi_circuit_open", "gauge", "1 while the host's circuit breaker is open or half-open.",
+         [({"host": host}, int(entry["state"] != "closed")) for host, entry in circuit.stats().items()]),
+        ("krishi_stale_events_total", "counter", "Last-good results served and background refresh outcomes.",
+         [({"event": event}, stale_stats[event]) for event in ("served_stale", "refreshed", "refresh_failed")]),
+    ])
+    index_stats = scheme_index.stats()
+    families.extend([
+        ("krishi_scheme_index_schemes", "gauge", "Schemes in the local scheme index.",
+         [({}, index_stats["schemes"])]),
+        ("krishi_scheme_index_lookups_total", "counter", "/gov-schemes requests answered from the index or not.",
+         [({"outcome": "answered"}, index_stats["answered"]), ({"outcome": "not_covered"}, index_stats["not_covered"])]),
+        ("krishi_scheme_index_crawls_total", "counter", "Scheme-index crawls by outcome.",
+         [({"outcome": "ok"}, index_stats["crawls"]), ({"outcome": "failed"}, index_stats["crawl_failures"])]),
+    ])
+    store_stats = store_registry.stats()
+    families.extend([
+        ("krishi_store_registry_stores", "gauge", "Stores in the local store registry.",
+         [({}, store_stats["stores"])]),
+        ("krishi_store_registry_lookups_total", "counter", "/nearby-stores requests answered from the registry or sent to Gemini.",
+         [({"outcome": "answered"}, store_stats["answered"]), ({"outcome": "enriched"}, store_stats["enriched"])]),
+        ("krishi_store_registry_ingested_total", "counter", "Stores added to the registry.",
+         [({}, store_stats["ingested"])]),
+    ])
+    price_stats = price_store.stats()
+    families.extend([
+        ("krishi_price_store_lookups_total", "counter", "/market-prices requests answered from the price store or not.",
+         [({"outcome": "answered"}, price_stats["answered"]), ({"outcome": "missed"}, price_stats["missed"])]),
+        ("krishi_price_store_ingested_total", "counter", "Price records added to the price store.",
+         [({}, price_stats["ingested"])]),
+    ])
+    triage_stats = triage.stats()
+    families.append(
+        ("krishi_triage_images_total", "counter", "/detect-disease images by triage verdict.",
+         [({"verdict": verdict}, triage_stats[verdict]) for verdict in ("rejected", "local", "escalated")]),
+    )
+    prompt_stats = prompts.stats()
+    families.extend([
+        ("krishi_prompt_cache_requests_total", "counter", "Gemini calls sending the static prompt by cache handle or inline.",
+         [({"mode": "cached"}, prompt_stats["cached_requests"]), ({"mode": "inline"}, prompt_stats["inline_requests"])]),
+        ("krishi_prompt_cache_events_total", "counter", "Prompt cache creations, renewals, failures and invalidations.",
+         [({"event": event}, prompt_stats[event]) for event in ("created", "renewed", "failed", "invalidated")]),
+    ])
+    warmer_stats = warmer.stats()
+    families.extend([
+        ("krishi_warmer_keys_total", "counter", "Keys handled by the cache warmer by outcome.",
+         [({"outcome": outcome}, warmer_stats[outcome]) for outcome in ("warmed", "skipped", "failed", "deferred")]),
+        ("krishi_warmer_requests_total", "counter", "Warmable requests, on keys warmed recently or not.",
+         [({"endpoint": name, "warmed": "true"}, row["warm_requests"]) for name, row in warmer_stats["traffic"].items()]
+         + [({"endpoint": name, "warmed": "false"}, row["requests"] - row["warm_requests"])
+            for name, row in warmer_stats["traffic"].items()]),
+        ("krishi_warmer_hits_total", "counter", "Warmable requests answered without an upstream call.",
+         [({"endpoint": name, "warmed": "true"}, row["warm_hits"]) for name, row in warmer_stats["traffic"].items()]
+         + [({"endpoint": name, "warmed": "false"}, row["hits"] - row["warm_hits"])
+            for name, row in warmer_stats["traffic"].items()]),
+    ])
+    health_stats = health.stats()
+    families.extend([
+        ("krishi_upstream_up", "gauge", "1 while the upstream's health probes pass (up or degraded).",
+         [({"upstream": name}, int(health_stats[name]["state"] in ("up", "degraded")))
+          for name in health.probes if health.probes[name].configured]),
+        ("krishi_upstream_probe_error_rate", "gauge", "Failed share of the recent health probes.",
+         [({"upstream": name}, health_stats[name]["error_rate"])
+          for name in health.probes if health_stats[name].get("checked_at")]),
+    ])
+    if backend["type"] == "memory":
+        families.append(("krishi_cache_entries", "gauge", "Entries in the in-process cache.",
+                         [({}, backend["entries"])]))
+        families.append(("krishi_cache_size_bytes", "gauge", "Bytes held by the in-process cache.",
+                         [({}, backend["size_bytes"])]))
+    if single_flight is not None:
+        families.append(("krishi_single_flight_calls_total", "counter", "Upstream calls led or coalesced.",
+                         [({"role": "leader"}, single_flight["leaders"]),
+                          ({"role": "coalesced"}, single_flight["coalesced"])]))
+    return families
+
+
+def render(single_flight=None):
+    """Prometheus text exposition of every metric."""
+    lines = []
+    with _lock:
+        for metric in _metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{labels} {_number(value)}" for name, labels, value in metric.samples())
+    for name, kind, help_text, samples in _stats_families(single_flight):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
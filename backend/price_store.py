@@ -0,0 +1,447 @@
+"""
+Local time series of mandi prices for /market-prices.
+
+Every price record Gemini returns is stored in a SQLite database at
+``PRICE_STORE_PATH``, one row per (commodity, market, variety, location,
+date), as are
+bulk CSV dumps such as the Agmarknet / data.gov.in daily price files
+(``python price_store.py import dump.csv``). A /market-prices request for a
+location and commodity with prices no older than ``PRICE_MAX_AGE_DAYS`` is
+answered from the store in a few milliseconds. Gemini is only asked when
+that data is missing, and its answer is added to the store.
+
+A store row only proves that its own series is known. Requests for one
+commodity in one place are answered as soon as that series is fresh, but
+broad requests (all commodities, or all of India) are answered from the
+store only when the same query was fetched from Gemini or imported within
+``PRICE_MAX_AGE_DAYS`` days; the ``queries`` table records those.
+
+``trend``, 7- and 30-day moving averages and the 7-day percent change are
+computed locally from the stored history. All matching series are laid out
+as one NumPy matrix (series x days), so the calculation is vectorized
+instead of running per commodity. ``trend`` compares the slope of a
+least-squares fit over the last ``PRICE_TREND_DAYS`` days with the mean
+price.
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import config  # noqa: F401  loads .env when run as a script
+import cache
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("PRICE_STORE", "1") == "1"
+PATH = os.getenv("PRICE_STORE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "prices.sqlite3"))
+MAX_AGE_DAYS = int(os.getenv("PRICE_MAX_AGE_DAYS", "1"))
+TREND_DAYS = int(os.getenv("PRICE_TREND_DAYS", "14"))
+TREND_THRESHOLD = float(os.getenv("PRICE_TREND_THRESHOLD", "2"))
+MAX_ROWS = int(os.getenv("PRICE_MAX_ROWS", "50"))
+MAX_HISTORY_DAYS = 365
+# History loaded for moving averages and trends.
+WINDOW_DAYS = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS prices (
+    commodity TEXT NOT NULL COLLATE NOCASE,
+    market TEXT NOT NULL COLLATE NOCASE,
+    variety TEXT NOT NULL COLLATE NOCASE,
+    date TEXT NOT NULL,
+    location TEXT NOT NULL COLLATE NOCASE,
+    state TEXT NOT NULL COLLATE NOCASE,
+    unit TEXT NOT NULL,
+    min_price REAL,
+    max_price REAL,
+    modal_price REAL NOT NULL,
+    source TEXT NOT NULL,
+    PRIMARY KEY (commodity, market, variety, location, date)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS prices_location ON prices (location, date);
+CREATE INDEX IF NOT EXISTS prices_state ON prices (state, date);
+CREATE INDEX IF NOT EXISTS prices_market ON prices (market, date);
+CREATE TABLE IF NOT EXISTS queries (
+    location TEXT NOT NULL,
+    commodity TEXT NOT NULL,
+    date TEXT NOT NULL,
+    PRIMARY KEY (location, commodity)
+) WITHOUT ROWID;
+"""
+# Databases created before location joined the key are rebuilt on first use.
+MIGRATE_KEY = """
+DROP INDEX IF EXISTS prices_location;
+DROP INDEX IF EXISTS prices_state;
+DROP INDEX IF EXISTS prices_market;
+ALTER TABLE prices RENAME TO prices_old;
+""" + SCHEMA + """
+INSERT INTO prices SELECT * FROM prices_old;
+DROP TABLE prices_old;
+"""
+SERIES = "commodity, market, variety, location"
+ALL_INDIA = {"", "india", "all india", "all states"}
+DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d %b %Y", "%d %B %Y", "%B %d, %Y", "%b %d, %Y")
+# CSV header (lower-cased, non-alphanumerics as "_") -> column.
+CSV_COLUMNS = {
+    "commodity": "commodity", "market": "market", "variety": "variety", "state": "state",
+    "district": "location", "location": "location", "unit": "unit",
+    "arrival_date": "date", "date": "date", "price_date": "date",
+    "min_price": "min_price", "max_price": "max_price", "modal_price": "modal_price",
+    "min_x0020_price": "min_price", "max_x0020_price": "max_price", "modal_x0020_price": "modal_price",
+}
+
+counters = {"answered": 0, "missed": 0, "ingested": 0}
+_local = threading.local()
+_schema_lock = threading.Lock()
+_ready = False
+
+
+def connection():
+    """This thread's connection, creating the database on first use."""
+    global _ready
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        os.makedirs(os.path.dirname(PATH), exist_ok=True)
+        conn = sqlite3.connect(PATH, timeout=10)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with _schema_lock:
+            if not _ready:
+                key = {row["name"] for row in conn.execute("PRAGMA table_info(prices)") if row["pk"]}
+                if key and "location" not in key:
+                    logger.info("Adding location to the key of %s", PATH)
+                    conn.executescript(f"BEGIN; {MIGRATE_KEY} COMMIT;")
+                else:
+                    conn.executescript(SCHEMA)
+                _ready = True
+        _local.conn = conn
+    return conn
+
+
+def parse_date(value, default=None):
+    """ISO date for ``value`` in one of ``DATE_FORMATS``, else ``default``."""
+    text = str(value or "").strip()
+    text = re.sub(r"(\d)(st|nd|rd|th)\b", r"\1", text)
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date().isoformat()
+        except ValueError:
+            continue
+    return default
+
+
+def _price(value):
+    try:
+        number = float(str(value).replace(",", "").replace("₹", "").strip())
+    except (TypeError, ValueError):
+        return None
+    return round(number, 2) if number > 0 else None
+
+
+def clean_record(raw, defaults):
+    """Row tuple for the ``prices`` table, or None without commodity or price."""
+    commodity = " ".join(str(raw.get("commodity") or "").split())
+    modal = _price(raw.get("modal_price"))
+    day = parse_date(raw.get("date"), defaults.get("date"))
+    if not commodity or modal is None or day is None:
+        return None
+    return (
+        commodity,
+        " ".join(str(raw.get("market") or defaults.get("market") or "").split()),
+        " ".join(str(raw.get("variety") or "").split()),
+        day,
+        " ".join(str(raw.get("location") or defaults.get("location") or "").split()),
+        " ".join(str(raw.get("state") or defaults.get("state") or "").split()),
+        str(raw.get("unit") or defaults.get("unit") or "quintal").strip(),
+        _price(raw.get("min_price")),
+        _price(raw.get("max_price")),
+        modal,
+        defaults.get("source", "gemini"),
+    )
+
+
+def add_records(rows):
+    """Insert or replace row tuples (see ``clean_record``); returns the count."""
+    if not rows or not ENABLED:
+        return 0
+    conn = connection()
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO prices VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    counters["ingested"] += len(rows)
+    return len(rows)
+
+
+def record_queries(queries):
+    """Mark ``(location, commodity, date)`` queries as fully answered up to ``date``."""
+    if not queries or not ENABLED:
+        return
+    conn = connection()
+    with conn:
+        conn.executemany(
+            "INSERT INTO queries VALUES (?, ?, ?) "
+            "ON CONFLICT (location, commodity) DO UPDATE SET date = max(date, excluded.date)",
+            [(cache.normalize(location), cache.normalize(commodity), day) for location, commodity, day in queries],
+        )
+
+
+def ingest_result(result, location, commodity=""):
+    """Store the prices of a parsed Gemini /market-prices answer to the query
+    ``location`` / ``commodity``."""
+    today = date.today().isoformat()
+    defaults = {"date": parse_date(result.get("date"), today), "location": location, "source": "gemini"}
+    rows = [clean_record(raw, defaults) for raw in result.get("prices", []) if isinstance(raw, dict)]
+    rows = [row for row in rows if row]
+    try:
+        stored = add_records(rows)
+        if rows:
+            record_queries([(location, commodity, max(row[3] for row in rows))])
+        return stored
+    except sqlite3.Error as exc:
+        logger.warning("Could not store market prices: %s", exc)
+        return 0
+
+
+def import_csv(path, unit="quintal", batch=5000):
+    """Bulk-load a mandi price dump; returns ``(stored, rows read)``.
+
+    A dump lists every commodity of the districts and states it contains, so
+    those count as fetched for all-commodity queries.
+    """
+    stored = read = 0
+    latest = {}
+    with open(path, newline="", encoding="utf-8-sig") as csv_file:
+        reader = csv.reader(csv_file)
+        header = [CSV_COLUMNS.get(re.sub(r"[^a-z0-9]+", "_", name.strip().lower()).strip("_")) for name in next(reader)]
+        defaults = {"unit": unit, "source": f"csv:{os.path.basename(path)}"}
+        rows = []
+        for values in reader:
+            read += 1
+            row = clean_record({column: value for column, value in zip(header, values) if column}, defaults)
+            if row:
+                rows.append(row)
+                for place in (row[4], row[5]):
+                    if place:
+                        latest[place] = max(latest.get(place, row[3]), row[3])
+            if len(rows) >= batch:
+                stored += add_records(rows)
+                rows = []
+        stored += add_records(rows)
+    record_queries([(place, "", day) for place, day in latest.items()])
+    return stored, read
+
+
+def _where(location, commodity):
+    clauses, params = [], []
+    if cache.normalize(location) not in ALL_INDIA:
+        clauses.append("(location = ? OR state = ? OR market = ?)")
+        params += [location.strip()] * 3
+    if commodity:
+        clauses.append("commodity = ?")
+        params.append(commodity.strip())
+    return clauses, params
+
+
+def fetched(location, commodity, since):
+    """Whether the broad query ``location`` / ``commodity`` was answered as a
+    whole on or after ``since``."""
+    row = connection().execute(
+        "SELECT date FROM queries WHERE location = ? AND commodity = ?",
+        (cache.normalize(location), cache.normalize(commodity)),
+    ).fetchone()
+    return row is not None and row["date"] >= since
+
+
+def answerable_series(location, commodity, since):
+    """``fresh_series`` for requests the store can answer in full, else []."""
+    specific = commodity.strip() and cache.normalize(location) not in ALL_INDIA
+    if not specific and not fetched(location, commodity, since):
+        return []
+    return fresh_series(location, commodity, since)
+
+
+def fresh_series(location, commodity, since):
+    """``(commodity, market, variety, location)`` keys matching the request
+    with a price from ``since`` (ISO date) on, at most ``MAX_ROWS``."""
+    clauses, params = _where(location, commodity)
+    clauses.append("date >= ?")
+    params.append(since)
+    sql = (f"SELECT DISTINCT {SERIES} FROM prices WHERE {' AND '.join(clauses)} "
+           f"ORDER BY {SERIES} LIMIT {int(MAX_ROWS)}")
+    return connection().execute(sql, params).fetchall()
+
+
+def history(keys, since):
+    """Rows of the ``keys`` series from ``since`` on, oldest first."""
+    if not keys:
+        return []
+    values = ", ".join(["(?, ?, ?, ?)"] * len(keys))
+    sql = (f"SELECT * FROM prices WHERE ({SERIES}) IN (VALUES {values}) AND date >= ? "
+           f"ORDER BY {SERIES}, date")
+    return connection().execute(sql, [part for key in keys for part in key] + [since]).fetchall()
+
+
+def analyze(rows, today, window=WINDOW_DAYS):
+    """Latest row and computed statistics per (commodity, market, variety, location).
+
+    Returns ``[(latest_row, stats, [(date, modal_price)])]``. Series are laid
+    out as a ``series x days`` matrix with NaN for days without a price.
+    """
+    import numpy as np
+
+    keys, index, series = {}, [], []
+    for row in rows:
+        key = tuple(row[column].lower() for column in ("commodity", "market", "variety", "location"))
+        if key not in keys:
+            keys[key] = len(series)
+            series.append([])
+        index.append(keys[key])
+        series[keys[key]].append(row)
+    if not series:
+        return []
+
+    start = today - timedelta(days=window - 1)
+    days = np.array([(date.fromisoformat(row["date"]) - start).days for row in rows])
+    inside = (days >= 0) & (days < window)
+    prices = np.full((len(series), window), np.nan)
+    prices[np.array(index)[inside], days[inside]] = [row["modal_price"] for row, keep in zip(rows, inside) if keep]
+
+    valid = ~np.isnan(prices)
+    # Forward-fill so that each day carries the last known price.
+    last_seen = np.where(valid, np.arange(window), 0)
+    np.maximum.accumulate(last_seen, axis=1, out=last_seen)
+    filled = np.where(np.maximum.accumulate(valid, axis=1), prices[np.arange(len(series))[:, None], last_seen], np.nan)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ma7 = np.nanmean(np.where(valid[:, -7:], prices[:, -7:], np.nan), axis=1)
+        ma30 = np.nanmean(np.where(valid, prices, np.nan), axis=1)
+        latest = filled[:, -1]
+        week_ago = filled[:, -8]
+        change = (latest - week_ago) / week_ago * 100
+
+        x = np.arange(TREND_DAYS, dtype=float)
+        recent = prices[:, -TREND_DAYS:]
+        mask = ~np.isnan(recent)
+        count = mask.sum(axis=1)
+        x_mean = (mask * x).sum(axis=1) / count
+        y_mean = np.nansum(recent, axis=1) / count
+        dx = np.where(mask, x - x_mean[:, None], 0.0)
+        slope = (dx * np.nan_to_num(recent - y_mean[:, None])).sum(axis=1) / (dx ** 2).sum(axis=1)
+        # Change over a week implied by the slope, in percent of the mean.
+        weekly = slope * 7 / y_mean * 100
+
+    results = []
+    for position, rows_of_series in enumerate(series):
+        enough = count[position] >= 3 and np.isfinite(weekly[position])
+        trend = "stable"
+        if enough and weekly[position] > TREND_THRESHOLD:
+            trend = "rising"
+        elif enough and weekly[position] < -TREND_THRESHOLD:
+            trend = "falling"
+        stats = {
+            "trend": trend if enough else None,
+            "moving_avg_7d": _rounded(ma7[position]),
+            "moving_avg_30d": _rounded(ma30[position]),
+            "change_7d_pct": _rounded(change[position]),
+        }
+        results.append((rows_of_series[-1], stats, [(row["date"], row["modal_price"]) for row in rows_of_series]))
+    return results
+
+
+def _rounded(value):
+    return round(float(value), 2) if value == value and abs(value) != float("inf") else None
+
+
+def covers(location, commodity):
+    """Whether ``lookup`` would answer the request (without counting it)."""
+    if not ENABLED:
+        return False
+    since = (date.today() - timedelta(days=MAX_AGE_DAYS)).isoformat()
+    try:
+        return bool(answerable_series(location, commodity, since))
+    except sqlite3.Error:
+        return False
+
+
+def lookup(location, commodity, history_days=0):
+    """A /market-prices body built from the store, or None when the store has
+    no prices for the request from the last ``MAX_AGE_DAYS`` days."""
+    if not ENABLED:
+        return None
+    today = date.today()
+    span = max(WINDOW_DAYS, min(int(history_days or 0), MAX_HISTORY_DAYS))
+    try:
+        keys = answerable_series(location, commodity, (today - timedelta(days=MAX_AGE_DAYS)).isoformat())
+        rows = history(keys, (today - timedelta(days=span - 1)).isoformat())
+    except sqlite3.Error as exc:
+        logger.warning("Price store lookup failed: %s", exc)
+        return None
+    if not rows:
+        counters["missed"] += 1
+        return None
+    counters["answered"] += 1
+
+    prices = []
+    for row, stats, points in analyze(rows, today):
+        price = {
+            "commodity": row["commodity"],
+            "variety": row["variety"],
+            "unit": row["unit"],
+            "min_price": row["min_price"],
+            "max_price": row["max_price"],
+            "modal_price": row["modal_price"],
+            "market": row["market"],
+            "date": row["date"],
+            **stats,
+        }
+        if history_days:
+            cutoff = (today - timedelta(days=int(history_days) - 1)).isoformat()
+            price["history"] = [{"date": day, "modal_price": value} for day, value in points if day >= cutoff]
+        prices.append(price)
+    return {
+        "location": location,
+        "date": max(price["date"] for price in prices),
+        "prices": prices,
+        "source": "price-store",
+        "last_updated": max(price["date"] for price in prices),
+    }
+
+
+def stats():
+    try:
+        size = os.path.getsize(PATH)
+    except OSError:
+        size = 0
+    return {"enabled": ENABLED, "path": PATH, "size_bytes": size, "max_age_days": MAX_AGE_DAYS, **counters}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the market price store")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser("import", help="import a mandi price CSV")
+    import_parser.add_argument("csv_path", nargs="+")
+    import_parser.add_argument("--unit", default="quintal", help="unit of prices without a unit column")
+    show_parser = commands.add_parser("show", help="print the answer for a location and commodity")
+    show_parser.add_argument("location")
+    show_parser.add_argument("commodity", nargs="?", default="")
+    show_parser.add_argument("--history-days", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == "import":
+        for path in args.csv_path:
+            start = time.perf_counter()
+            stored, read = import_csv(path, args.unit)
+            print(f"{path}: stored {stored} of {read} rows in {time.perf_counter() - start:.1f} s", file=sys.stderr)
+    else:
+        print(json.dumps(lookup(args.location, args.commodity, args.history_days), indent=2))
+
+
+if __name__ == "__main__":
+    main()
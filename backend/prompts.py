@@ -0,0 +1,332 @@
+"""
+Registry of the static instruction prompts, cached with Gemini context caching.
+
+The fixed instructions and JSON schemas of /chatbot, /gov-schemes,
+/market-prices, /nearby-stores and /weather-crop-advisory are built once at
+import as ``Prompt`` objects; handlers send only the per-request text in
+``contents``. A background thread registers each prompt with the
+``cachedContents`` API and renews the TTL (``PROMPT_CACHE_TTL``) before it
+lapses, and requests then reference the cache with ``cachedContent``. A
+request that uses a cache may not set its own tools, so search-backed
+prompts get one cache per search-tool variant, created when the variant is
+first used.
+
+The prompt is sent inline as ``systemInstruction`` until its cache exists,
+with ``PROMPT_CACHE=0``, and while Gemini refuses to cache it (explicit
+caches have a minimum size; the refusal is retried after
+``PROMPT_CACHE_RETRY`` seconds). A call rejected because its cache has
+vanished is retried inline once.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+
+import metrics
+import upstream
+from config import GEMINI_URL, api_key
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("PROMPT_CACHE", "1") == "1" and "/models/" in GEMINI_URL
+TTL = int(os.getenv("PROMPT_CACHE_TTL", "3600"))
+RETRY = float(os.getenv("PROMPT_CACHE_RETRY", "21600"))
+# Renew a cache once less than this much of its TTL is left.
+RENEW_BEFORE = TTL / 4
+# Do not hand out a cache that may expire during a (120 s) request.
+USE_MARGIN = 180
+CHECK_INTERVAL = min(60.0, TTL / 8)
+# Transport errors and 5xx while creating a cache are retried sooner.
+ERROR_RETRY = 60
+
+API_ROOT, _, _model_path = GEMINI_URL.partition("/models/")
+MODEL = "models/" + _model_path.split(":")[0]
+CACHE_URL = f"{API_ROOT}/cachedContents"
+
+counters = {"cached_requests": 0, "inline_requests": 0, "created": 0, "renewed": 0, "failed": 0, "invalidated": 0}
+
+REGISTRY = {}
+_entries = {}
+_lock = threading.Lock()
+_wake = threading.Event()
+_maintainer = None
+
+
+class Prompt:
+    """A static instruction, sent inline or through its Gemini cache."""
+
+    def __init__(self, name, text):
+        self.name = name
+        self.text = text
+
+    def instruction(self):
+        return {"parts": [{"text": self.text}]}
+
+    def payload(self, base, tools=None, inline=False):
+        """``(payload, handle)``: ``base`` with this prompt and ``tools``
+        added, by cache handle (also returned) when a live one exists."""
+        if ENABLED and api_key and not inline:
+            handle = entry(self, tools).live_handle()
+            if handle is not None:
+                counters["cached_requests"] += 1
+                return {**base, "cachedContent": handle}, handle
+        counters["inline_requests"] += 1
+        payload = {**base, "systemInstruction": self.instruction()}
+        if tools:
+            payload["tools"] = tools
+        return payload, None
+
+    def send(self, base, gemini_call, timeout, tools=None):
+        """Handler sub-flow calling Gemini with this prompt; use with ``yield from``."""
+        payload, handle = self.payload(base, tools)
+        try:
+            return (yield gemini_call(payload, timeout=timeout))
+        except requests.HTTPError as exc:
+            if handle is None or getattr(exc.response, "status_code", None) not in (400, 403, 404):
+                raise
+            invalidate(handle)
+        payload, _ = self.payload(base, tools, inline=True)
+        return (yield gemini_call(payload, timeout=timeout))
+
+
+def register(name, text):
+    prompt = Prompt(name, text)
+    REGISTRY[name] = prompt
+    return prompt
+
+
+class CacheEntry:
+    """The Gemini cache of one prompt with one set of tools."""
+
+    def __init__(self, prompt, tools):
+        self.prompt = prompt
+        self.tools = tools
+        self.handle = None
+        self.expires_at = 0.0
+        self.retry_at = 0.0
+        self.error = None
+
+    def live_handle(self):
+        handle = self.handle
+        if handle is not None and self.expires_at - time.monotonic() > USE_MARGIN:
+            return handle
+        return None
+
+    def create(self):
+        body = {
+            "model": MODEL,
+            "displayName": f"krishi-{self.prompt.name}",
+            "systemInstruction": self.prompt.instruction(),
+            "ttl": f"{TTL}s",
+        }
+        if self.tools:
+            body["tools"] = self.tools
+        started = time.monotonic()
+        response = upstream.execute(upstream.Call(
+            "POST", CACHE_URL, 30, params={"key": api_key}, headers={"Content-Type": "application/json"}, json=body,
+        ))
+        self.handle, self.expires_at, self.error = response["name"], started + TTL, None
+        counters["created"] += 1
+
+    def renew(self):
+        started = time.monotonic()
+        upstream.execute(upstream.Call(
+            "PATCH", f"{API_ROOT}/{self.handle}", 30, params={"key": api_key, "updateMask": "ttl"},
+            headers={"Content-Type": "application/json"}, json={"ttl": f"{TTL}s"},
+        ))
+        self.expires_at = started + TTL
+        counters["renewed"] += 1
+
+    def maintain(self):
+        """Create or renew the cache when due; failures fall back to inline."""
+        now = time.monotonic()
+        if now < self.retry_at:
+            return
+        try:
+            if self.handle is None or self.expires_at - now <= USE_MARGIN:
+                self.create()
+            elif self.expires_at - now < RENEW_BEFORE:
+                try:
+                    self.renew()
+                except requests.HTTPError as exc:
+                    if getattr(exc.response, "status_code", None) not in (403, 404):
+                        raise
+                    self.create()
+        except Exception as exc:
+            status = getattr(getattr(exc, "response", None), "status_code", None)
+            refused = status is not None and status < 500
+            self.handle = None
+            self.retry_at = now + (RETRY if refused else ERROR_RETRY)
+            self.error = getattr(getattr(exc, "response", None), "text", "") or str(exc)
+            self.error = self.error[:200]
+            counters["failed"] += 1
+            logger.info("Prompt cache for %s unavailable, sending it inline: %s", self.prompt.name, self.error)
+
+    def stats(self):
+        remaining = self.expires_at - time.monotonic()
+        return {
+            "prompt": self.prompt.name,
+            "tools": [name for tool in self.tools or [] for name in tool],
+            "cached": self.live_handle() is not None,
+            "expires_in_s": round(remaining) if self.handle and remaining > 0 else None,
+            "retry_in_s": round(max(0.0, self.retry_at - time.monotonic())) or None,
+            "error": self.error,
+        }
+
+
+def entry(prompt, tools=None):
+    """The cache entry for ``prompt`` with ``tools``, queued for creation on first use."""
+    key = (prompt.name, json.dumps(tools, sort_keys=True) if tools else "")
+    found = _entries.get(key)
+    if found is None:
+        with _lock:
+            found = _entries.get(key)
+            if found is None:
+                found = _entries[key] = CacheEntry(prompt, tools)
+                _wake.set()
+        start()
+    return found
+
+
+def invalidate(handle):
+    """Forget ``handle`` after Gemini rejected it; the maintainer recreates it."""
+    for cache_entry in list(_entries.values()):
+        if cache_entry.handle == handle:
+            cache_entry.handle = None
+            counters["invalidated"] += 1
+    _wake.set()
+
+
+def _maintain_loop():
+    metrics.endpoint.set("job:prompt-cache")
+    while True:
+        _wake.clear()
+        for cache_entry in list(_entries.values()):
+            cache_entry.maintain()
+        _wake.wait(CHECK_INTERVAL)
+
+
+def start():
+    """Queue every registered prompt and start the maintainer thread, once per
+    process (lazily, so it survives forking)."""
+    global _maintainer
+    if not (ENABLED and api_key) or _maintainer is not None:
+        return
+    with _lock:
+        if _maintainer is not None:
+            return
+        for prompt in REGISTRY.values():
+            _entries.setdefault((prompt.name, ""), CacheEntry(prompt, None))
+        _maintainer = threading.Thread(target=_maintain_loop, name="prompt-cache", daemon=True)
+        _maintainer.start()
+
+
+def stats():
+    return {
+        "enabled": ENABLED,
+        "ttl_s": TTL,
+        "caches": [cache_entry.stats() for cache_entry in list(_entries.values())],
+        **counters,
+    }
+
+
+CHATBOT = register("chatbot", (
+    "You are a helpful agriculture assistant for farmers using our app. "
+    "Our app supports crop disease detection, land measurement, and other farm utilities. "
+    "Give practical, safe, low-cost, step-by-step advice in simple language. "
+    "If location-specific or uncertain, ask a short follow-up question before assuming. "
+    "Keep replies concise and action-oriented."
+))
+
+GOV_SCHEMES = register("gov-schemes", (
+    "Find Indian government schemes only for farmers from official or reliable public sources. "
+    "Use internet search results to provide up-to-date information. "
+    "Apply the filter preferences given in the request. "
+    "Return STRICTLY valid JSON with this schema: "
+    "{"
+    "\"state\":\"...\","
+    "\"type\":\"...\","
+    "\"schemes\":["
+    "{"
+    "\"name\":\"...\","
+    "\"state\":\"...\","
+    "\"type\":\"...\","
+    "\"summary\":\"...\","
+    "\"eligibility\":\"...\","
+    "\"benefits\":[\"...\"],"
+    "\"how_to_apply\":\"...\","
+    "\"official_links\":[\"https://...\"]"
+    "}"
+    "]"
+    "}. "
+    "Rules: include only schemes for farmers, exclude non-farmer schemes, and include official links whenever possible."
+))
+
+MARKET_PRICES = register("market-prices", (
+    "Find current market prices for agricultural commodities in the location given in the request. "
+    "Use internet search to get the most recent and accurate pricing information from reliable sources like "
+    "government mandi boards, agricultural market websites, or official price reporting systems. "
+    "Return STRICTLY valid JSON with this schema: "
+    "{"
+    "\"location\":\"...\","
+    "\"date\":\"...\","
+    "\"prices\":["
+    "{"
+    "\"commodity\":\"...\","
+    "\"variety\":\"...\","
+    "\"unit\":\"...\","
+    "\"min_price\":number,"
+    "\"max_price\":number,"
+    "\"modal_price\":number,"
+    "\"market\":\"...\","
+    "\"trend\":\"rising|falling|stable\""
+    "}"
+    "],"
+    "\"source\":\"...\","
+    "\"last_updated\":\"...\""
+    "}. "
+    "Include prices in Indian Rupees (₹) per quintal or per kg as appropriate. "
+    "If specific commodity is requested, prioritize that commodity but include related varieties."
+))
+
+NEARBY_STORES = register("nearby-stores", (
+    "Find nearby agricultural stores, pesticide shops, and farming supply stores around the location given in "
+    "the request. Use internet search to find real agricultural stores, pesticide dealers, and farming supply "
+    "shops in this area. "
+    "Return STRICTLY valid JSON with this schema: "
+    "{"
+    "\"stores\":["
+    "{"
+    "\"name\":\"...\","
+    "\"distance\":\"X.X km\","
+    "\"address\":\"...\","
+    "\"rating\":number,"
+    "\"is_open\":boolean,"
+    "\"phone\":\"+91 XXXXXXXXXX\","
+    "\"latitude\":number,"
+    "\"longitude\":number"
+    "}"
+    "],"
+    "\"location\":\"...\","
+    "\"total_stores\":number"
+    "}. "
+    "Include real store names, accurate addresses, phone numbers, and coordinates. "
+    "Calculate approximate distance from the given coordinates. "
+    "Prioritize stores that sell pesticides, fertilizers, and agricultural supplies."
+))
+
+WEATHER_ADVISORY = register("weather-advisory", (
+    "You are an agriculture advisory expert. Based on the weather forecast, suggest crops to cultivate "
+    "and practical farm actions for farmers. Keep language simple and actionable. "
+    "Return STRICTLY valid JSON with this schema: "
+    "{"
+    "\"weather_summary\":\"...\","
+    "\"recommended_crops\":[{\"crop\":\"...\",\"reason\":\"...\",\"suitability\":\"high|medium|low\"}],"
+    "\"farm_actions\":[\"...\"],"
+    "\"risk_alerts\":[\"...\"],"
+    "\"other_suggestions\":[\"...\"]"
+    "}."
+))
@@ -0,0 +1,463 @@
+"""
+Local index of government schemes for /gov-schemes.
+
+The scheme catalogue changes slowly and is mostly the same for every
+request, so instead of one search-grounded Gemini call per request the
+catalogue is crawled with one bulk call per state and kept in a JSON file
+(``SCHEME_INDEX_PATH``). Requests for a crawled state are answered from an
+in-memory inverted index over state, type, keywords (name, summary,
+benefits) and eligibility terms, which also makes ``keyword`` and
+``eligibility`` filters cheap.
+
+A background thread re-crawls indexed states older than
+``SCHEME_INDEX_REFRESH`` seconds and crawls states that were requested but
+are not indexed yet (those requests are still answered by Gemini directly).
+A state whose crawl fails is not queued again for ``SCHEME_INDEX_RETRY``
+seconds, doubling with each further failure up to a day. "All States" is
+answered locally only once every state has been crawled.
+``python scheme_index.py --crawl-all`` seeds every state, e.g. from cron.
+With several workers the file is shared: each process reloads it when it
+changes and skips states another process already refreshed.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import config  # noqa: F401  loads .env when run as a script
+import cache
+import metrics
+import search_fallback
+import structured
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("SCHEME_INDEX", "1") == "1"
+PATH = os.getenv("SCHEME_INDEX_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "scheme_index.json"))
+REFRESH = float(os.getenv("SCHEME_INDEX_REFRESH", str(7 * 24 * 3600)))
+SCHEDULE = os.getenv("SCHEME_INDEX_SCHEDULE", "1") == "1"
+# Pause between two crawls, so a refresh round does not burst the Gemini quota.
+CRAWL_PAUSE = float(os.getenv("SCHEME_INDEX_CRAWL_PAUSE", "10"))
+# First backoff after a failed crawl; doubles per consecutive failure.
+RETRY = float(os.getenv("SCHEME_INDEX_RETRY", "900"))
+MAX_RETRY = 24 * 3600
+RELOAD_INTERVAL = 30
+CHECK_INTERVAL = 600
+
+CENTRAL = "Central"
+STATES = [
+    CENTRAL,
+    "Andhra Pradesh", "Arunachal Pradesh", "Assam", "Bihar", "Chhattisgarh", "Goa", "Gujarat", "Haryana",
+    "Himachal Pradesh", "Jharkhand", "Karnataka", "Kerala", "Madhya Pradesh", "Maharashtra", "Manipur",
+    "Meghalaya", "Mizoram", "Nagaland", "Odisha", "Punjab", "Rajasthan", "Sikkim", "Tamil Nadu", "Telangana",
+    "Tripura", "Uttar Pradesh", "Uttarakhand", "West Bengal", "Andaman and Nicobar Islands", "Chandigarh",
+    "Dadra and Nagar Haveli and Daman and Diu", "Delhi", "Jammu and Kashmir", "Ladakh", "Lakshadweep",
+    "Puducherry",
+]
+TYPES = [
+    "Income Support", "Crop Insurance", "Credit/Loan", "Irrigation/Water Management", "Market Access/Trade",
+    "Infrastructure/Credit", "Soil Management/Advisory", "Mechanization/Subsidy", "Production Enhancement/Subsidy",
+]
+ALL_STATES = "all states"
+ALL_TYPES = "all types"
+
+STOPWORDS = frozenset(
+    "a an and are as at be by for from in is it of on or the to with under scheme schemes yojana farmer "
+    "farmers per year who can all any this that their its".split()
+)
+
+_states_by_key = {cache.normalize(state): state for state in STATES}
+
+
+def tokens(text):
+    """Lower-case word tokens without stopwords; a plural ``s`` is dropped."""
+    result = set()
+    for word in re.findall(r"[a-z0-9]+", str(text or "").lower()):
+        if len(word) < 2 or word in STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        result.add(word)
+    return result
+
+
+def canonical_state(state):
+    """The ``STATES`` spelling of ``state``; None for unknown names."""
+    key = cache.normalize(state)
+    if key in ("central", "all india", "india", "national", ALL_STATES):
+        return CENTRAL
+    return _states_by_key.get(key)
+
+
+def needed(state):
+    """States that must be crawled to answer ``state``: itself and Central,
+    or every state for "All States"; empty for unknown names."""
+    if cache.normalize(state) == ALL_STATES:
+        return list(STATES)
+    canonical = canonical_state(state)
+    if canonical is None:
+        return []
+    return [CENTRAL] if canonical == CENTRAL else [CENTRAL, canonical]
+
+
+def scheme_id(scheme):
+    key = f"{cache.normalize(scheme.get('name'))}|{cache.normalize(scheme.get('state'))}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+
+
+def _text_list(value):
+    if isinstance(value, list):
+        return [str(item) for item in value if item]
+    return [str(value)] if value else []
+
+
+def clean_scheme(raw, crawl_state):
+    """Normalize a crawled scheme; None when it has no name, or is a central
+    scheme listed by a state crawl (the central crawl owns those)."""
+    name = str(raw.get("name") or "").strip()
+    if not name:
+        return None
+    state = canonical_state(raw.get("state")) or crawl_state
+    if state == CENTRAL and crawl_state != CENTRAL:
+        return None
+    scheme = {
+        "name": name,
+        "state": "All States" if state == CENTRAL else state,
+        "type": str(raw.get("type") or "").strip(),
+        "summary": str(raw.get("summary") or "").strip(),
+        "eligibility": str(raw.get("eligibility") or "").strip(),
+        "benefits": _text_list(raw.get("benefits")),
+        "how_to_apply": str(raw.get("how_to_apply") or "").strip(),
+        "official_links": _text_list(raw.get("official_links")),
+    }
+    scheme["id"] = scheme_id(scheme)
+    scheme["crawl_state"] = crawl_state
+    return scheme
+
+
+class SchemeIndex:
+    """Schemes plus postings from ``field:token`` to scheme ids."""
+
+    def __init__(self, schemes=(), crawled=None):
+        self.schemes = {}
+        self.crawled = dict(crawled or {})
+        self.postings = defaultdict(set)
+        for scheme in schemes:
+            self._add(scheme)
+
+    def _add(self, scheme):
+        scheme_key = scheme["id"]
+        self.schemes[scheme_key] = scheme
+        state = CENTRAL if scheme["state"] == "All States" else scheme["state"]
+        self.postings[f"state:{cache.normalize(state)}"].add(scheme_key)
+        for token in tokens(scheme["type"]):
+            self.postings[f"type:{token}"].add(scheme_key)
+        for token in tokens(" ".join([scheme["name"], scheme["summary"], scheme["type"], *scheme["benefits"]])):
+            self.postings[f"kw:{token}"].add(scheme_key)
+        for token in tokens(scheme["eligibility"]):
+            self.postings[f"elig:{token}"].add(scheme_key)
+
+    def replace_state(self, crawl_state, schemes, crawled_at):
+        """A new index with ``crawl_state``'s schemes replaced by ``schemes``."""
+        kept = [s for s in self.schemes.values() if s["crawl_state"] != crawl_state]
+        return SchemeIndex(kept + list(schemes), {**self.crawled, crawl_state: crawled_at})
+
+    def covers(self, state):
+        """Whether requests for ``state`` can be answered from the index."""
+        return bool(needed(state)) and all(name in self.crawled for name in needed(state))
+
+    def _all(self, field, words):
+        """Ids matching every token of ``words`` in ``field``; None when
+        ``words`` has no searchable token."""
+        result = None
+        for token in tokens(words):
+            ids = self.postings.get(f"{field}:{token}", set())
+            result = ids if result is None else result & ids
+            if not result:
+                return set()
+        return result
+
+    def search(self, state, scheme_type=None, keyword=None, eligibility=None):
+        """Schemes for ``state`` (plus central ones), filtered by type and by
+        every token of ``keyword`` and ``eligibility``; state schemes first."""
+        canonical = canonical_state(state)
+        if cache.normalize(state) == ALL_STATES:
+            ids = set(self.schemes)
+        else:
+            ids = self.postings.get(f"state:{cache.normalize(canonical)}", set()) | self.postings.get(
+                f"state:{cache.normalize(CENTRAL)}", set()
+            )
+        for field, words in (("type", scheme_type), ("kw", keyword), ("elig", eligibility)):
+            if words and cache.normalize(words) != ALL_TYPES:
+                matched = self._all(field, words)
+                if matched is not None:
+                    ids = ids & matched
+        ordered = sorted(
+            (self.schemes[scheme_key] for scheme_key in ids),
+            key=lambda s: (s["state"] == "All States", s["name"].lower()),
+        )
+        return [{k: v for k, v in s.items() if k not in ("id", "crawl_state")} for s in ordered]
+
+    def to_json(self):
+        return {"version": 1, "crawled": self.crawled, "schemes": list(self.schemes.values())}
+
+    def stats(self):
+        oldest = min(self.crawled.values(), default=None)
+        return {
+            "schemes": len(self.schemes),
+            "states_indexed": len(self.crawled),
+            "postings": len(self.postings),
+            "oldest_crawl": _iso(oldest) if oldest else None,
+        }
+
+
+def _iso(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat(timespec="seconds")
+
+
+_index = SchemeIndex()
+_loaded_mtime = None
+_checked_at = 0.0
+_lock = threading.Lock()
+_write_lock = threading.Lock()
+_wanted = []
+# state -> (consecutive failed crawls, monotonic time before which it is not retried)
+_failures = {}
+_wake = threading.Event()
+_scheduler = None
+counters = {"answered": 0, "not_covered": 0, "crawls": 0, "crawl_failures": 0}
+
+
+def load(path=PATH):
+    """(Re)load the index file if it changed since the last load."""
+    global _index, _loaded_mtime
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return _index
+    if mtime == _loaded_mtime:
+        return _index
+    try:
+        with open(path, encoding="utf-8") as index_file:
+            data = json.load(index_file)
+        index = SchemeIndex(data.get("schemes", []), data.get("crawled", {}))
+    except (OSError, ValueError, KeyError) as exc:
+        logger.warning("Could not load scheme index %s: %s", path, exc)
+        return _index
+    with _lock:
+        _index, _loaded_mtime = index, mtime
+    return index
+
+
+def save(index, path=PATH):
+    global _loaded_mtime
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as index_file:
+        json.dump(index.to_json(), index_file)
+    os.replace(tmp_path, path)
+    _loaded_mtime = os.path.getmtime(path)
+
+
+def current():
+    """The loaded index, re-checking the file at most every ``RELOAD_INTERVAL``."""
+    global _checked_at
+    now = time.monotonic()
+    if now - _checked_at > RELOAD_INTERVAL:
+        _checked_at = now
+        load()
+    return _index
+
+
+def lookup(state, scheme_type, keyword=None, eligibility=None):
+    """Response body for a request the index covers, else None (and the
+    state is queued for crawling)."""
+    if not ENABLED:
+        return None
+    index = current()
+    if not index.covers(state):
+        counters["not_covered"] += 1
+        want(state)
+        return None
+    counters["answered"] += 1
+    with metrics.stage("scheme-index"):
+        schemes = index.search(state, scheme_type, keyword, eligibility)
+    body = {"state": state, "type": scheme_type, "schemes": schemes, "source": "index"}
+    if keyword:
+        body["keyword"] = keyword
+    if eligibility:
+        body["eligibility"] = eligibility
+    body["indexed_at"] = _iso(min(index.crawled[name] for name in needed(state)))
+    return body
+
+
+def crawl_prompt(state):
+    where = "central (all-India)" if state == CENTRAL else f"the state of {state}"
+    return (
+        f"List all current Indian government schemes for farmers run by {where}, "
+        "using internet search results from official or reliable public sources. "
+        "Include only schemes for farmers and up to 60 of them. "
+        f"Use one of these types for each scheme: {', '.join(TYPES)}. "
+        "Return STRICTLY valid JSON with this schema: "
+        "{"
+        "\"schemes\":["
+        "{"
+        "\"name\":\"...\","
+        f"\"state\":\"{'All States' if state == CENTRAL else state}\","
+        "\"type\":\"...\","
+        "\"summary\":\"...\","
+        "\"eligibility\":\"...\","
+        "\"benefits\":[\"...\"],"
+        "\"how_to_apply\":\"...\","
+        "\"official_links\":[\"https://...\"]"
+        "}"
+        "]"
+        "}."
+    )
+
+
+def crawl_flow(state, gemini_call):
+    """Handler flow returning the cleaned schemes of one state."""
+    payload = {
+        "contents": [{"parts": [{"text": crawl_prompt(state)}]}],
+        "generationConfig": {"temperature": 0.1, "responseMimeType": "application/json"},
+    }
+    response_json = yield from search_fallback.generate(payload, gemini_call, timeout=180)
+    result = structured.parse(response_json, "schemes")
+    schemes = [clean_scheme(raw, state) for raw in result["schemes"] if isinstance(raw, dict)]
+    return [scheme for scheme in schemes if scheme is not None]
+
+
+def crawl(state):
+    """Crawl ``state`` now and persist the updated index."""
+    # Imported here: handlers imports this module.
+    import handlers
+
+    metrics.endpoint.set("job:scheme-index")
+    try:
+        schemes = handlers.run(crawl_flow(state, handlers.gemini_call))
+    except Exception as exc:
+        _crawl_failed(state, exc)
+        return False
+    if not schemes:
+        _crawl_failed(state, "no schemes returned")
+        return False
+    global _index
+    with _write_lock:
+        # Another worker may have written the file meanwhile; merge into the latest.
+        index = load().replace_state(state, schemes, time.time())
+        save(index)
+        with _lock:
+            _index = index
+    with _lock:
+        _failures.pop(state, None)
+    counters["crawls"] += 1
+    logger.info("Indexed %d schemes for %s", len(schemes), state)
+    return True
+
+
+def _crawl_failed(state, reason):
+    counters["crawl_failures"] += 1
+    with _lock:
+        failures = _failures.get(state, (0, 0.0))[0] + 1
+        delay = min(MAX_RETRY, RETRY * 2 ** (failures - 1))
+        _failures[state] = (failures, time.monotonic() + delay)
+    logger.warning("Scheme crawl for %s failed (%s); not retrying for %d s", state, reason, delay)
+
+
+def backing_off(state):
+    """Whether ``state`` failed recently and is not crawled again yet. Call with ``_lock`` held."""
+    failure = _failures.get(state)
+    return failure is not None and time.monotonic() < failure[1]
+
+
+def want(state):
+    """Queue the states needed to answer ``state`` (see ``needed``) for crawling."""
+    if not SCHEDULE:
+        return
+    with _lock:
+        for name in needed(state):
+            if name not in _wanted and name not in _index.crawled and not backing_off(name):
+                _wanted.append(name)
+    start_scheduler()
+    _wake.set()
+
+
+def next_due():
+    with _lock:
+        while _wanted:
+            state = _wanted.pop(0)
+            if not backing_off(state):
+                return state
+        now = time.time()
+        due = [
+            (crawled_at, state) for state, crawled_at in _index.crawled.items()
+            if now - crawled_at > REFRESH and not backing_off(state)
+        ]
+    return min(due)[1] if due else None
+
+
+def _schedule_loop():
+    while True:
+        load()
+        state = next_due()
+        if state is None:
+            _wake.wait(CHECK_INTERVAL)
+            _wake.clear()
+            continue
+        crawl(state)
+        time.sleep(CRAWL_PAUSE)
+
+
+def start_scheduler():
+    """Start the crawl thread once per process (lazily, so it survives forking)."""
+    global _scheduler
+    if not (ENABLED and SCHEDULE) or _scheduler is not None:
+        return
+    with _lock:
+        if _scheduler is None:
+            _scheduler = threading.Thread(target=_schedule_loop, name="scheme-index", daemon=True)
+            _scheduler.start()
+
+
+def stats():
+    return {
+        "enabled": ENABLED,
+        "path": PATH,
+        **current().stats(),
+        "queued_states": list(_wanted),
+        "backing_off": {
+            state: round(retry_at - time.monotonic()) for state, (_, retry_at) in list(_failures.items())
+            if retry_at > time.monotonic()
+        },
+        **counters,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Crawl the scheme index")
+    parser.add_argument("--state", action="append", default=[], help="state to crawl (repeatable)")
+    parser.add_argument("--crawl-all", action="store_true", help="crawl every state")
+    parser.add_argument("--stale-only", action="store_true", help="skip states crawled within the refresh period")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    states = STATES if args.crawl_all else [canonical_state(state) or state for state in args.state]
+    failed = 0
+    for state in states:
+        crawled_at = load().crawled.get(state)
+        if args.stale_only and crawled_at and time.time() - crawled_at < REFRESH:
+            continue
+        failed += not crawl(state)
+    print(json.dumps(current().stats(), indent=2))
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Search-tool fallback shared by /gov-schemes, /market-prices and /nearby-stores.
+
+Gemini accepts either the ``google_search`` or the older
+``google_search_retrieval`` tool depending on the model, and rejects the
+other with a 400. The variant the API last accepted is remembered for
+``SEARCH_VARIANT_TTL`` seconds and tried first, so only the first request
+after a change pays for the rejected round trip. With
+``SEARCH_VARIANT_RACE=1`` both search-tool variants are sent at once and the
+first success wins; the other is cancelled (ASGI) or ignored (Flask). The
+plain variant (no search grounding) is only used once both are rejected.
+"""
+import os
+import threading
+import time
+
+import requests
+
+import metrics
+import upstream
+
+PREFERENCE_TTL = float(os.getenv("SEARCH_VARIANT_TTL", "3600"))
+RACE = os.getenv("SEARCH_VARIANT_RACE", "0") == "1"
+
+VARIANTS = [
+    ("google_search", {"tools": [{"google_search": {}}]}),
+    ("google_search_retrieval", {"tools": [{"google_search_retrieval": {}}]}),
+    ("plain", {}),
+]
+
+_lock = threading.Lock()
+_preferred = {"name": None, "expires_at": 0.0}
+_stats = {name: {"ok": 0, "rejected": 0, "errors": 0, "latency_s": 0.0} for name, _ in VARIANTS}
+
+
+def ordered_variants():
+    with _lock:
+        name = _preferred["name"] if _preferred["expires_at"] > time.monotonic() else None
+    if name is None:
+        return list(VARIANTS)
+    return [v for v in VARIANTS if v[0] == name] + [v for v in VARIANTS if v[0] != name]
+
+
+def remember(name):
+    with _lock:
+        _preferred["name"] = name
+        _preferred["expires_at"] = time.monotonic() + PREFERENCE_TTL
+
+
+def forget(name):
+    with _lock:
+        if _preferred["name"] == name:
+            _preferred["name"] = None
+
+
+def record(name, outcome, elapsed):
+    metrics.observe_stage(f"search:{name}", elapsed)
+    with _lock:
+        entry = _stats[name]
+        entry[outcome] += 1
+        entry["latency_s"] += elapsed
+
+
+def stats():
+    with _lock:
+        preferred = _preferred["name"] if _preferred["expires_at"] > time.monotonic() else None
+        variants = {}
+        for name, entry in _stats.items():
+            calls = entry["ok"] + entry["rejected"] + entry["errors"]
+            variants[name] = {
+                "ok": entry["ok"],
+                "rejected": entry["rejected"],
+                "errors": entry["errors"],
+                "avg_latency_ms": round(entry["latency_s"] / calls * 1000, 1) if calls else 0.0,
+            }
+    return {"preferred": preferred, "race": RACE, "variants": variants}
+
+
+def generate(base_payload, gemini_call, timeout, prompt=None):
+    """Handler sub-flow returning the Gemini response JSON; use with ``yield from``.
+
+    ``prompt`` is the endpoint's ``prompts.Prompt``, sent with each variant's
+    tools (through its cache when there is one).
+    """
+    order = ordered_variants()
+
+    def payload(extra):
+        if prompt is None:
+            return {**base_payload, **extra}
+        return prompt.payload(base_payload, extra.get("tools"))[0]
+
+    if RACE and order[0][1]:
+        racers = [v for v in order if v[1]]
+        calls = [gemini_call(payload(extra), timeout=timeout) for _, extra in racers]
+        started = time.monotonic()
+        try:
+            index, response_json = yield upstream.Race(calls)
+        except requests.HTTPError as http_exc:
+            status_code = getattr(http_exc.response, "status_code", None)
+            record(racers[0][0], "rejected" if status_code == 400 else "errors", time.monotonic() - started)
+            if status_code != 400:
+                raise
+            order = [v for v in order if not v[1]]
+        else:
+            name = racers[index][0]
+            record(name, "ok", time.monotonic() - started)
+            remember(name)
+            return response_json
+
+    last_error = None
+    for name, extra in order:
+        started = time.monotonic()
+        try:
+            if prompt is None:
+                response_json = yield gemini_call({**base_payload, **extra}, timeout=timeout)
+            else:
+                response_json = yield from prompt.send(base_payload, gemini_call, timeout, extra.get("tools"))
+        except requests.HTTPError as http_exc:
+            status_code = getattr(http_exc.response, "status_code", None)
+            record(name, "rejected" if status_code == 400 else "errors", time.monotonic() - started)
+            if status_code != 400:
+                raise
+            forget(name)
+            last_error = http_exc
+            continue
+        except Exception:
+            record(name, "errors", time.monotonic() - started)
+            raise
+        record(name, "ok", time.monotonic() - started)
+        remember(name)
+        return response_json
+
+    raise last_error if last_error else RuntimeError("No successful Gemini response")
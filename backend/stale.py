@@ -0,0 +1,132 @@
+"""
+Serve-stale fallback for /market-prices, /gov-schemes and /weather-crop-advisory.
+
+Every good answer is also kept as the key's *last good* result for
+``CACHE_TTL_LAST_GOOD`` seconds, well past the response caches' TTLs. When a
+request misses the fresh cache and a last good result exists, the upstream
+part of the handler runs on a background thread and the request waits at
+most ``STALE_DEADLINE`` seconds for it. A fresh answer is returned as usual;
+a failure, an open circuit or a slow upstream returns the last good result
+at once, with a ``stale`` block in the body and ``Age`` / ``Warning: 110``
+headers. The background run carries on and refreshes the caches if it
+succeeds; concurrent requests for the same key share it. While the health
+probes (health.py) find Gemini down, the last good result is returned
+without waiting.
+
+Requests without a last good result run the upstream part inline, as before.
+"""
+import concurrent.futures
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import cache
+import circuit
+import health
+import upstream
+
+logger = logging.getLogger(__name__)
+
+STALE_TTL = cache.ttl_setting("last-good", 7 * 24 * 3600)
+DEADLINE = float(os.getenv("STALE_DEADLINE", "8"))
+REFRESH_WORKERS = int(os.getenv("STALE_REFRESH_WORKERS", "8"))
+
+last_good = cache.register(cache.ResponseCache("last-good", STALE_TTL))
+
+_pool = ThreadPoolExecutor(max_workers=REFRESH_WORKERS, thread_name_prefix="stale-refresh")
+_inflight = {}
+_lock = threading.Lock()
+counters = {"served_stale": 0, "refreshed": 0, "refresh_failed": 0}
+
+
+def good(result):
+    body, status, *_ = result
+    return status == 200 and isinstance(body, dict) and "detail" not in body
+
+
+def remember(name, key, body):
+    last_good.set((name, *key), {"stored_at": time.time(), "body": body})
+
+
+def serve(name, key, fetch):
+    """Handler sub-flow around ``fetch``, the upstream part of an endpoint (a
+    flow returning ``(body, status)``); use with ``yield from``."""
+    entry = last_good.get((name, *key)) if STALE_TTL > 0 else None
+    if entry is None:
+        result = yield from fetch
+        if good(result):
+            remember(name, key, result[0])
+        return result
+
+    # With Gemini down there is no point waiting: answer from the last good
+    # result now and leave the refresh running in the background.
+    gemini_down = health.down("gemini")
+    result, reason = yield upstream.Blocking(wait_for_refresh, refresh(name, key, fetch), 0 if gemini_down else DEADLINE)
+    if result is not None and good(result):
+        return result
+    if gemini_down:
+        reason = "unavailable"
+    counters["served_stale"] += 1
+    age = int(time.time() - entry["stored_at"])
+    stored_at = datetime.fromtimestamp(entry["stored_at"], timezone.utc).isoformat(timespec="seconds")
+    body = {**entry["body"], "stale": {"age_s": age, "stored_at": stored_at, "reason": reason or "error"}}
+    return body, 200, {"Age": str(age), "Warning": '110 - "Response is Stale"'}
+
+
+def refresh(name, key, fetch):
+    """Run ``fetch`` in the background unless a run for the key is in flight."""
+    with _lock:
+        future = _inflight.get((name, key))
+        if future is not None:
+            fetch.close()
+            return future
+        future = _pool.submit(contextvars.copy_context().run, _run, name, key, fetch)
+        _inflight[(name, key)] = future
+    future.add_done_callback(lambda _: _forget(name, key))
+    return future
+
+
+def _forget(name, key):
+    with _lock:
+        _inflight.pop((name, key), None)
+
+
+def _run(name, key, fetch):
+    # Imported here: handlers imports this module.
+    import handlers
+
+    try:
+        result = handlers.run(fetch)
+    except Exception as exc:
+        counters["refresh_failed"] += 1
+        logger.warning("Refresh of %s %r failed: %s", name, key, exc)
+        raise
+    if good(result):
+        remember(name, key, result[0])
+        counters["refreshed"] += 1
+    else:
+        counters["refresh_failed"] += 1
+    return result
+
+
+def wait_for_refresh(future, timeout):
+    """``(result, None)``, or ``(None, reason)`` when the refresh failed or
+    did not finish within ``timeout`` seconds."""
+    try:
+        return future.result(timeout), None
+    except concurrent.futures.TimeoutError:
+        return None, "timeout"
+    except circuit.Unavailable:
+        return None, "unavailable"
+    except Exception:
+        return None, "error"
+
+
+def stats():
+    with _lock:
+        in_flight = len(_inflight)
+    return {"ttl_s": STALE_TTL, "deadline_s": DEADLINE, "refreshing": in_flight, **counters}
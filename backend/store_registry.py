@@ -0,0 +1,279 @@
+"""
+Local registry of agri-input stores for /nearby-stores.
+
+Stores come from earlier Gemini answers (only entries with coordinates
+near the request point are kept) and from CSV imports
+(``python store_registry.py import stores.csv``). The registry is persisted as
+JSON at ``STORE_REGISTRY_PATH`` and indexed in memory in buckets of
+``GRID_DEG`` degrees of latitude/longitude. A query reads only the buckets
+that overlap its radius and ranks them by haversine distance, so lookups take
+well under a millisecond.
+
+A request is answered from the registry when at least
+``STORE_MIN_COVERAGE`` stores lie within ``STORE_RADIUS_KM``. Otherwise
+Gemini is asked as before, and its stores are added to the registry to
+enrich that region.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import logging
+import math
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+
+import config  # noqa: F401  loads .env when run as a script
+import cache
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("STORE_REGISTRY", "1") == "1"
+PATH = os.getenv("STORE_REGISTRY_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "stores.json"))
+RADIUS_KM = float(os.getenv("STORE_RADIUS_KM", "25"))
+MIN_COVERAGE = int(os.getenv("STORE_MIN_COVERAGE", "3"))
+MAX_RESULTS = int(os.getenv("STORE_MAX_RESULTS", "10"))
+# Bucket size; 0.1 degree is about 11 km north-south.
+GRID_DEG = 0.1
+# Gemini stores further than this from the request point are not trusted.
+INGEST_MAX_KM = 3 * RADIUS_KM
+EARTH_RADIUS_KM = 6371.0088
+RELOAD_INTERVAL = 30
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def coordinates(latitude, longitude):
+    """``(lat, lon)`` as floats, or None when missing or out of range."""
+    try:
+        lat, lon = float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180) or (lat == 0 and lon == 0) or math.isnan(lat + lon):
+        return None
+    return lat, lon
+
+
+def bucket(lat, lon):
+    return (math.floor(lat / GRID_DEG), math.floor(lon / GRID_DEG))
+
+
+def store_id(name, lat, lon):
+    key = f"{cache.normalize(name)}|{lat:.3f}|{lon:.3f}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+
+
+def clean_store(raw, source):
+    """Normalize a store record; None without a name or valid coordinates."""
+    name = str(raw.get("name") or "").strip()
+    point = coordinates(raw.get("latitude"), raw.get("longitude"))
+    if not name or point is None:
+        return None
+    try:
+        rating = round(float(raw.get("rating")), 1)
+    except (TypeError, ValueError):
+        rating = None
+    return {
+        "id": store_id(name, *point),
+        "name": name,
+        "address": str(raw.get("address") or "").strip(),
+        "phone": str(raw.get("phone") or "").strip(),
+        "rating": rating,
+        "latitude": point[0],
+        "longitude": point[1],
+        "source": source,
+        "updated_at": time.time(),
+    }
+
+
+class StoreRegistry:
+    """Stores by id, bucketed on a ``GRID_DEG`` lat/lon grid."""
+
+    def __init__(self, stores=()):
+        self.stores = {}
+        self.buckets = defaultdict(set)
+        for store in stores:
+            self.add(store)
+
+    def add(self, store):
+        old = self.stores.get(store["id"])
+        if old is not None:
+            self.buckets[bucket(old["latitude"], old["longitude"])].discard(old["id"])
+        self.stores[store["id"]] = store
+        self.buckets[bucket(store["latitude"], store["longitude"])].add(store["id"])
+
+    def within(self, lat, lon, radius_km):
+        """``[(distance_km, store)]`` within ``radius_km``, nearest first."""
+        dlat = radius_km / 111.2
+        dlon = radius_km / max(0.01, 111.2 * math.cos(math.radians(lat)))
+        low, high = bucket(lat - dlat, lon - dlon), bucket(lat + dlat, lon + dlon)
+        found = []
+        for row in range(low[0], high[0] + 1):
+            for column in range(low[1], high[1] + 1):
+                for key in self.buckets.get((row, column), ()):
+                    store = self.stores[key]
+                    distance = haversine_km(lat, lon, store["latitude"], store["longitude"])
+                    if distance <= radius_km:
+                        found.append((distance, store))
+        found.sort(key=lambda pair: pair[0])
+        return found
+
+    def nearest(self, lat, lon, k, radius_km):
+        return self.within(lat, lon, radius_km)[:k]
+
+    def to_json(self):
+        return {"version": 1, "stores": list(self.stores.values())}
+
+
+def response_store(distance, store):
+    """Registry entry in the /nearby-stores response shape."""
+    return {
+        "name": store["name"],
+        "distance": f"{distance:.1f} km",
+        "distance_km": round(distance, 2),
+        "address": store["address"],
+        "rating": store["rating"],
+        "is_open": None,
+        "phone": store["phone"],
+        "latitude": store["latitude"],
+        "longitude": store["longitude"],
+    }
+
+
+_registry = StoreRegistry()
+_loaded_mtime = None
+_checked_at = 0.0
+_lock = threading.Lock()
+counters = {"answered": 0, "enriched": 0, "ingested": 0}
+
+
+def load(path=PATH):
+    """(Re)load the registry file if it changed since the last load."""
+    global _registry, _loaded_mtime
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return _registry
+    if mtime == _loaded_mtime:
+        return _registry
+    try:
+        with open(path, encoding="utf-8") as registry_file:
+            registry = StoreRegistry(json.load(registry_file).get("stores", []))
+    except (OSError, ValueError, KeyError) as exc:
+        logger.warning("Could not load store registry %s: %s", path, exc)
+        return _registry
+    _registry, _loaded_mtime = registry, mtime
+    return registry
+
+
+def save(registry, path=PATH):
+    global _loaded_mtime
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as registry_file:
+        json.dump(registry.to_json(), registry_file)
+    os.replace(tmp_path, path)
+    _loaded_mtime = os.path.getmtime(path)
+
+
+def current():
+    """The loaded registry, re-checking the file at most every ``RELOAD_INTERVAL``."""
+    global _checked_at
+    now = time.monotonic()
+    if now - _checked_at > RELOAD_INTERVAL:
+        _checked_at = now
+        with _lock:
+            load()
+    return _registry
+
+
+def lookup(lat, lon):
+    """Nearest stores in the response shape when the area is covered, else None."""
+    if not ENABLED:
+        return None
+    found = current().nearest(lat, lon, MAX_RESULTS, RADIUS_KM)
+    if len(found) < MIN_COVERAGE:
+        counters["enriched"] += 1
+        return None
+    counters["answered"] += 1
+    return [response_store(distance, store) for distance, store in found]
+
+
+def nearest(lat, lon):
+    return [response_store(distance, store) for distance, store in current().nearest(lat, lon, MAX_RESULTS, RADIUS_KM)]
+
+
+def add_stores(raw_stores, source, near=None):
+    """Add stores and persist the registry; returns how many were kept.
+
+    With ``near=(lat, lon)``, stores further than ``INGEST_MAX_KM`` from it
+    are dropped (coordinates Gemini made up for a different place).
+    """
+    stores = [store for store in (clean_store(raw, source) for raw in raw_stores if isinstance(raw, dict)) if store]
+    if near is not None:
+        stores = [s for s in stores if haversine_km(*near, s["latitude"], s["longitude"]) <= INGEST_MAX_KM]
+    if not stores or not ENABLED:
+        return 0
+    global _registry
+    with _lock:
+        # Merge into the latest file in case another worker wrote it, and
+        # swap in a copy: lookups read the live registry without the lock.
+        registry = StoreRegistry(load().stores.values())
+        for store in stores:
+            registry.add(store)
+        try:
+            save(registry)
+        except OSError as exc:
+            logger.warning("Could not save store registry %s: %s", PATH, exc)
+        _registry = registry
+    counters["ingested"] += len(stores)
+    return len(stores)
+
+
+def import_csv(path):
+    """Import ``name,address,phone,rating,latitude,longitude`` rows (header required)."""
+    with open(path, newline="", encoding="utf-8") as csv_file:
+        rows = list(csv.DictReader(csv_file))
+    return add_stores(rows, "csv"), len(rows)
+
+
+def stats():
+    registry = current()
+    return {
+        "enabled": ENABLED,
+        "path": PATH,
+        "stores": len(registry.stores),
+        "buckets": len(registry.buckets),
+        "radius_km": RADIUS_KM,
+        "min_coverage": MIN_COVERAGE,
+        **counters,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the store registry")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser("import", help="import stores from CSV")
+    import_parser.add_argument("csv_path")
+    near_parser = commands.add_parser("near", help="list stores near a point")
+    near_parser.add_argument("latitude", type=float)
+    near_parser.add_argument("longitude", type=float)
+    args = parser.parse_args()
+
+    load()
+    if args.command == "import":
+        kept, total = import_csv(args.csv_path)
+        print(f"Imported {kept} of {total} rows into {PATH}", file=sys.stderr)
+    else:
+        print(json.dumps(nearest(args.latitude, args.longitude), indent=2))
+
+
+if __name__ == "__main__":
+    main()
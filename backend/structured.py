@@ -0,0 +1,247 @@
+"""
+Structured (JSON) output parsing shared by the Gemini-backed endpoints.
+
+Gemini is asked for JSON, but replies sometimes arrive wrapped in code
+fences, followed by a sentence of commentary, cut off at the token limit,
+with single-quoted strings or trailing commas. Rather than returning a
+"Could not parse" answer (and making the farmer retry a full round trip),
+``parse`` first tries a strict decode (``orjson`` when installed) and then
+re-tokenizes the text into valid JSON, closing whatever was left open.
+The result is checked against the endpoint's schema; counters of clean,
+repaired and failed parses per schema are exposed through ``stats()``.
+"""
+import json
+import logging
+import math
+import threading
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+
+    _loads = orjson.loads
+    DECODER = "orjson"
+except ImportError:
+    _loads = json.loads
+    DECODER = "json"
+
+
+class ParseError(ValueError):
+    """The response could not be turned into a value matching the schema."""
+
+    def __init__(self, message, raw_text):
+        super().__init__(message)
+        self.raw_text = raw_text
+
+
+class Schema:
+    """Top-level shape of an endpoint's JSON: the root type and the keys
+    (with their types) it must contain when the root is an object. ``items``
+    lists the keys every element must have when the root is an array."""
+
+    def __init__(self, root=dict, required=None, items=None):
+        self.root = root
+        self.required = required or {}
+        self.items = items or {}
+
+    def validate(self, value):
+        """Return ``(value, repaired)`` or raise ``ValueError``."""
+        repaired = False
+        if self.root is list and isinstance(value, dict):
+            # ``{"results": [...]}`` instead of a bare array.
+            lists = [v for v in value.values() if isinstance(v, list)]
+            if len(lists) != 1:
+                raise ValueError("Expected a JSON array")
+            value, repaired = lists[0], True
+        if not isinstance(value, self.root):
+            raise ValueError(f"Expected a JSON {'array' if self.root is list else 'object'}")
+        for key, kind in self.required.items():
+            if not isinstance(value.get(key), kind):
+                raise ValueError(f"Missing or invalid '{key}' field")
+        if self.items:
+            kept = [
+                item for item in value
+                if isinstance(item, dict) and all(isinstance(item.get(k), t) for k, t in self.items.items())
+            ]
+            repaired = repaired or len(kept) != len(value)
+            value = kept
+        return value, repaired
+
+
+SCHEMAS = {
+    "disease": Schema(required={"disease": str, "cure": str}),
+    "disease-batch": Schema(root=list, items={"disease": str, "cure": str}),
+    "schemes": Schema(required={"schemes": list}),
+    "prices": Schema(required={"prices": list}),
+    "stores": Schema(required={"stores": list}),
+    "advisory": Schema(required={"recommended_crops": list}),
+}
+
+_lock = threading.Lock()
+_stats = {name: {"ok": 0, "repaired": 0, "failed": 0} for name in SCHEMAS}
+
+
+def record(schema_name, outcome):
+    with _lock:
+        _stats[schema_name][outcome] += 1
+
+
+def stats():
+    with _lock:
+        result = {}
+        for name, entry in _stats.items():
+            total = entry["ok"] + entry["repaired"] + entry["failed"]
+            result[name] = {
+                **entry,
+                "repair_rate": round(entry["repaired"] / total, 4) if total else 0.0,
+                "failure_rate": round(entry["failed"] / total, 4) if total else 0.0,
+            }
+    return {"decoder": DECODER, "schemas": result}
+
+
+def response_text(response_json):
+    """Concatenated text parts of the first candidate (thoughts excluded)."""
+    parts = response_json.get("candidates", [{}])[0].get("content", {}).get("parts", [])
+    return "".join(part.get("text", "") for part in parts if not part.get("thought")).strip()
+
+
+_LITERALS = {"true": "true", "false": "false", "null": "null", "True": "true", "False": "false", "None": "null"}
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+def _read_string(text, i, quote):
+    """Return ``(decoded, end)`` for the string starting at ``text[i]``;
+    ``end`` is None when the text ends inside the string."""
+    out = []
+    i += 1
+    while i < len(text):
+        char = text[i]
+        if char == "\\" and i + 1 < len(text):
+            escaped = text[i + 1]
+            if escaped == "u" and i + 5 < len(text):
+                try:
+                    out.append(chr(int(text[i + 2:i + 6], 16)))
+                    i += 6
+                    continue
+                except ValueError:
+                    pass
+            out.append({"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f"}.get(escaped, escaped))
+            i += 2
+            continue
+        if char == quote:
+            return "".join(out), i + 1
+        out.append(char)
+        i += 1
+    return "".join(out), None
+
+
+def _number(word):
+    """JSON text for a numeric token (``+3``, ``1.``, ``.5``), else None."""
+    if word[0].isalpha():
+        return None
+    try:
+        return json.dumps(int(word))
+    except ValueError:
+        pass
+    try:
+        number = float(word)
+    except ValueError:
+        return None
+    return json.dumps(number) if math.isfinite(number) else None
+
+
+def repair(text):
+    """Rewrite almost-JSON model output as valid JSON text, or return None.
+
+    Handles code fences and surrounding prose (only the first top-level
+    object/array is kept), single-quoted strings, Python literals, trailing
+    commas, and output truncated mid-value (open strings, objects and arrays
+    are closed; a dangling key or comma is dropped).
+    """
+    starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+    if not starts:
+        return None
+    i = min(starts)
+    out = []
+    stack = []
+    while i < len(text):
+        char = text[i]
+        if char in "\"'":
+            value, end = _read_string(text, i, char)
+            out.append(json.dumps(value))
+            if end is None:
+                break
+            i = end
+            continue
+        if char in "{[":
+            stack.append(char)
+            out.append(char)
+        elif char in "}]":
+            if not stack:
+                break
+            while out and out[-1] == ",":
+                out.pop()
+            opener = stack.pop()
+            out.append(_CLOSERS[opener])
+            if not stack:
+                break
+        elif char in ",:":
+            out.append(char)
+        elif char.isalpha() or char in "-+.0123456789":
+            end = i
+            while end < len(text) and (text[end].isalnum() or text[end] in "-+._"):
+                end += 1
+            word = text[i:end]
+            out.append(_LITERALS.get(word) or _number(word) or json.dumps(word))
+            i = end
+            continue
+        i += 1
+
+    if not out:
+        return None
+    # Truncated output: drop a dangling comma, key or "key:", then close.
+    while stack:
+        if out[-1] == ",":
+            out.pop()
+        elif out[-1] == ":":
+            del out[-2:]
+        elif stack[-1] == "{" and out[-1] not in ("{", "[") and len(out) > 1 and out[-2] in ("{", ","):
+            out.pop()
+        else:
+            out.append(_CLOSERS[stack.pop()])
+    return "".join(out)
+
+
+def decode(text):
+    """Return ``(value, repaired)`` for model output text or raise ``ValueError``."""
+    cleaned = text.replace("```json", "").replace("```", "").strip()
+    try:
+        return _loads(cleaned), cleaned != text
+    except ValueError:
+        pass
+    fixed = repair(cleaned)
+    if fixed is None:
+        raise ValueError("No JSON value found")
+    return _loads(fixed), True
+
+
+def parse(response_json, schema_name):
+    """Return the validated JSON value of a Gemini response.
+
+    Raises ``ParseError`` (carrying the raw text) when the output cannot be
+    decoded, even after repair, or does not match ``SCHEMAS[schema_name]``.
+    """
+    raw_text = response_text(response_json)
+    try:
+        with metrics.stage("parse"):
+            value, repaired = decode(raw_text)
+            value, reshaped = SCHEMAS[schema_name].validate(value)
+    except ValueError as exc:
+        record(schema_name, "failed")
+        logger.info("Unparseable %s output: %s", schema_name, exc)
+        raise ParseError(str(exc), raw_text) from exc
+    record(schema_name, "repaired" if repaired or reshaped else "ok")
+    return value
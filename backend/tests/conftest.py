@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The backend modules are imported as top-level modules, as the servers do.
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+# benchmarks/fake_upstream.py is the local stand-in for Gemini and WeatherAPI.
+sys.path.insert(0, os.path.join(BACKEND_DIR, "benchmarks"))
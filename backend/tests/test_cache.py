@@ -0,0 +1,65 @@
+import time
+
+import cache
+
+
+def test_memory_backend_evicts_least_recently_used_entry():
+    backend = cache.MemoryBackend(max_entries=2, max_bytes=1024)
+    backend.set("a", "1", 60)
+    backend.set("b", "2", 60)
+    assert backend.get("a") == "1"
+    backend.set("c", "3", 60)
+    assert backend.get("b") is None
+    assert backend.get("a") == "1" and backend.get("c") == "3"
+    assert backend.evictions == 1
+
+
+def test_memory_backend_is_bounded_by_bytes():
+    backend = cache.MemoryBackend(max_entries=100, max_bytes=10)
+    backend.set("a", "x" * 6, 60)
+    backend.set("b", "y" * 6, 60)
+    assert backend.get("a") is None
+    assert backend.size_bytes == 6
+    backend.set("too-big", "z" * 11, 60)
+    assert backend.get("too-big") is None and backend.get("b") == "y" * 6
+
+
+def test_memory_backend_expires_entries():
+    backend = cache.MemoryBackend()
+    backend.set("a", "1", 0.05)
+    assert backend.get("a") == "1"
+    time.sleep(0.1)
+    assert backend.get("a") is None
+    assert len(backend) == 0 and backend.size_bytes == 0
+
+
+def test_response_cache_counts_hits_and_copies_values():
+    responses = cache.ResponseCache("test", 60, backend=cache.MemoryBackend())
+    assert responses.get(("Pune", "tomato")) is None
+    responses.set(("Pune", "tomato"), {"prices": [1]})
+    value = responses.get(("Pune", "tomato"))
+    value["prices"].append(2)
+    assert responses.get(("Pune", "tomato")) == {"prices": [1]}
+    assert responses.stats()["hits"] == 2 and responses.stats()["misses"] == 1
+
+
+def test_zero_ttl_disables_the_cache():
+    responses = cache.ResponseCache("off", 0, backend=cache.MemoryBackend())
+    responses.set(("key",), {"a": 1})
+    assert responses.get(("key",)) is None
+
+
+def test_response_cache_uses_an_empty_backend_it_is_given():
+    backend = cache.MemoryBackend()
+    assert cache.ResponseCache("own", 60, backend=backend).backend is backend
+
+
+def test_memory_backend_counts_utf8_bytes():
+    backend = cache.MemoryBackend(max_entries=100, max_bytes=20)
+    advisory = "टमाटर की फसल"  # 12 characters, 32 bytes
+    backend.set("hi", advisory, 60)
+    assert backend.get("hi") is None
+    backend.set("mr", "कांदा", 60)
+    assert backend.size_bytes == len("कांदा".encode("utf-8")) == 15
+    backend.delete("mr")
+    assert backend.size_bytes == 0
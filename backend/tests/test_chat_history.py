@@ -0,0 +1,89 @@
+import pytest
+
+import cache
+import chat_history
+
+
+@pytest.fixture(autouse=True)
+def summaries(monkeypatch):
+    fresh = cache.ResponseCache("chat-summary", 60, backend=cache.MemoryBackend())
+    monkeypatch.setattr(chat_history, "summaries", fresh)
+    return fresh
+
+
+def gemini_call(payload, timeout):
+    return payload
+
+
+def drive(lines, reply="summary text"):
+    """Run ``build_context``, answering summary calls with ``reply`` (or raising it)."""
+    calls = []
+    flow = chat_history.build_context(lines, gemini_call)
+    try:
+        payload = next(flow)
+        while True:
+            calls.append(payload)
+            if isinstance(reply, Exception):
+                payload = flow.throw(reply)
+            else:
+                payload = flow.send({"candidates": [{"content": {"parts": [{"text": reply}]}}]})
+    except StopIteration as stop:
+        context, meta = stop.value
+    return context, meta, calls
+
+
+MAX = chat_history.MAX_TURNS
+BATCH = chat_history.SUMMARY_BATCH
+
+
+def turns(count):
+    return [f"Farmer: question {number}" for number in range(count)]
+
+
+def test_turn_lines_skips_empty_and_malformed_items():
+    history = [{"role": "user", "content": " hi "}, {"role": "model", "content": "hello"}, {"content": ""}, "bad"]
+    assert chat_history.turn_lines(history) == ["Farmer: hi", "Assistant: hello"]
+
+
+def test_split_keeps_max_turns_within_token_budget():
+    lines = ["x" * 40] * 6
+    assert chat_history.split(lines, max_turns=4, token_budget=1000) == 2
+    assert chat_history.split(lines, max_turns=4, token_budget=25) == 4
+    # The newest turn is always kept, even over budget.
+    assert chat_history.split(lines, max_turns=4, token_budget=1) == 5
+
+
+def test_short_history_is_sent_verbatim():
+    context, meta, calls = drive(turns(MAX))
+    assert context == turns(MAX) and not calls
+    assert meta["turns_summarized"] == 0
+
+
+def test_turns_wait_for_a_full_batch_before_summarizing():
+    context, meta, calls = drive(turns(MAX + BATCH - 1))
+    assert context == turns(MAX + BATCH - 1) and not calls
+
+    context, meta, calls = drive(turns(MAX + BATCH))
+    assert len(calls) == 1
+    assert context == ["Summary of earlier conversation: summary text"] + turns(MAX + BATCH)[BATCH:]
+    assert meta["summary_updated"] and meta["turns_summarized"] == BATCH
+
+
+def test_cached_prefix_summary_is_reused():
+    drive(turns(MAX + BATCH))
+    context, meta, calls = drive(turns(MAX + BATCH + 1))
+    assert not calls and not meta["summary_updated"]
+    assert context[0] == "Summary of earlier conversation: summary text"
+    assert context[1:] == turns(MAX + BATCH + 1)[BATCH:]
+
+    context, meta, calls = drive(turns(MAX + 2 * BATCH), reply="longer summary")
+    assert "Summary so far: summary text" in calls[0]["contents"][0]["parts"][1]["text"]
+    assert context[0] == "Summary of earlier conversation: longer summary"
+    assert meta["turns_summarized"] == 2 * BATCH
+
+
+def test_failed_summary_falls_back_to_local_clipping(summaries):
+    context, meta, calls = drive(turns(MAX + BATCH), reply=RuntimeError("upstream down"))
+    assert len(calls) == 1 and not meta["summary_updated"]
+    assert context[0] == "Summary of earlier conversation: " + " | ".join(turns(BATCH))
+    assert summaries.get((chat_history.prefix_hashes(turns(BATCH))[-1],)) is None
@@ -0,0 +1,74 @@
+import pytest
+import requests
+
+import circuit
+
+
+def http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(response=response)
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    monkeypatch.setattr(circuit, "ENABLED", True)
+    monkeypatch.setattr(circuit, "FAILURES", 3)
+    monkeypatch.setattr(circuit, "OPEN_SECONDS", 0.05)
+    return circuit.Breaker("example.test")
+
+
+def test_opens_after_consecutive_failures(breaker):
+    for _ in range(2):
+        breaker.check().record(requests.ConnectionError())
+    breaker.check().record()
+    for _ in range(2):
+        breaker.check().record(http_error(503))
+    assert breaker.state == circuit.CLOSED
+    breaker.check().record(requests.Timeout())
+    assert breaker.state == circuit.OPEN
+    with pytest.raises(circuit.CircuitOpen) as error:
+        breaker.check()
+    assert error.value.retry_after == 1 and breaker.rejected == 1
+
+
+def test_client_errors_and_local_refusals_are_not_failures(breaker):
+    for _ in range(5):
+        breaker.check().record(http_error(429))
+        breaker.check().record(circuit.Unavailable("busy", 1))
+    assert breaker.state == circuit.CLOSED and breaker.failures == 0
+
+
+def test_half_open_lets_one_probe_through(breaker):
+    for _ in range(3):
+        breaker.record(requests.ConnectionError())
+    breaker.opened_at -= 1
+    probe = breaker.check()
+    assert breaker.state == circuit.HALF_OPEN
+    with pytest.raises(circuit.CircuitOpen):
+        breaker.check()
+    probe.record(requests.ConnectionError())
+    assert breaker.state == circuit.OPEN and breaker.opened == 2
+
+    breaker.opened_at -= 1
+    breaker.check().record()
+    assert breaker.state == circuit.CLOSED and breaker.failures == 0
+
+
+def test_health_probes_open_and_shorten_the_open_period(breaker):
+    for _ in range(3):
+        breaker.observe(True)
+    assert breaker.state == circuit.OPEN
+    breaker.observe(False)
+    breaker.check()
+    assert breaker.state == circuit.HALF_OPEN
+    # A failing probe leaves the call's half-open probe alone.
+    breaker.observe(True)
+    assert breaker.state == circuit.HALF_OPEN
+
+
+def test_disabled_breaker_never_opens(breaker, monkeypatch):
+    monkeypatch.setattr(circuit, "ENABLED", False)
+    for _ in range(10):
+        breaker.check().record(requests.ConnectionError())
+    assert breaker.state == circuit.CLOSED
@@ -0,0 +1,97 @@
+import contextvars
+
+import pytest
+import requests
+
+import governor
+import metrics
+
+
+def http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(response=response)
+
+
+def test_token_bucket_refills_continuously():
+    bucket = governor.TokenBucket(60)
+    assert bucket.delay(60, now=bucket.updated) == 0.0
+    bucket.take(60)
+    assert bucket.delay(1, now=bucket.updated) == pytest.approx(1.0)
+    assert bucket.delay(1, now=bucket.updated + 1) == 0.0
+    # A cost above the capacity waits for a full bucket instead of forever.
+    assert bucket.delay(1000, now=bucket.updated) == pytest.approx(59.0)
+
+
+def test_zero_rate_bucket_never_limits():
+    bucket = governor.TokenBucket(0)
+    bucket.take(10 ** 6)
+    assert bucket.delay(10 ** 6, now=bucket.updated) == 0.0
+
+
+def test_aimd_grows_on_success_and_cuts_once_per_round_trip(monkeypatch):
+    monkeypatch.setattr(governor, "COOLDOWN", 60)
+    gate = governor.Governor(rpm=0, tpm=0, limit=4)
+    gate.acquire(1)
+    gate.release("/chatbot", 0.1)
+    assert gate.limit == pytest.approx(4.25)
+
+    for _ in range(3):
+        gate.acquire(1)
+    for _ in range(3):
+        gate.release("/chatbot", 0.1, http_error(429))
+    assert gate.limit == pytest.approx(4.25 * governor.BACKOFF)
+    assert gate.counters["throttled"] == 3
+
+    gate.acquire(1)
+    gate.release("/chatbot", 0.1, http_error(400))
+    assert gate.limit == pytest.approx(4.25 * governor.BACKOFF)
+
+
+def test_slow_reply_counts_as_congestion(monkeypatch):
+    monkeypatch.setattr(governor, "COOLDOWN", 0)
+    gate = governor.Governor(rpm=0, tpm=0, limit=10)
+    gate.acquire(1)
+    gate.release("/chatbot", 1.0)
+    limit = gate.limit
+    gate.acquire(1)
+    gate.release("/chatbot", 1.0 * governor.LATENCY_FACTOR + 1)
+    assert gate.limit == pytest.approx(limit * governor.BACKOFF)
+    assert gate.counters["slow"] == 1
+
+
+def test_queue_admits_by_route_priority():
+    gate = governor.Governor(rpm=0, tpm=0, limit=1)
+    gate.acquire(1)
+    admitted = []
+
+    def enqueue(route):
+        metrics.endpoint.set(route)
+        return gate._enqueue(1, lambda: admitted.append(route))
+
+    jobs = contextvars.copy_context().run(enqueue, "job:refresh")
+    chat = contextvars.copy_context().run(enqueue, "/chatbot")
+    assert gate.stats()["queue_depth"] == 2
+    # A failed call frees its slot without raising the limit.
+    gate.release("/market-prices", 0.1, http_error(400))
+    assert admitted == ["/chatbot"] and chat.admitted and not jobs.admitted
+    gate.release("/chatbot", 0.1, http_error(400))
+    assert admitted == ["/chatbot", "job:refresh"]
+
+
+def test_full_or_stuck_queue_raises_overloaded(monkeypatch):
+    monkeypatch.setattr(governor, "QUEUE_SIZE", 1)
+    monkeypatch.setattr(governor, "QUEUE_TIMEOUT", 0.05)
+    gate = governor.Governor(rpm=0, tpm=0, limit=1)
+    gate.acquire(1)
+    gate._enqueue(1, lambda: None)
+    with pytest.raises(governor.Overloaded) as error:
+        gate.acquire(1)
+    assert error.value.reason == "queue full" and error.value.retry_after >= 1
+
+    gate = governor.Governor(rpm=0, tpm=0, limit=1)
+    gate.acquire(1)
+    with pytest.raises(governor.Overloaded) as error:
+        gate.acquire(1)
+    assert error.value.reason == "queue timeout"
+    assert gate.stats()["queue_depth"] == 0 and gate.counters["timed_out"] == 1
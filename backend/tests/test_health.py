@@ -0,0 +1,90 @@
+import pytest
+import requests
+
+import circuit
+import health
+
+
+class Answer:
+    def __init__(self, status_code, text=""):
+        self.status_code = status_code
+        self.text = text
+
+
+@pytest.fixture
+def probe(monkeypatch):
+    """A Gemini-like probe whose next answers are taken from a list."""
+    answers = []
+
+    def request(method, url, timeout, params):
+        answer = answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    monkeypatch.setattr(health.upstream, "request", request)
+    monkeypatch.setattr(health, "DOWN_AFTER", 2)
+    monkeypatch.setattr(circuit, "_breakers", {})
+    monkeypatch.setattr(circuit, "ENABLED", True)
+    checked = health.Probe("gemini", "http://gemini.test/v1beta/models/fake", {}, 60, True)
+    monkeypatch.setattr(health, "probes", {"gemini": checked, "weather": health.Probe("weather", "", {}, 60, False)})
+    monkeypatch.setattr(health, "ENABLED", True)
+
+    def check(*results):
+        answers.extend(results)
+        for _ in results:
+            checked.check()
+        return checked.state()
+
+    return check
+
+
+def test_probe_states(probe):
+    assert health.state("gemini") == health.UNKNOWN
+    assert health.state("weather") == health.DISABLED
+    assert probe(Answer(200)) == health.UP
+    assert probe(Answer(503)) == health.DEGRADED
+    assert probe(requests.ConnectionError("refused")) == health.DOWN
+    assert health.down("gemini")
+    # Up again, but 2 of 4 recent probes failed.
+    assert probe(Answer(200)) == health.DEGRADED
+    # Up once failures are below DEGRADED_ERROR_RATE of the window: 2 of 11.
+    assert probe(*[Answer(200)] * 6) == health.DEGRADED
+    assert probe(Answer(200)) == health.UP
+    assert probe(Answer(403, "API key not valid")) == health.REJECTED
+    assert health.probes["gemini"].summary()["error"] == "API key not valid"
+
+
+def test_readiness_follows_gemini(probe):
+    assert health.readiness()[1] == 200
+    probe(Answer(500), Answer(500))
+    body, status = health.readiness()
+    assert status == 503 and body["upstreams"]["gemini"] == health.DOWN
+    probe(Answer(200))
+    assert health.readiness()[1] == 200
+    assert health.liveness() == ({"status": "ok"}, 200)
+
+
+def test_failing_probes_count_towards_the_breaker(probe, monkeypatch):
+    monkeypatch.setattr(circuit, "FAILURES", 3)
+    monkeypatch.setattr(circuit, "OPEN_SECONDS", 30)
+    probe(Answer(502), Answer(502), Answer(502))
+    breaker = circuit.for_url("http://gemini.test/")
+    assert breaker.state == circuit.OPEN
+    with pytest.raises(circuit.CircuitOpen):
+        breaker.check()
+    # A passing probe lets the next call through as the half-open probe.
+    probe(Answer(200))
+    breaker.check()
+    assert breaker.state == circuit.HALF_OPEN
+
+
+def test_api_key_report_reads_the_probes(probe):
+    assert health.api_key_report()["gemini_api_status"] == "⏳ Not checked yet"
+    probe(Answer(200))
+    report = health.api_key_report()
+    assert report["gemini_api_status"] == "✅ Working"
+    assert report["weather_api_status"] == "❌ API key not set"
+    probe(Answer(400, "quota exhausted"))
+    report = health.api_key_report()
+    assert report["gemini_api_status"] == "❌ Failed: 400" and report["gemini_error"] == "quota exhausted"
@@ -0,0 +1,70 @@
+import io
+
+import pytest
+
+import cache
+import image_cache
+
+Image = pytest.importorskip("PIL.Image")
+ImageDraw = pytest.importorskip("PIL.ImageDraw")
+
+
+def leaf_photo(spots, size=(640, 480), quality=90):
+    img = Image.new("RGB", size, (30, 110, 40))
+    draw = ImageDraw.Draw(img)
+    for x, y, r in spots:
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=(120, 80, 20))
+    return encode(img, quality)
+
+
+def encode(img, quality):
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=quality)
+    return out.getvalue()
+
+
+SPOTS = [(120, 100, 50), (400, 300, 70), (520, 120, 40)]
+
+
+@pytest.fixture
+def cached(monkeypatch):
+    monkeypatch.setattr(image_cache, "PERCEPTUAL", True)
+    monkeypatch.setattr(image_cache, "index", image_cache.PerceptualIndex(max_distance=6))
+    monkeypatch.setattr(
+        image_cache, "results", cache.ResponseCache("detect-disease", 60, backend=cache.MemoryBackend())
+    )
+    original = leaf_photo(SPOTS)
+    digest, phash = image_cache.fingerprint(original)
+    image_cache.store(digest, phash, {"disease": "Leaf blight"})
+    return original, phash
+
+
+def test_resized_and_reencoded_copies_hit(cached):
+    original, phash = cached
+    with Image.open(io.BytesIO(original)) as img:
+        smaller = encode(img.resize((320, 240)), quality=60)
+    digest, copy_hash = image_cache.fingerprint(smaller)
+    assert bin(phash ^ copy_hash).count("1") <= 6
+    assert image_cache.lookup(digest, copy_hash) == ({"disease": "Leaf blight"}, "perceptual")
+    assert image_cache.lookup(*image_cache.fingerprint(original)) == ({"disease": "Leaf blight"}, "exact")
+
+
+def test_different_photo_misses(cached):
+    _, phash = cached
+    other = leaf_photo([(100, 380, 60), (300, 80, 45), (560, 400, 55)])
+    digest, other_hash = image_cache.fingerprint(other)
+    assert bin(phash ^ other_hash).count("1") > 6
+    assert image_cache.lookup(digest, other_hash) == (None, "exact")
+
+
+def test_hamming_distance_threshold():
+    index = image_cache.PerceptualIndex(max_distance=6)
+    index.add(0, "base")
+    assert index.find(0b111111) == "base"
+    assert index.find(0b1111111) is None
+    index.add(0b1111111, "closer")
+    assert index.find(0b1111111) == "closer"
+
+
+def test_undecodable_upload_has_no_perceptual_hash():
+    assert image_cache.dhash(b"not an image") is None
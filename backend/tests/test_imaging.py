@@ -0,0 +1,36 @@
+import io
+import random
+
+import pytest
+
+import imaging
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def photo_with_gps(size=(64, 48)):
+    exif = Image.Exif()
+    exif[0x010F] = "PhoneCam"
+    exif[0x8825] = {1: "N", 2: (18.0, 31.0, 12.0)}
+    out = io.BytesIO()
+    # Low quality, so re-encoding at the default quality makes it larger.
+    noise = Image.frombytes("RGB", size, random.Random(0).randbytes(size[0] * size[1] * 3))
+    noise.save(out, format="JPEG", quality=20, exif=exif)
+    return out.getvalue()
+
+
+def test_metadata_is_dropped_even_when_the_image_grows(monkeypatch):
+    monkeypatch.setattr(imaging, "ENABLED", True)
+    original = photo_with_gps()
+    assert Image.open(io.BytesIO(original)).getexif()
+    data, mimetype, stats = imaging.preprocess(original, "image/jpeg")
+    assert mimetype == "image/jpeg"
+    assert stats["bytes_out"] > stats["bytes_in"]
+    with Image.open(io.BytesIO(data)) as img:
+        assert not img.getexif()
+        assert "exif" not in img.info
+
+
+def test_undecodable_upload_is_passed_through(monkeypatch):
+    monkeypatch.setattr(imaging, "ENABLED", True)
+    assert imaging.preprocess(b"not an image", "image/png")[:2] == (b"not an image", "image/png")
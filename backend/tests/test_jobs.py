@@ -0,0 +1,50 @@
+import time
+
+import jobs
+
+
+def test_job_store_keeps_records_until_ttl(tmp_path):
+    store = jobs.JobStore(str(tmp_path / "jobs.sqlite3"), ttl=0.2)
+    store.put("a", {"job_id": "a", "status": "running"})
+    assert store.get("a") == {"job_id": "a", "status": "running"}
+    assert len(store) == 1
+    time.sleep(0.25)
+    assert store.get("a") is None
+    store.sweep()
+    assert store.connection().execute("SELECT COUNT(*) FROM jobs").fetchone()[0] == 0
+
+
+def test_job_store_is_not_bounded_like_the_cache(tmp_path):
+    store = jobs.JobStore(str(tmp_path / "jobs.sqlite3"), ttl=60)
+    for number in range(5000):
+        store.put(str(number), {"job_id": str(number), "status": "queued"})
+    assert store.get("0")["status"] == "queued"
+    assert len(store) == 5000
+
+
+def test_unfinished_job_without_heartbeat_reads_as_failed(tmp_path):
+    store = jobs.JobStore(str(tmp_path / "jobs.sqlite3"), ttl=60, stale_after=0.2)
+    store.put("a", {"job_id": "a", "status": "running"})
+    store.put("b", {"job_id": "b", "status": "done"})
+    time.sleep(0.15)
+    store.touch(["a"])
+    time.sleep(0.15)
+    assert store.get("a")["status"] == "running"
+    time.sleep(0.1)
+    assert store.get("a")["status"] == "failed"
+    assert store.get("b")["status"] == "done"
+
+
+def test_stale_job_is_run_again_on_resubmission(tmp_path, monkeypatch):
+    store = jobs.JobStore(str(tmp_path / "jobs.sqlite3"), ttl=60, stale_after=0.1)
+    monkeypatch.setattr(jobs, "records", store)
+    monkeypatch.setattr(jobs, "ENDPOINTS", {"echo": lambda body: iter(())})
+    monkeypatch.setattr(jobs.handlers, "run", lambda flow: ({"ok": True}, 200))
+    key = jobs.job_id("echo", {"q": 1})
+    # Left behind by a worker that restarted before running it.
+    store.put(key, {"job_id": key, "endpoint": "echo", "status": "queued", "created_at": time.time()})
+
+    assert jobs.submit("echo", {"q": 1})[0]["status"] == "queued"
+    time.sleep(0.15)
+    jobs.submit("echo", {"q": 1})
+    assert jobs.wait(key, 5)["status"] == "done"
@@ -0,0 +1,88 @@
+import sqlite3
+from datetime import date, timedelta
+
+import pytest
+
+import price_store
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(price_store, "PATH", str(tmp_path / "prices.sqlite3"))
+    monkeypatch.setattr(price_store, "ENABLED", True)
+    monkeypatch.setattr(price_store, "_ready", False)
+    monkeypatch.setattr(price_store, "_local", price_store.threading.local())
+    return tmp_path / "prices.sqlite3"
+
+
+def test_cities_without_a_market_do_not_overwrite_each_other(store):
+    today = date.today().isoformat()
+    price_store.ingest_result({"date": today, "prices": [{"commodity": "Tomato", "modal_price": "1200"}]}, "Pune")
+    price_store.ingest_result({"date": today, "prices": [{"commodity": "Tomato", "modal_price": "2400"}]}, "Delhi")
+    assert price_store.lookup("Pune", "Tomato")["prices"][0]["modal_price"] == 1200
+    assert price_store.lookup("Delhi", "Tomato")["prices"][0]["modal_price"] == 2400
+    assert len(price_store.fresh_series("India", "Tomato", today)) == 2
+
+
+def test_old_key_is_migrated(store):
+    conn = sqlite3.connect(store)
+    conn.executescript(price_store.SCHEMA.replace("variety, location, date)", "variety, date)"))
+    conn.execute("INSERT INTO prices VALUES ('Onion', 'Lasalgaon', '', '2024-06-01', 'Nashik', 'Maharashtra',"
+                 " 'quintal', NULL, NULL, 1500, 'gemini')")
+    conn.commit()
+    conn.close()
+    key = [row["name"] for row in price_store.connection().execute("PRAGMA table_info(prices)") if row["pk"]]
+    assert "location" in key
+    assert price_store.connection().execute("SELECT modal_price FROM prices").fetchall()[0][0] == 1500
+
+
+def test_analyze_computes_moving_averages_and_trend():
+    today = date(2024, 6, 30)
+    rows = [
+        {"commodity": "Onion", "market": "Lasalgaon", "variety": "", "location": "Nashik",
+         "date": (today - timedelta(days=day)).isoformat(), "modal_price": 1000 + (29 - day) * 50}
+        for day in range(29, -1, -1)
+    ]
+    rows += [
+        {"commodity": "Onion", "market": "Lasalgaon", "variety": "", "location": "Pune",
+         "date": today.isoformat(), "modal_price": 900}
+    ]
+    (latest, stats, points), (other, other_stats, _) = price_store.analyze(rows, today)
+    assert latest["modal_price"] == 2450 and len(points) == 30
+    assert stats["trend"] == "rising"
+    assert stats["moving_avg_7d"] == pytest.approx(sum(1000 + day * 50 for day in range(23, 30)) / 7)
+    assert stats["change_7d_pct"] == pytest.approx((2450 - 2100) / 2100 * 100, abs=0.01)
+    assert other["location"] == "Pune"
+    assert other_stats["trend"] is None and other_stats["moving_avg_7d"] == 900
+
+
+def test_broad_queries_need_their_own_fetch(store):
+    today = date.today().isoformat()
+    price_store.ingest_result(
+        {"date": today, "prices": [{"commodity": "Tomato", "modal_price": "1200"}]}, "Pune", "Tomato"
+    )
+    assert price_store.lookup("Pune", "Tomato") is not None
+    assert price_store.lookup("Pune", "") is None
+    assert price_store.lookup("India", "Tomato") is None
+    assert not price_store.covers("India", "")
+
+    price_store.ingest_result(
+        {"date": today, "prices": [{"commodity": "Onion", "modal_price": "900"},
+                                   {"commodity": "Potato", "modal_price": "700"}]},
+        "Pune", "",
+    )
+    answer = price_store.lookup(" pune ", "")
+    assert sorted(price["commodity"] for price in answer["prices"]) == ["Onion", "Potato", "Tomato"]
+    assert price_store.lookup("India", "") is None
+
+
+def test_imported_dump_answers_its_districts(store, tmp_path):
+    dump = tmp_path / "mandi.csv"
+    dump.write_text(
+        "State,District,Market,Commodity,Variety,Arrival_Date,Min_x0020_Price,Max_x0020_Price,Modal_x0020_Price\n"
+        f"Maharashtra,Nashik,Lasalgaon,Onion,Red,{date.today():%d/%m/%Y},1000,1400,1200\n"
+    )
+    assert price_store.import_csv(str(dump)) == (1, 1)
+    assert price_store.lookup("Nashik", "")["prices"][0]["modal_price"] == 1200
+    assert price_store.covers("Maharashtra", "")
+    assert not price_store.covers("Pune", "")
@@ -0,0 +1,138 @@
+import time
+
+import pytest
+import requests
+
+import circuit
+import prompts
+from fake_upstream import FakeUpstream
+
+
+@pytest.fixture(scope="module")
+def server():
+    upstream = FakeUpstream().start()
+    yield upstream
+    upstream.shutdown()
+    upstream.server_close()
+
+
+@pytest.fixture
+def fake(server, monkeypatch):
+    server.caches.clear()
+    server.calls.clear()
+    server.cache_min_tokens = 0
+    server.error_rate = 0.0
+    server.cache_hits = 0
+    # A fresh breaker for the fake's host, whatever earlier tests sent it.
+    monkeypatch.setattr(circuit, "_breakers", {})
+    monkeypatch.setattr(prompts, "ENABLED", True)
+    monkeypatch.setattr(prompts, "api_key", "fake")
+    monkeypatch.setattr(prompts, "API_ROOT", f"{server.base_url}/v1beta")
+    monkeypatch.setattr(prompts, "CACHE_URL", f"{server.base_url}/v1beta/cachedContents")
+    monkeypatch.setattr(prompts, "_entries", {})
+    monkeypatch.setattr(prompts, "counters", dict.fromkeys(prompts.counters, 0))
+    # The tests call ``maintain`` themselves instead of the background thread.
+    monkeypatch.setattr(prompts, "start", lambda: None)
+    return server
+
+
+PROMPT = prompts.Prompt("test", "Answer as a farming assistant. " * 20)
+BASE = {"contents": [{"parts": [{"text": "Which crop suits clay soil?"}]}]}
+
+
+def gemini_call(payload, timeout):
+    return payload
+
+
+def send(fake):
+    """Drive ``PROMPT.send`` against the fake; returns the payloads sent and the reply."""
+    sent = []
+    flow = PROMPT.send(BASE, gemini_call, timeout=5)
+    payload = next(flow)
+    try:
+        while True:
+            sent.append(payload)
+            response = requests.post(fake.gemini_url, json=payload, timeout=5)
+            try:
+                response.raise_for_status()
+            except requests.HTTPError as exc:
+                payload = flow.throw(exc)
+            else:
+                payload = flow.send(response.json())
+    except StopIteration as stop:
+        return sent, stop.value
+
+
+def test_prompt_is_inline_until_its_cache_is_created(fake):
+    cache_entry = prompts.entry(PROMPT)
+    payload, handle = PROMPT.payload(BASE)
+    assert handle is None and payload["systemInstruction"] == PROMPT.instruction()
+
+    cache_entry.maintain()
+    assert cache_entry.handle in fake.caches
+    assert prompts.counters["created"] == 1
+    sent, reply = send(fake)
+    assert sent == [{**BASE, "cachedContent": cache_entry.handle}]
+    assert reply["candidates"] and fake.cache_hits == 1
+
+
+def test_cache_is_renewed_before_it_expires(fake):
+    cache_entry = prompts.entry(PROMPT)
+    cache_entry.maintain()
+    handle = cache_entry.handle
+    cache_entry.maintain()
+    assert prompts.counters["renewed"] == 0
+
+    cache_entry.expires_at = time.monotonic() + prompts.RENEW_BEFORE - 1
+    cache_entry.maintain()
+    assert prompts.counters["renewed"] == 1 and cache_entry.handle == handle
+    assert cache_entry.expires_at - time.monotonic() > prompts.TTL - 5
+    assert fake.caches[handle][1] - time.time() > prompts.TTL - 5
+
+    # A cache that vanished on Gemini's side is created again instead.
+    fake.caches.clear()
+    cache_entry.expires_at = time.monotonic() + prompts.RENEW_BEFORE - 1
+    cache_entry.maintain()
+    assert cache_entry.handle != handle and cache_entry.handle in fake.caches
+
+
+def test_rejected_cache_is_invalidated_and_the_call_retried_inline(fake):
+    cache_entry = prompts.entry(PROMPT)
+    cache_entry.maintain()
+    handle = cache_entry.handle
+    fake.caches.clear()
+
+    sent, reply = send(fake)
+    assert sent[0]["cachedContent"] == handle
+    assert "cachedContent" not in sent[1] and sent[1]["systemInstruction"] == PROMPT.instruction()
+    assert reply["candidates"]
+    assert cache_entry.handle is None and prompts.counters["invalidated"] == 1
+
+    cache_entry.maintain()
+    assert cache_entry.handle not in (None, handle)
+
+
+def test_refused_cache_falls_back_inline_and_backs_off(fake):
+    fake.cache_min_tokens = 10 ** 6
+    cache_entry = prompts.entry(PROMPT)
+    cache_entry.maintain()
+    assert cache_entry.handle is None and "too small" in cache_entry.error
+    assert cache_entry.retry_at - time.monotonic() > prompts.RETRY - 5
+    assert PROMPT.payload(BASE)[1] is None
+
+    attempts = fake.calls["/v1beta/cachedContents"]
+    cache_entry.maintain()
+    assert fake.calls["/v1beta/cachedContents"] == attempts
+
+    cache_entry.retry_at = 0.0
+    fake.cache_min_tokens = 0
+    cache_entry.maintain()
+    assert PROMPT.payload(BASE)[1] == cache_entry.handle is not None
+
+
+def test_upstream_error_is_retried_sooner_than_a_refusal(fake):
+    fake.error_rate = 1.0
+    cache_entry = prompts.entry(PROMPT)
+    cache_entry.maintain()
+    assert cache_entry.handle is None
+    assert prompts.ERROR_RETRY - 5 < cache_entry.retry_at - time.monotonic() <= prompts.ERROR_RETRY
@@ -0,0 +1,42 @@
+import time
+
+import handlers
+import scheme_index
+
+
+def test_all_states_needs_every_state_crawled():
+    index = scheme_index.SchemeIndex(crawled={scheme_index.CENTRAL: time.time()})
+    assert index.covers("Central")
+    assert not index.covers("All States")
+    assert not index.covers("Punjab")
+    index = scheme_index.SchemeIndex(crawled={state: time.time() for state in scheme_index.STATES})
+    assert index.covers("All States")
+    assert index.covers("Punjab")
+
+
+def test_failed_crawl_is_not_queued_again_until_backoff(monkeypatch):
+    def fail(flow):
+        flow.close()
+        raise RuntimeError("upstream down")
+
+    monkeypatch.setattr(handlers, "run", fail)
+    monkeypatch.setattr(scheme_index, "SCHEDULE", True)
+    monkeypatch.setattr(scheme_index, "start_scheduler", lambda: None)
+    monkeypatch.setattr(scheme_index, "_index", scheme_index.SchemeIndex())
+    monkeypatch.setattr(scheme_index, "_wanted", [])
+    monkeypatch.setattr(scheme_index, "_failures", {})
+    monkeypatch.setattr(scheme_index, "RETRY", 0.2)
+
+    assert not scheme_index.crawl("Punjab")
+    scheme_index.want("Punjab")
+    assert scheme_index._wanted == [scheme_index.CENTRAL]
+
+    assert not scheme_index.crawl("Punjab")
+    assert scheme_index._failures["Punjab"][0] == 2
+    time.sleep(0.25)
+    # The second failure doubled the backoff to 0.4 s.
+    scheme_index.want("Punjab")
+    assert scheme_index._wanted == [scheme_index.CENTRAL]
+    time.sleep(0.2)
+    scheme_index.want("Punjab")
+    assert scheme_index._wanted == [scheme_index.CENTRAL, "Punjab"]
@@ -0,0 +1,100 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import singleflight
+
+
+def test_group_coalesces_concurrent_calls():
+    group = singleflight.Group()
+    calls = []
+    release = threading.Event()
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return {"answer": 42}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(group.do("key", fetch))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    while group.leaders + group.coalesced < 8:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert results == [{"answer": 42}] * 8
+    assert group.stats() == {"leaders": 1, "coalesced": 7, "in_flight": 0}
+
+
+def test_group_propagates_errors_and_forgets_the_key():
+    group = singleflight.Group()
+    release = threading.Event()
+    errors = []
+
+    def fail():
+        release.wait(5)
+        raise ValueError("upstream failed")
+
+    def call():
+        try:
+            group.do("key", fail)
+        except ValueError as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    while group.leaders + group.coalesced < 3:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(errors) == 3
+    assert group.do("key", lambda: "retried") == "retried"
+
+
+def test_async_group_coalesces_and_propagates_errors():
+    group = singleflight.AsyncGroup()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    async def fail():
+        await asyncio.sleep(0.05)
+        raise ValueError("upstream failed")
+
+    async def main():
+        assert await asyncio.gather(*(group.do("a", fetch) for _ in range(5))) == ["ok"] * 5
+        results = await asyncio.gather(*(group.do("b", fail) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+
+    asyncio.run(main())
+    assert len(calls) == 1
+    assert group.stats() == {"leaders": 2, "coalesced": 6, "in_flight": 0}
+
+
+def test_async_group_keeps_shared_call_while_a_caller_waits():
+    group = singleflight.AsyncGroup()
+
+    async def fetch():
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    async def main():
+        first = asyncio.ensure_future(group.do("a", fetch))
+        second = asyncio.ensure_future(group.do("a", fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+        assert await second == "ok"
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+    asyncio.run(main())
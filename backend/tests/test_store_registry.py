@@ -0,0 +1,64 @@
+import pytest
+
+import store_registry
+
+
+def store(name, lat, lon):
+    return store_registry.clean_store({"name": name, "latitude": lat, "longitude": lon}, "test")
+
+
+@pytest.fixture
+def registry_file(tmp_path, monkeypatch):
+    path = str(tmp_path / "stores.json")
+    monkeypatch.setattr(store_registry, "PATH", path)
+    monkeypatch.setattr(store_registry, "ENABLED", True)
+    monkeypatch.setattr(store_registry, "_registry", store_registry.StoreRegistry())
+    monkeypatch.setattr(store_registry, "_loaded_mtime", None)
+    # save() and load() bind the default path at definition time.
+    monkeypatch.setattr(store_registry.save, "__defaults__", (path,))
+    monkeypatch.setattr(store_registry.load, "__defaults__", (path,))
+    return path
+
+
+def test_lookup_across_a_bucket_boundary():
+    # 30.0 is a grid line: the query and the store fall in different buckets.
+    registry = store_registry.StoreRegistry([store("Across the line", 29.995, 75.0)])
+    assert store_registry.bucket(29.995, 75.0) != store_registry.bucket(30.005, 75.0)
+    (distance, found), = registry.within(30.005, 75.0, 5)
+    assert found["name"] == "Across the line"
+    assert distance == pytest.approx(1.11, abs=0.01)
+
+
+def test_radius_cut_off_uses_haversine_distance():
+    # 0.1 degrees of latitude is about 11.1 km.
+    registry = store_registry.StoreRegistry([
+        store("Near", 30.1, 75.0), store("Far", 30.3, 75.0), store("Nearest", 30.05, 75.0),
+    ])
+    assert [found["name"] for _, found in registry.within(30.0, 75.0, 12)] == ["Nearest", "Near"]
+    assert [found["name"] for _, found in registry.within(30.0, 75.0, 11)] == ["Nearest"]
+    assert registry.nearest(30.0, 75.0, 1, 50)[0][1]["name"] == "Nearest"
+
+
+def test_ingest_dedupes_and_drops_far_or_invalid_stores(registry_file):
+    near = (30.0, 75.0)
+    answer = [
+        {"name": "Kisan Kendra", "latitude": 30.01, "longitude": 75.01, "rating": "4.5"},
+        {"name": " kisan  kendra ", "latitude": 30.0101, "longitude": 75.0101, "phone": "+91 1"},
+        {"name": "Made up", "latitude": 28.6, "longitude": 77.2},
+        {"name": "No coordinates"},
+        {"name": "Null Island", "latitude": 0, "longitude": 0},
+    ]
+    assert store_registry.add_stores(answer, "gemini", near=near) == 2
+    registry = store_registry.current()
+    assert len(registry.stores) == 1
+    (only,) = registry.stores.values()
+    assert only["phone"] == "+91 1"
+    assert sum(len(ids) for ids in registry.buckets.values()) == 1
+
+
+def test_lookup_needs_minimum_coverage(registry_file, monkeypatch):
+    monkeypatch.setattr(store_registry, "MIN_COVERAGE", 2)
+    store_registry.add_stores([{"name": "A", "latitude": 30.01, "longitude": 75.0}], "csv")
+    assert store_registry.lookup(30.0, 75.0) is None
+    store_registry.add_stores([{"name": "B", "latitude": 30.02, "longitude": 75.0}], "csv")
+    assert [found["name"] for found in store_registry.lookup(30.0, 75.0)] == ["A", "B"]
@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+import structured
+
+
+def gemini(text):
+    return {"candidates": [{"content": {"parts": [{"text": "thinking", "thought": True}, {"text": text}]}}]}
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ('Here you go: {"a": 1} Hope that helps.', {"a": 1}),
+        ("{'a': 'it\\'s', 'b': True, 'c': None}", {"a": "it's", "b": True, "c": None}),
+        ('{"a": [1, 2,], "b": +3,}', {"a": [1, 2], "b": 3}),
+        ('{"a": [1, 2', {"a": [1, 2]}),
+        ('{"a": "cut off', {"a": "cut off"}),
+        ('{"a": 1, "b":', {"a": 1}),
+        ('{"a": 1, "b"', {"a": 1}),
+        ('[{"a": 1}, {"a": 2},', [{"a": 1}, {"a": 2}]),
+        ('{"a": "\\u0939\\n"}', {"a": "ह\n"}),
+    ],
+)
+def test_repair_produces_valid_json(text, expected):
+    assert json.loads(structured.repair(text)) == expected
+
+
+def test_repair_without_json_returns_none():
+    assert structured.repair("Sorry, I cannot help with that.") is None
+
+
+def test_decode_reports_whether_it_repaired():
+    assert structured.decode('{"a": 1}') == ({"a": 1}, False)
+    assert structured.decode('```json\n{"a": 1}\n```') == ({"a": 1}, True)
+    assert structured.decode('{"a": 1,}') == ({"a": 1}, True)
+    with pytest.raises(ValueError):
+        structured.decode("no json here")
+
+
+def test_schema_checks_required_keys_and_unwraps_arrays():
+    schema = structured.Schema(required={"prices": list})
+    assert schema.validate({"prices": []}) == ({"prices": []}, False)
+    with pytest.raises(ValueError):
+        schema.validate({"prices": "none"})
+    with pytest.raises(ValueError):
+        schema.validate([])
+
+    batch = structured.Schema(root=list, items={"disease": str})
+    assert batch.validate({"results": [{"disease": "rust"}, {"oops": 1}]}) == ([{"disease": "rust"}], True)
+    with pytest.raises(ValueError):
+        batch.validate({"a": [], "b": []})
+
+
+def test_parse_counts_outcomes_and_keeps_raw_text():
+    before = structured.stats()["schemas"]["stores"]
+    assert structured.parse(gemini('{"stores": []}'), "stores") == {"stores": []}
+    assert structured.parse(gemini('{"stores": [{"name": "A"},'), "stores") == {"stores": [{"name": "A"}]}
+    with pytest.raises(structured.ParseError) as error:
+        structured.parse(gemini('{"shops": []}'), "stores")
+    assert error.value.raw_text == '{"shops": []}'
+    after = structured.stats()["schemas"]["stores"]
+    assert [after[key] - before[key] for key in ("ok", "repaired", "failed")] == [1, 1, 1]
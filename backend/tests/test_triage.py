@@ -0,0 +1,102 @@
+import io
+import math
+
+import pytest
+
+import triage
+
+np = pytest.importorskip("numpy")
+Image = pytest.importorskip("PIL.Image")
+
+
+def vector(brightness=0.5, green=0.6, lesion=0.0):
+    values = np.zeros(len(triage.FEATURES), dtype=np.float32)
+    values[1], values[3], values[4] = brightness, green, lesion
+    values[5] = lesion / max(1e-6, green + lesion)
+    return values
+
+
+def jpeg(pixels):
+    out = io.BytesIO()
+    Image.fromarray(pixels.astype(np.uint8), "RGB").save(out, format="JPEG", quality=95)
+    return out.getvalue()
+
+
+@pytest.mark.parametrize(
+    "values, sharpness, reason",
+    [
+        (vector(brightness=triage.MIN_BRIGHTNESS - 0.01), 1.0, "dark"),
+        (vector(brightness=triage.MIN_BRIGHTNESS), 1.0, None),
+        (vector(brightness=triage.MAX_BRIGHTNESS + 0.01), 1.0, "overexposed"),
+        (vector(green=triage.MIN_PLANT / 2, lesion=triage.MIN_PLANT / 2 - 0.01), 1.0, "no_plant"),
+        (vector(green=triage.MIN_PLANT / 2, lesion=triage.MIN_PLANT / 2), 1.0, None),
+        (vector(), triage.MIN_SHARPNESS - 0.01, "blurry"),
+        (vector(), triage.MIN_SHARPNESS, None),
+    ],
+)
+def test_rejection_thresholds(values, sharpness, reason):
+    assert triage.rejection(values, sharpness) == reason
+
+
+def test_flat_leaf_is_blurry_and_textured_leaf_is_sharp():
+    leaf = np.zeros((96, 96, 3))
+    leaf[...] = (40, 140, 50)
+    flat = triage.features(jpeg(leaf))
+    assert triage.rejection(*flat) == "blurry"
+
+    leaf[::2, :, 1] = 90  # alternating rows of darker green
+    textured = triage.features(jpeg(leaf))
+    assert textured[1] >= triage.MIN_SHARPNESS and triage.rejection(*textured) is None
+    assert triage.rejection(*triage.features(jpeg(np.zeros((96, 96, 3))))) == "dark"
+
+
+@pytest.fixture
+def classifier(monkeypatch):
+    """A model whose probabilities come from the bias alone, and features
+    looked up by image name."""
+    vectors = {}
+
+    def use(probabilities, classes=("blight", triage.HEALTHY)):
+        weights = np.zeros((len(triage.FEATURES), len(classes)), dtype=np.float32)
+        bias = np.log(np.array(probabilities, dtype=np.float32))
+        scale = np.ones(len(triage.FEATURES), dtype=np.float32)
+        model = triage.Model(weights, bias, np.zeros_like(scale), scale, classes, ["cure", triage.HEALTHY_CURE])
+        monkeypatch.setattr(triage, "_model", model)
+        monkeypatch.setattr(triage, "_model_loaded", True)
+
+    monkeypatch.setattr(triage, "CONFIDENCE", 0.9)
+    monkeypatch.setattr(triage, "features", lambda name: (vectors[name], 1.0))
+    use.vectors = vectors
+    return use
+
+
+def test_confident_verdicts_are_answered_locally(classifier):
+    classifier.vectors.update(leaf=vector(lesion=0.05))
+    classifier([0.95, 0.05])
+    verdict = triage.classify("leaf")
+    assert verdict["verdict"] == "local" and verdict["label"] == "blight"
+    assert math.isclose(verdict["probability"], 0.95, abs_tol=1e-3)
+    assert triage.answer(verdict)["disease"] == "blight"
+
+
+def test_unsure_verdicts_escalate(classifier):
+    classifier.vectors.update(leaf=vector(lesion=0.05))
+    classifier([0.85, 0.15])
+    assert triage.classify("leaf") == {"verdict": "escalate"}
+    assert triage.answer({"verdict": "escalate"}) is None
+
+
+def test_healthy_needs_a_lesion_free_leaf(classifier):
+    classifier.vectors.update(clean=vector(lesion=0.0), spotted=vector(lesion=0.01))
+    classifier([0.02, 0.98])
+    clean, spotted = triage.classify_batch(["clean", "spotted"])
+    assert clean["verdict"] == "local" and triage.answer(clean)["disease"] == triage.HEALTHY_DISEASE
+    assert spotted == {"verdict": "escalate"}
+
+
+def test_rejected_images_skip_the_model(classifier):
+    classifier.vectors.update(dark=vector(brightness=0.01))
+    classifier([0.99, 0.01])
+    verdict = triage.classify("dark")
+    assert verdict == {"verdict": "rejected", "reason": "dark"}
+    assert triage.answer(verdict)["disease"] == "Unusable image"
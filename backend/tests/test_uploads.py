@@ -0,0 +1,63 @@
+import base64
+import json
+import socket
+import threading
+
+import h11
+
+import upstream
+import uploads
+
+
+def serve_once(listener, received):
+    """Accept one request, parse it with h11 (strict framing) and answer 200."""
+    conn, _ = listener.accept()
+    parser = h11.Connection(h11.SERVER)
+    body = b""
+    with conn:
+        while True:
+            event = parser.next_event()
+            if event is h11.NEED_DATA:
+                parser.receive_data(conn.recv(65536))
+            elif isinstance(event, h11.Request):
+                received["headers"] = [(name.decode().lower(), value.decode()) for name, value in event.headers]
+            elif isinstance(event, h11.Data):
+                body += event.data
+            elif isinstance(event, h11.EndOfMessage):
+                break
+        received["body"] = body
+        conn.sendall(parser.send(h11.Response(status_code=200, headers=[("Content-Length", "2")])))
+        conn.sendall(parser.send(h11.Data(data=b"{}")) + parser.send(h11.EndOfMessage()))
+
+
+def test_streamed_body_is_sent_with_content_length_only():
+    image = bytes(range(256)) * 1000 + b"tail"
+    payload = {"contents": [{"parts": [{"inline_data": {"mime_type": "image/jpeg", "data": uploads.INLINE_DATA}}]}]}
+    body = uploads.StreamedBody(payload, image, "digest")
+
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    received = {}
+    server = threading.Thread(target=serve_once, args=(listener, received))
+    server.start()
+    call = upstream.Call("POST", f"http://127.0.0.1:{listener.getsockname()[1]}/", 10, body=body)
+    try:
+        assert upstream.execute(call) == {}
+    finally:
+        server.join(5)
+        listener.close()
+
+    headers = dict(received["headers"])
+    assert "transfer-encoding" not in headers
+    assert headers["content-length"] == str(len(body))
+    sent = json.loads(received["body"])
+    assert base64.b64decode(sent["contents"][0]["parts"][0]["inline_data"]["data"]) == image
+
+
+def test_streamed_body_length_matches_bytes_and_restarts():
+    for size in (0, 1, 2, 3, uploads.CHUNK_SIZE + 1):
+        body = uploads.StreamedBody({"data": uploads.INLINE_DATA}, b"x" * size, "id")
+        first = b"".join(body)
+        assert len(first) == len(body) == body.length
+        assert b"".join(body) == first
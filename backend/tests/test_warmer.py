@@ -0,0 +1,142 @@
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+import cache
+import circuit
+import metrics
+import warmer
+
+
+@pytest.fixture
+def state(tmp_path, monkeypatch):
+    monkeypatch.setattr(warmer, "ENABLED", True)
+    monkeypatch.setattr(warmer, "STATE_PATH", str(tmp_path / "warm_keys.json"))
+    monkeypatch.setattr(warmer, "KEYS_PATH", "")
+    monkeypatch.setattr(warmer, "weather_api_key", "fake")
+    monkeypatch.setattr(warmer, "_scores", {})
+    monkeypatch.setattr(warmer, "_pending", {})
+    monkeypatch.setattr(warmer, "_params", {})
+    monkeypatch.setattr(warmer, "_warmed", {})
+    monkeypatch.setattr(warmer, "claims", cache.ResponseCache("warm-claims", 60, backend=cache.MemoryBackend()))
+    # warm() marks the context as the warmer's, which observe() ignores.
+    token = metrics.endpoint.set("other")
+    yield tmp_path
+    metrics.endpoint.reset(token)
+
+
+def prices(location, commodity=""):
+    return {"location": location, "commodity": commodity}
+
+
+def test_scores_persist_merge_and_decay(state):
+    for _ in range(3):
+        warmer.observe("market-prices", prices("Pune", "Onion"), hit=False)
+    warmer.observe("market-prices", prices(" pune ", "onion"), hit=True)
+    warmer.save()
+    key = warmer.key_id("market-prices", prices("Pune", "Onion"))
+    assert warmer._scores[key]["score"] == 4
+
+    # Another worker saved one half-life ago with its own score for the key.
+    saved = json.loads(open(warmer.STATE_PATH).read())
+    saved["saved_at"] -= warmer.HALF_LIFE
+    saved["keys"][key]["score"] = 10
+    with open(warmer.STATE_PATH, "w") as state_file:
+        json.dump(saved, state_file)
+    warmer.observe("market-prices", prices("Pune", "Onion"), hit=False)
+    warmer.save()
+    assert warmer._scores[key]["score"] == pytest.approx(6, rel=1e-3)
+
+
+def test_plan_lists_configured_keys_first_then_the_hottest(state, monkeypatch):
+    keys_path = state / "keys.json"
+    keys_path.write_text(json.dumps({"market-prices": [prices("Nashik", "Onion")]}))
+    monkeypatch.setattr(warmer, "KEYS_PATH", str(keys_path))
+    monkeypatch.setattr(warmer.hottest, "__defaults__", (2,))
+    for location, count in (("Pune", 5), ("Delhi", 3), ("Agra", 1), ("Nashik", 9)):
+        for _ in range(count):
+            warmer.observe("market-prices", prices(location, "Onion"), hit=False)
+    warmer.observe("weather-crop-advisory", {"city": "Pune", "state": "MH", "country": "IN"}, hit=False)
+    warmer.save()
+
+    planned = [key for key, _ in warmer.plan()]
+    assert planned == [
+        "market-prices|nashik|onion", "market-prices|pune|onion", "weather-crop-advisory|pune|mh|in",
+    ]
+    monkeypatch.setattr(warmer, "weather_api_key", "")
+    assert "weather-crop-advisory|pune|mh|in" not in [key for key, _ in warmer.plan()]
+
+
+@pytest.fixture
+def flows(state, monkeypatch):
+    outcomes = []
+
+    def flow(params):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome, ("pune", "onion")
+        yield
+
+    remembered = []
+    monkeypatch.setattr(warmer, "FLOWS", {"market-prices": flow})
+    monkeypatch.setattr(warmer.price_store, "covers", lambda location, commodity: False)
+    monkeypatch.setattr(warmer.stale, "remember", lambda *args: remembered.append(args))
+    return outcomes, remembered
+
+
+def test_claims_skip_keys_warmed_by_any_worker(flows):
+    outcomes, remembered = flows
+    key = warmer.key_id("market-prices", prices("Pune", "Onion"))
+    outcomes.append(({"prices": []}, 200))
+    assert warmer.warm(key, "market-prices", prices("Pune", "Onion")) == "warmed"
+    assert warmer.warm(key, "market-prices", prices("Pune", "Onion")) == "skipped"
+    assert key in warmer._warmed
+    assert remembered == [("market-prices", ("pune", "onion"), {"prices": []})]
+
+    other = warmer.key_id("market-prices", prices("Agra", "Onion"))
+    outcomes.append(({"detail": "upstream failed"}, 502))
+    assert warmer.warm(other, "market-prices", prices("Agra", "Onion")) == "failed"
+
+
+def test_refused_call_releases_the_claim(flows):
+    key = warmer.key_id("market-prices", prices("Pune", "Onion"))
+    flows[0].append(circuit.CircuitOpen("gemini", 5))
+    with pytest.raises(circuit.Unavailable):
+        warmer.warm(key, "market-prices", prices("Pune", "Onion"))
+    assert warmer.claims.get((key,), count=False) is None
+
+
+def test_price_store_answers_are_not_warmed(flows, monkeypatch):
+    monkeypatch.setattr(warmer.price_store, "covers", lambda location, commodity: True)
+    assert warmer.warm("market-prices|pune|onion", "market-prices", prices("Pune", "Onion")) == "skipped"
+    assert warmer.claims.get(("market-prices|pune|onion",), count=False) is None
+
+
+def test_run_defers_keys_after_a_refusal(state, monkeypatch):
+    monkeypatch.setattr(warmer, "CONCURRENCY", 1)
+    monkeypatch.setattr(warmer, "BUSY_PAUSE", 0.01)
+    monkeypatch.setattr(warmer, "_busy", lambda: False)
+    monkeypatch.setattr(warmer, "plan", lambda: [("a", ("market-prices", {})), ("b", ("market-prices", {}))])
+    outcomes = ["warmed", circuit.CircuitOpen("gemini", 1)]
+
+    def warm(key, endpoint, params):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    monkeypatch.setattr(warmer, "warm", warm)
+    summary = warmer.run("test")
+    assert (summary["total"], summary["warmed"], summary["deferred"]) == (2, 1, 1)
+    assert not warmer.progress["running"]
+
+
+def test_next_run_is_the_next_local_warm_time(monkeypatch):
+    monkeypatch.setattr(warmer, "WARM_AT", ["04:30", "21:00"])
+    # 2024-06-01 03:00 IST (UTC+5:30) is 2024-05-31 21:30 UTC.
+    now = datetime(2024, 5, 31, 21, 30, tzinfo=timezone.utc).timestamp()
+    assert warmer.next_run_at(now) == datetime(2024, 5, 31, 23, 0, tzinfo=timezone.utc).timestamp()
+    later = datetime(2024, 6, 1, 0, 0, tzinfo=timezone.utc).timestamp()
+    assert warmer.next_run_at(later) == datetime(2024, 6, 1, 15, 30, tzinfo=timezone.utc).timestamp()
@@ -0,0 +1,67 @@
+import time
+
+import pytest
+
+import cache
+import weather_cache
+
+
+@pytest.fixture
+def refreshed(monkeypatch):
+    for name in ("forecasts", "aliases", "advisories"):
+        monkeypatch.setattr(weather_cache, name, cache.ResponseCache(name, 3600, backend=cache.MemoryBackend()))
+    scheduled = []
+    monkeypatch.setattr(weather_cache, "schedule_refresh", lambda query, call: scheduled.append(query))
+    return scheduled
+
+
+def forecast(name, lat, lon, max_temp=31.0):
+    return {
+        "location": {"name": name, "lat": lat, "lon": lon},
+        "forecast": {"forecastday": [{"date": "2024-06-01", "day": {"maxtemp_c": max_temp}}]},
+    }
+
+
+def test_aliases_resolve_to_a_shared_geo_cell(refreshed):
+    weather_cache.store("Ludhiana", forecast("Ludhiana", 30.91, 75.82))
+    # A neighbouring village in the same 0.1 degree cell reuses the entry.
+    weather_cache.store("Gill", forecast("Gill", 30.88, 75.84))
+    assert weather_cache.cell(forecast("x", 30.91, 75.82)) == weather_cache.cell(forecast("x", 30.88, 75.84))
+    assert len(weather_cache.forecasts.backend) == 1
+
+    call = object()
+    found = weather_cache.lookup("  LUDHIANA ", call)
+    assert found["location"]["name"] == "Ludhiana"
+    assert weather_cache.lookup("gill", call)["location"]["name"] == "Gill"
+    assert weather_cache.lookup("Amritsar", call) is None
+    assert not refreshed
+
+
+def test_refresh_ahead_only_inside_the_refresh_window(refreshed, monkeypatch):
+    weather_cache.store("Pune", forecast("Pune", 18.52, 73.86))
+    weather_cache.lookup("Pune", None)
+    assert refreshed == []
+
+    fetched_at = time.time() - weather_cache.FORECAST_TTL * weather_cache.REFRESH_AHEAD - 1
+    key = weather_cache.cell(forecast("Pune", 18.52, 73.86))
+    entry = weather_cache.forecasts.get(key)
+    weather_cache.forecasts.set(key, {**entry, "fetched_at": fetched_at})
+    assert weather_cache.lookup("Pune", None) is not None
+    assert refreshed == ["Pune"]
+
+
+def test_schedule_refresh_runs_once_per_query(monkeypatch):
+    monkeypatch.setattr(weather_cache, "_refreshing", {"pune"})
+    before = weather_cache.refreshes["scheduled"]
+    weather_cache.schedule_refresh(" Pune ", None)
+    assert weather_cache.refreshes["scheduled"] == before
+
+
+def test_advisory_key_follows_the_forecast():
+    data = forecast("Pune", 18.52, 73.86)
+    days = data["forecast"]["forecastday"]
+    key = weather_cache.advisory_key(data, days, "Pune")
+    assert key == weather_cache.advisory_key(forecast("Pune", 18.52, 73.86), days, "Pune")
+    hotter = forecast("Pune", 18.52, 73.86, max_temp=38.0)
+    assert weather_cache.advisory_key(hotter, hotter["forecast"]["forecastday"], "Pune") != key
+    assert key[:2] == weather_cache.cell(data)
@@ -0,0 +1,347 @@
+"""
+On-CPU triage of /detect-disease uploads before Gemini is called.
+
+Each image is decoded at thumbnail size (``THUMB_EDGE`` pixels) and reduced
+to a small NumPy feature vector: sharpness (variance of the Laplacian over
+the variance of the image), brightness, contrast, the fraction of green
+(leaf) and brown/yellow (lesion) pixels, mean saturation and a hue
+histogram. Then:
+
+* images that are too dark, overexposed, too blurry or show no plant are
+  answered at once with ``"disease": "Unusable image"`` and a retake hint;
+* when a model is configured (``TRIAGE_MODEL``, an ``.npz`` written by
+  ``python triage.py train``), a softmax classifier over the features
+  answers healthy or known-disease cases locally when its probability is at
+  least ``TRIAGE_CONFIDENCE``;
+* everything else is escalated to Gemini as before.
+
+Local answers use the usual ``disease`` / ``cure`` / ``confidence`` schema
+plus a ``triage`` block. The model is loaded once per worker and batch
+uploads are classified with one matrix product. Triage needs NumPy and
+Pillow; without them, or when an image cannot be decoded, it escalates.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+import uploads
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("TRIAGE", "0") == "1"
+MODEL_PATH = os.getenv("TRIAGE_MODEL", "")
+CONFIDENCE = float(os.getenv("TRIAGE_CONFIDENCE", "0.9"))
+MIN_SHARPNESS = float(os.getenv("TRIAGE_MIN_SHARPNESS", "0.2"))
+MIN_PLANT = float(os.getenv("TRIAGE_MIN_PLANT", "0.15"))
+MIN_BRIGHTNESS = float(os.getenv("TRIAGE_MIN_BRIGHTNESS", "0.08"))
+MAX_BRIGHTNESS = float(os.getenv("TRIAGE_MAX_BRIGHTNESS", "0.95"))
+HEALTHY_MAX_LESION = float(os.getenv("TRIAGE_HEALTHY_MAX_LESION", "0.002"))
+THUMB_EDGE = 128
+HUE_BINS = 8
+
+FEATURES = (
+    "sharpness", "brightness", "contrast", "green", "lesion", "lesion_share", "saturation",
+    *(f"hue_{n}" for n in range(HUE_BINS)),
+)
+HEALTHY = "healthy"
+HEALTHY_DISEASE = "No disease detected"
+HEALTHY_CURE = (
+    "Your crop appears healthy! Continue with regular care: 1. Water consistently. "
+    "2. Monitor for pests. 3. Apply balanced fertilizer."
+)
+DEFAULT_CURE = "Remove affected leaves and consult your local agriculture extension officer for a suitable treatment."
+REJECTIONS = {
+    "dark": "The photo is too dark.",
+    "overexposed": "The photo is overexposed.",
+    "blurry": "The photo is too blurry.",
+    "no_plant": "No plant leaves are visible in the photo.",
+}
+RETAKE = "Please retake it in daylight, close to the affected leaves, holding the camera steady."
+
+totals = {"images": 0, "rejected": 0, "local": 0, "escalated": 0, "seconds": 0.0}
+_totals_lock = threading.Lock()
+_model = None
+_model_loaded = False
+_model_lock = threading.Lock()
+
+
+def features(image):
+    """``(vector, sharpness)`` with the vector in ``FEATURES`` order, or None
+    if the image cannot be decoded."""
+    import numpy as np
+    from PIL import Image
+
+    try:
+        with Image.open(uploads.open_source(image)) as img:
+            img.draft("RGB", (THUMB_EDGE, THUMB_EDGE))
+            img = img.convert("RGB")
+            img.thumbnail((THUMB_EDGE, THUMB_EDGE), Image.BILINEAR)
+            rgb = np.asarray(img, dtype=np.float32) / 255.0
+    except Exception:
+        return None
+
+    gray = rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    laplacian = 4 * gray[1:-1, 1:-1] - gray[:-2, 1:-1] - gray[2:, 1:-1] - gray[1:-1, :-2] - gray[1:-1, 2:]
+    # Edge energy relative to contrast, so that high-contrast blurred shots
+    # do not pass for sharp ones.
+    sharpness = float(laplacian.var() / (gray.var() + 1e-4)) if laplacian.size else 0.0
+
+    high, low = rgb.max(axis=-1), rgb.min(axis=-1)
+    chroma = high - low
+    saturation = np.where(high > 0, chroma / np.maximum(high, 1e-6), 0.0)
+    red, green, blue = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    safe = np.maximum(chroma, 1e-6)
+    hue = np.select(
+        [high == red, high == green],
+        [((green - blue) / safe) % 6, (blue - red) / safe + 2],
+        (red - green) / safe + 4,
+    ) / 6.0
+    total = rgb.sum(axis=-1) + 1e-6
+    excess_green = (2 * green - red - blue) / total
+    leaf = excess_green > 0.05
+    # Brown and yellow (hue 15-65 degrees, visibly saturated) pixels count as
+    # lesions only when enclosed by leaf, which leaves out the soil around it.
+    brown = ~leaf & (hue > 15 / 360) & (hue < 65 / 360) & (saturation > 0.25) & (high > 0.15)
+    lesion = brown & _enclosed(leaf)
+    colored = saturation > 0.2
+    histogram = np.histogram(hue[colored], bins=HUE_BINS, range=(0.0, 1.0))[0].astype(np.float32)
+    histogram /= max(1.0, float(colored.sum()))
+
+    leaf_fraction, lesion_fraction = float(leaf.mean()), float(lesion.mean())
+    vector = np.array([
+        sharpness,
+        gray.mean(),
+        gray.std(),
+        leaf_fraction,
+        lesion_fraction,
+        lesion_fraction / max(1e-6, leaf_fraction + lesion_fraction),
+        saturation.mean(),
+        *histogram,
+    ], dtype=np.float32)
+    return vector, sharpness
+
+
+def _enclosed(mask):
+    """Pixels with ``mask`` set somewhere to their left, right, top and bottom."""
+    import numpy as np
+
+    inside = np.logical_or.accumulate(mask, axis=1) & np.logical_or.accumulate(mask[:, ::-1], axis=1)[:, ::-1]
+    inside &= np.logical_or.accumulate(mask, axis=0) & np.logical_or.accumulate(mask[::-1], axis=0)[::-1]
+    return inside
+
+
+def rejection(vector, sharpness):
+    """Reason an image is unusable (a ``REJECTIONS`` key), or None."""
+    brightness, plant = vector[1], vector[3] + vector[4]
+    if brightness < MIN_BRIGHTNESS:
+        return "dark"
+    if brightness > MAX_BRIGHTNESS:
+        return "overexposed"
+    if plant < MIN_PLANT:
+        return "no_plant"
+    if sharpness < MIN_SHARPNESS:
+        return "blurry"
+    return None
+
+
+class Model:
+    """Softmax regression over standardized features."""
+
+    def __init__(self, weights, bias, mean, scale, classes, cures):
+        self.weights, self.bias, self.mean, self.scale = weights, bias, mean, scale
+        self.classes, self.cures = [str(c) for c in classes], [str(c) for c in cures]
+
+    @classmethod
+    def load(cls, path):
+        import numpy as np
+
+        with np.load(path, allow_pickle=False) as data:
+            if list(data["features"]) != list(FEATURES):
+                raise ValueError("model was trained on different features")
+            return cls(data["weights"], data["bias"], data["mean"], data["scale"], data["classes"], data["cures"])
+
+    def save(self, path):
+        import numpy as np
+
+        np.savez(path, weights=self.weights, bias=self.bias, mean=self.mean, scale=self.scale,
+                 classes=np.array(self.classes), cures=np.array(self.cures), features=np.array(FEATURES))
+
+    def probabilities(self, matrix):
+        import numpy as np
+
+        logits = ((matrix - self.mean) / self.scale) @ self.weights + self.bias
+        logits -= logits.max(axis=1, keepdims=True)
+        exp = np.exp(logits)
+        return exp / exp.sum(axis=1, keepdims=True)
+
+
+def model():
+    """The configured model, loaded once per worker; None without one."""
+    global _model, _model_loaded
+    if not _model_loaded:
+        with _model_lock:
+            if not _model_loaded:
+                if MODEL_PATH:
+                    try:
+                        _model = Model.load(MODEL_PATH)
+                    except Exception as exc:
+                        logger.warning("Could not load triage model %s: %s", MODEL_PATH, exc)
+                _model_loaded = True
+    return _model
+
+
+def classify_batch(images):
+    """One verdict per image: ``{"verdict": "rejected" | "local" | "escalate", ...}``."""
+    start = time.perf_counter()
+    try:
+        import numpy as np
+
+        extracted = [features(image) for image in images]
+    except ImportError:
+        logger.warning("NumPy or Pillow is not installed; triage escalates every image")
+        return [{"verdict": "escalate"} for _ in images]
+
+    verdicts = [None] * len(images)
+    candidates = []
+    for position, item in enumerate(extracted):
+        if item is None:
+            verdicts[position] = {"verdict": "escalate"}
+            continue
+        reason = rejection(*item)
+        if reason is not None:
+            verdicts[position] = {"verdict": "rejected", "reason": reason}
+        else:
+            candidates.append(position)
+
+    classifier = model()
+    if candidates and classifier is not None:
+        probabilities = classifier.probabilities(np.stack([extracted[position][0] for position in candidates]))
+        for position, row in zip(candidates, probabilities):
+            best = int(row.argmax())
+            lesion_share = extracted[position][0][5]
+            if classifier.classes[best] == HEALTHY and lesion_share > HEALTHY_MAX_LESION:
+                # Never call a leaf with visible lesions healthy without Gemini.
+                continue
+            if row[best] >= CONFIDENCE:
+                verdicts[position] = {
+                    "verdict": "local",
+                    "label": classifier.classes[best],
+                    "cure": classifier.cures[best],
+                    "probability": round(float(row[best]), 3),
+                }
+    verdicts = [verdict or {"verdict": "escalate"} for verdict in verdicts]
+
+    elapsed = time.perf_counter() - start
+    with _totals_lock:
+        totals["images"] += len(images)
+        totals["seconds"] += elapsed
+        for verdict in verdicts:
+            totals["escalated" if verdict["verdict"] == "escalate" else verdict["verdict"]] += 1
+    return verdicts
+
+
+def classify(image):
+    return classify_batch([image])[0]
+
+
+def answer(verdict):
+    """The /detect-disease body for a local verdict, or None to ask Gemini."""
+    if verdict["verdict"] == "rejected":
+        return {
+            "disease": "Unusable image",
+            "cure": f"{REJECTIONS[verdict['reason']]} {RETAKE}",
+            "confidence": "high",
+            "triage": {"verdict": "rejected", "reason": verdict["reason"]},
+        }
+    if verdict["verdict"] == "local":
+        healthy = verdict["label"] == HEALTHY
+        return {
+            "disease": HEALTHY_DISEASE if healthy else verdict["label"],
+            "cure": verdict["cure"],
+            "confidence": "high",
+            "triage": {"verdict": "local", "probability": verdict["probability"]},
+        }
+    return None
+
+
+def stats():
+    with _totals_lock:
+        snapshot = dict(totals)
+    classifier = model() if ENABLED else None
+    return {
+        "enabled": ENABLED,
+        "model": MODEL_PATH or None,
+        "classes": classifier.classes if classifier else [],
+        "images": snapshot["images"],
+        "rejected": snapshot["rejected"],
+        "local": snapshot["local"],
+        "escalated": snapshot["escalated"],
+        "ms_per_image": round(snapshot["seconds"] * 1000 / snapshot["images"], 3) if snapshot["images"] else None,
+    }
+
+
+def train(samples, cures=None, steps=2000, rate=0.5, l2=1e-3):
+    """Fit a ``Model`` to ``[(label, image)]``; ``cures`` maps labels to cure text."""
+    import numpy as np
+
+    cures = cures or {}
+    rows, labels = [], []
+    for label, image in samples:
+        item = features(image)
+        if item is not None and rejection(*item) is None:
+            rows.append(item[0])
+            labels.append(label)
+    classes = sorted(set(labels))
+    if len(classes) < 2:
+        raise ValueError("need usable images of at least two classes")
+    matrix = np.stack(rows)
+    mean, scale = matrix.mean(axis=0), matrix.std(axis=0) + 1e-6
+    inputs = (matrix - mean) / scale
+    targets = np.eye(len(classes), dtype=np.float32)[[classes.index(label) for label in labels]]
+    weights = np.zeros((len(FEATURES), len(classes)), dtype=np.float32)
+    bias = np.zeros(len(classes), dtype=np.float32)
+    for _ in range(steps):
+        logits = inputs @ weights + bias
+        logits -= logits.max(axis=1, keepdims=True)
+        exp = np.exp(logits)
+        error = exp / exp.sum(axis=1, keepdims=True) - targets
+        weights -= rate * (inputs.T @ error / len(inputs) + l2 * weights)
+        bias -= rate * error.mean(axis=0)
+    cure_texts = [cures.get(label) or (HEALTHY_CURE if label == HEALTHY else DEFAULT_CURE) for label in classes]
+    trained = Model(weights, bias, mean, scale, classes, cure_texts)
+    accuracy = float((trained.probabilities(matrix).argmax(axis=1) == targets.argmax(axis=1)).mean())
+    return trained, {"images": len(rows), "skipped": len(samples) - len(rows), "classes": classes, "accuracy": accuracy}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the /detect-disease triage model")
+    parser.add_argument("dataset", help="directory with one subdirectory of images per class (use 'healthy' "
+                                        "for healthy leaves) and an optional cures.json {class: cure}")
+    parser.add_argument("--out", default="triage_model.npz")
+    args = parser.parse_args()
+
+    samples = []
+    for label in sorted(os.listdir(args.dataset)):
+        folder = os.path.join(args.dataset, label)
+        if os.path.isdir(folder):
+            for name in sorted(os.listdir(folder)):
+                with open(os.path.join(folder, name), "rb") as image_file:
+                    samples.append((label, image_file.read()))
+    cures_path = os.path.join(args.dataset, "cures.json")
+    cures = {}
+    if os.path.exists(cures_path):
+        with open(cures_path, encoding="utf-8") as cures_file:
+            cures = json.load(cures_file)
+
+    trained, report = train(samples, cures)
+    trained.save(args.out)
+    print(json.dumps(report, indent=2))
+    print(f"Wrote {args.out}; set TRIAGE=1 TRIAGE_MODEL={args.out}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Memory-bounded upload handling for /detect-disease.
+
+Uploads larger than ``UPLOAD_MAX_BYTES`` are refused before the body is
+read. Accepted files stay in the spooled temporary file the server parsed
+them into (Werkzeug and Starlette both move large parts to disk) instead of
+being read into memory, and the Gemini request is sent as a stream: the JSON
+around the image is written as is and the image is base64-encoded
+``CHUNK_SIZE`` bytes at a time. A request therefore never holds the raw
+upload, its base64 text and the serialized JSON body at the same time.
+
+Handlers accept either ``bytes`` or a seekable binary file as an image
+source; ``UPLOAD_STREAMING=0`` restores reading uploads into memory.
+"""
+import base64
+import hashlib
+import io
+import json
+import os
+
+MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(20 * 1024 * 1024)))
+STREAMING = os.getenv("UPLOAD_STREAMING", "1") == "1"
+# A multiple of 3, so every chunk base64-encodes without padding.
+CHUNK_SIZE = 3 * 64 * 1024
+
+# Stands in for the base64 data while the surrounding JSON is serialized.
+INLINE_DATA = "\x00inline-data\x00"
+
+
+class TooLarge(Exception):
+    """Raised while receiving a body that exceeds the upload limit."""
+
+
+def too_large(limit):
+    return {"detail": f"Upload is too large. The limit is {limit // (1024 * 1024)} MB."}, 413
+
+
+def open_source(source):
+    """Return a binary file positioned at the start of ``source``."""
+    if isinstance(source, (bytes, bytearray)):
+        return io.BytesIO(source)
+    source.seek(0)
+    return source
+
+
+def size(source):
+    if isinstance(source, (bytes, bytearray)):
+        return len(source)
+    source.seek(0, os.SEEK_END)
+    length = source.tell()
+    source.seek(0)
+    return length
+
+
+def iter_chunks(source, chunk_size=CHUNK_SIZE):
+    stream = open_source(source)
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def sha256(source):
+    digest = hashlib.sha256()
+    for chunk in iter_chunks(source):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+class StreamedBody:
+    """JSON request body whose ``INLINE_DATA`` value is streamed from ``source``
+    as base64. Iterating it again restarts from the beginning, so the HTTP
+    client can resend it on retry."""
+
+    def __init__(self, payload, source, identity):
+        head, tail = json.dumps(payload).split(json.dumps(INLINE_DATA))
+        self.head = (head + '"').encode("utf-8")
+        self.tail = ('"' + tail).encode("utf-8")
+        self.source = source
+        self.identity = identity
+        self.length = len(self.head) + 4 * -(-size(source) // 3) + len(self.tail)
+
+    def __len__(self):
+        # requests sizes iterable bodies with len(); without it the body would
+        # be sent with Transfer-Encoding: chunked next to our Content-Length.
+        return self.length
+
+    @property
+    def headers(self):
+        return {"Content-Type": "application/json", "Content-Length": str(self.length)}
+
+    def __iter__(self):
+        yield self.head
+        for chunk in iter_chunks(self.source):
+            yield base64.b64encode(chunk)
+        yield self.tail
+
+    def key(self):
+        """Identity of the body for single-flight; ``identity`` stands for the image."""
+        return hashlib.sha1(self.head + self.identity.encode("utf-8") + self.tail).hexdigest()
@@ -0,0 +1,291 @@
+"""
+Shared HTTP client for upstream APIs (Gemini, WeatherAPI).
+
+One keep-alive session is kept per host so repeated calls reuse pooled
+TCP/TLS connections instead of paying a new handshake on every request.
+"""
+import contextvars
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import circuit
+import governor
+import metrics
+from singleflight import Group
+
+POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE", "10"))
+CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))
+# Optional cap on the per-call read timeouts used by the handlers.
+READ_TIMEOUT = float(os.getenv("UPSTREAM_READ_TIMEOUT", "0")) or None
+RETRIES = int(os.getenv("UPSTREAM_RETRIES", "2"))
+RETRY_BACKOFF = float(os.getenv("UPSTREAM_RETRY_BACKOFF", "0.5"))
+RETRY_STATUSES = (502, 503, 504)
+RACE_WORKERS = int(os.getenv("UPSTREAM_RACE_WORKERS", "16"))
+# Identical calls in flight at the same time share one upstream request.
+SINGLE_FLIGHT = os.getenv("UPSTREAM_SINGLE_FLIGHT", "1") == "1"
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+flights = Group()
+
+
+def _build_session():
+    # Connection errors and gateway failures are retried; read timeouts are
+    # not, since a second 90 s wait is worse than failing the request.
+    retry = Retry(
+        total=RETRIES,
+        connect=RETRIES,
+        read=0,
+        status=RETRIES,
+        backoff_factor=RETRY_BACKOFF,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=None,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session(url):
+    """Return the pooled session for the host of ``url``."""
+    parts = urlsplit(url)
+    host = f"{parts.scheme}://{parts.netloc}"
+    session = _sessions.get(host)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(host)
+            if session is None:
+                session = _build_session()
+                _sessions[host] = session
+    return session
+
+
+def read_timeout(timeout):
+    """Apply the optional ``UPSTREAM_READ_TIMEOUT`` cap to a per-call timeout."""
+    if READ_TIMEOUT is not None and (timeout is None or timeout > READ_TIMEOUT):
+        timeout = READ_TIMEOUT
+    return timeout
+
+
+def _timeout(timeout):
+    return (CONNECT_TIMEOUT, read_timeout(timeout))
+
+
+class Call:
+    """An upstream HTTP request yielded by a handler flow (see handlers.py)."""
+
+    __slots__ = ("method", "url", "timeout", "params", "headers", "json", "body")
+
+    def __init__(self, method, url, timeout, params=None, headers=None, json=None, body=None):
+        """``body`` is an alternative to ``json``: a re-iterable streamed body
+        with ``headers`` and ``key()`` (see uploads.StreamedBody)."""
+        self.method = method
+        self.url = url
+        self.timeout = timeout
+        self.params = params
+        self.headers = headers
+        self.json = json
+        self.body = body
+
+    def key(self):
+        """Identity used to coalesce identical concurrent calls."""
+        body = self.body.key() if self.body is not None else self.json
+        data = json.dumps([self.method, self.url, self.params, body], sort_keys=True, default=str)
+        return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+    def send_headers(self):
+        if self.body is None:
+            return self.headers
+        return {**(self.headers or {}), **self.body.headers}
+
+
+class Blocking:
+    """CPU-bound work yielded by a handler flow; the ASGI server runs it in a
+    thread so it does not stall the event loop."""
+
+    __slots__ = ("fn", "args")
+
+    def __init__(self, fn, *args):
+        self.fn = fn
+        self.args = args
+
+
+class Race:
+    """Several calls sent at once; the first success wins and is returned as
+    ``(index, result)``. If every call fails, the first call's error is raised."""
+
+    __slots__ = ("calls",)
+
+    def __init__(self, calls):
+        self.calls = calls
+
+
+_race_pool = None
+
+
+def _race(calls):
+    global _race_pool
+    if _race_pool is None:
+        with _sessions_lock:
+            if _race_pool is None:
+                _race_pool = ThreadPoolExecutor(max_workers=RACE_WORKERS, thread_name_prefix="upstream-race")
+    # Each racer runs in the caller's context so the governor sees its route.
+    futures = {
+        _race_pool.submit(contextvars.copy_context().run, execute, call): index for index, call in enumerate(calls)
+    }
+    errors = [None] * len(calls)
+    for future in as_completed(futures):
+        index = futures[future]
+        try:
+            result = future.result()
+        except Exception as exc:
+            errors[index] = exc
+            continue
+        # Blocking requests cannot be interrupted; losers that already
+        # started run to completion and their results are dropped.
+        for other in futures:
+            other.cancel()
+        return index, result
+    raise errors[0]
+
+
+def execute(call):
+    """Send ``call`` on the pooled session and return the decoded JSON body.
+
+    Non-2xx responses raise ``requests.HTTPError``; calls refused locally (an
+    open circuit, a full Gemini queue) raise ``circuit.Unavailable``.
+    """
+    if isinstance(call, Blocking):
+        return call.fn(*call.args)
+    if isinstance(call, Race):
+        return _race(call.calls)
+    if SINGLE_FLIGHT:
+        return flights.do(call.key(), lambda: _send(call))
+    return _send(call)
+
+
+class Admission:
+    """A call let through by its host's circuit breaker and, for Gemini, the
+    governor. ``finish`` reports the outcome to both; it is idempotent, so a
+    response's close hook can finish an admission its stream never used."""
+
+    def __init__(self, call):
+        self.breaker = circuit.check(call.url)
+        self.ticket = None
+        self.finished = False
+
+    def finish(self, exc=None):
+        if self.finished:
+            return
+        self.finished = True
+        self.breaker.record(exc)
+        if self.ticket is not None:
+            self.ticket.release(exc)
+
+    def abandon(self):
+        self.finish(GeneratorExit())
+
+
+def admit(call):
+    """Return the ``Admission`` for ``call`` or raise ``circuit.Unavailable``."""
+    admission = Admission(call)
+    try:
+        admission.ticket = governor.admit(call)
+    except BaseException as exc:
+        admission.finish(exc)
+        raise
+    return admission
+
+
+def _send(call):
+    admission = admit(call)
+    try:
+        result = _send_admitted(call)
+    except BaseException as exc:
+        admission.finish(exc)
+        raise
+    admission.finish()
+    return result
+
+
+def _send_admitted(call):
+    started = time.perf_counter()
+    try:
+        response = request(
+            call.method,
+            call.url,
+            timeout=call.timeout,
+            params=call.params,
+            headers=call.send_headers(),
+            json=call.json,
+            data=call.body,
+        )
+    except requests.RequestException:
+        metrics.record_upstream(call.url, "error", time.perf_counter() - started)
+        raise
+    metrics.record_upstream(call.url, response.status_code, time.perf_counter() - started, response.request.headers)
+    response.raise_for_status()
+    return response.json()
+
+
+def stream_events(call, admission=None):
+    """Send ``call`` and yield each JSON ``data:`` payload of the SSE response.
+
+    ``admission`` is passed when the caller admitted the call up front (to
+    answer 503 before the response starts).
+    """
+    if admission is None:
+        admission = admit(call)
+    try:
+        started = time.perf_counter()
+        response = request(
+            call.method,
+            call.url,
+            timeout=call.timeout,
+            params=call.params,
+            headers=call.headers,
+            json=call.json,
+            stream=True,
+        )
+        # Latency here is time to the response headers, not to the last event.
+        metrics.record_upstream(call.url, response.status_code, time.perf_counter() - started, response.request.headers)
+        with response:
+            response.raise_for_status()
+            for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                if line and line.startswith("data:"):
+                    yield json.loads(line[5:])
+    except BaseException as exc:
+        admission.finish(exc)
+        raise
+    admission.finish()
+
+
+def request(method, url, timeout=None, **kwargs):
+    return get_session(url).request(method, url, timeout=_timeout(timeout), **kwargs)
+
+
+def post(url, timeout=None, **kwargs):
+    return get_session(url).post(url, timeout=_timeout(timeout), **kwargs)
+
+
+def get(url, timeout=None, **kwargs):
+    return get_session(url).get(url, timeout=_timeout(timeout), **kwargs)
+
+
+def close_all():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
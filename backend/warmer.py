@@ -0,0 +1,383 @@
+"""
+Cache warmer for the hot /market-prices and /weather-crop-advisory keys.
+
+Farmers check prices and weather mostly between 6 and 9 am, and every key
+that is cold then pays the full Gemini / WeatherAPI latency. The warmer
+refreshes the hottest keys before that:
+
+* Keys are learned from traffic. Each request adds to its key's score, and
+  scores halve every ``WARM_HALF_LIFE_HOURS``. They are persisted to
+  ``WARM_STATE_PATH``, so a fresh deploy knows yesterday's hot keys. Keys
+  listed in ``WARM_KEYS_PATH`` (a JSON file, see the README) are always
+  warmed. Per endpoint the ``WARM_TOP_N`` best keys are warmed.
+* Runs happen at the local times in ``WARM_AT`` (off-peak, before the
+  morning rush) and once ``WARM_START_DELAY`` seconds after the process
+  starts, so new instances do not serve the rush cold.
+* A run refreshes at most ``WARM_CONCURRENCY`` keys at once. Its Gemini
+  calls have the lowest governor priority, and no new key starts while
+  Gemini calls queue or more than ``WARM_MAX_SHARE`` of the concurrency
+  limit is in use. A refused call (429 backoff, open circuit) pauses the run
+  for its ``Retry-After``. Keys refreshed by any worker in the last
+  ``WARM_MIN_INTERVAL`` seconds (claims live in the shared cache backend)
+  and prices the local price store already answers are skipped. While the
+  health probes find Gemini down, no new key starts.
+
+Progress and the hit rate of warmed vs. other keys are under ``warmer`` in
+``GET /upstream-stats``.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+
+import cache
+import circuit
+import governor
+import health
+import metrics
+import price_store
+import stale
+import weather_cache
+from config import api_key, weather_api_key
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("WARMER", "1") == "1"
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+STATE_PATH = os.getenv("WARM_STATE_PATH", os.path.join(DATA_DIR, "warm_keys.json"))
+KEYS_PATH = os.getenv("WARM_KEYS_PATH", "")
+TOP_N = int(os.getenv("WARM_TOP_N", "20"))
+HALF_LIFE = float(os.getenv("WARM_HALF_LIFE_HOURS", "72")) * 3600
+WARM_AT = [t.strip() for t in os.getenv("WARM_AT", "04:30").split(",") if t.strip()]
+UTC_OFFSET = timedelta(minutes=int(os.getenv("WARM_UTC_OFFSET_MINUTES", "330")))
+START_DELAY = float(os.getenv("WARM_START_DELAY", "30"))
+CONCURRENCY = int(os.getenv("WARM_CONCURRENCY", "2"))
+MAX_SHARE = float(os.getenv("WARM_MAX_SHARE", "0.5"))
+MIN_INTERVAL = float(os.getenv("WARM_MIN_INTERVAL", "1800"))
+MAX_RUN_SECONDS = float(os.getenv("WARM_MAX_RUN_SECONDS", "1800"))
+# A request counts as "on a warmed key" this long after the key was warmed.
+EFFECT_WINDOW = 6 * 3600
+SAVE_INTERVAL = 300
+BUSY_PAUSE = 2.0
+MAX_TRACKED = 500
+
+ENDPOINTS = ("market-prices", "weather-crop-advisory")
+PARAMS = {
+    "market-prices": ("location", "commodity"),
+    "weather-crop-advisory": ("city", "state", "country"),
+}
+
+claims = cache.ResponseCache("warm-claims", MIN_INTERVAL)
+
+_lock = threading.Lock()
+_wake = threading.Event()
+_thread = None
+# key id -> {"endpoint", "params", "score", "last_seen"}, as of the last save
+_scores = {}
+# key id -> requests since the last save (their params are in _params)
+_pending = {}
+_params = {}
+_warmed = {}
+_saved_at = None
+progress = {"running": False, "trigger": None, "started_at": None, "total": 0, "done": 0}
+last_run = {}
+counters = {"runs": 0, "warmed": 0, "skipped": 0, "failed": 0, "deferred": 0}
+traffic = {name: {"requests": 0, "hits": 0, "warm_requests": 0, "warm_hits": 0} for name in ENDPOINTS}
+
+
+def key_id(endpoint, params):
+    values = [cache.normalize(params.get(field) or "") for field in PARAMS[endpoint]]
+    return "|".join([endpoint, *values])
+
+
+def clean_params(endpoint, params):
+    return {field: str(params.get(field) or "").strip() for field in PARAMS[endpoint]}
+
+
+def observe(endpoint, params, hit):
+    """Count a request for ``endpoint`` with ``params``; ``hit`` is whether it
+    was answered without an upstream call."""
+    if not ENABLED or metrics.endpoint.get() == "job:warmer":
+        return
+    key = key_id(endpoint, params)
+    with _lock:
+        _pending[key] = _pending.get(key, 0) + 1
+        _params.setdefault(key, (endpoint, clean_params(endpoint, params)))
+    row = traffic[endpoint]
+    row["requests"] += 1
+    row["hits"] += hit
+    warmed_at = _warmed.get(key)
+    if warmed_at is not None and time.time() - warmed_at < EFFECT_WINDOW:
+        row["warm_requests"] += 1
+        row["warm_hits"] += hit
+
+
+def _decayed(score, since, now):
+    return score * 0.5 ** (max(0.0, now - since) / HALF_LIFE) if HALF_LIFE > 0 else score
+
+
+def save():
+    """Merge the requests seen since the last save into ``WARM_STATE_PATH``."""
+    global _scores, _saved_at
+    now = time.time()
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+        params = dict(_params)
+        _params.clear()
+    try:
+        with open(STATE_PATH, encoding="utf-8") as state_file:
+            state = json.load(state_file)
+    except FileNotFoundError:
+        state = {}
+    except (OSError, ValueError) as exc:
+        logger.warning("Could not read warmer state %s: %s", STATE_PATH, exc)
+        state = {}
+    # Other workers merge into the same file, so start from what is on disk.
+    saved_at = state.get("saved_at", now)
+    scores = {
+        key: {**entry, "score": _decayed(entry["score"], saved_at, now)}
+        for key, entry in state.get("keys", {}).items()
+        if entry.get("endpoint") in ENDPOINTS
+    }
+    for key, count in pending.items():
+        endpoint, key_params = params[key]
+        entry = scores.setdefault(key, {"endpoint": endpoint, "params": key_params, "score": 0.0})
+        entry["score"] += count
+        entry["last_seen"] = now
+    kept = sorted(scores.items(), key=lambda item: item[1]["score"], reverse=True)[:MAX_TRACKED]
+    scores = {key: entry for key, entry in kept if entry["score"] >= 0.05}
+    try:
+        os.makedirs(os.path.dirname(STATE_PATH), exist_ok=True)
+        tmp_path = f"{STATE_PATH}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as state_file:
+            json.dump({"version": 1, "saved_at": now, "keys": scores}, state_file)
+        os.replace(tmp_path, STATE_PATH)
+    except OSError as exc:
+        logger.warning("Could not save warmer state %s: %s", STATE_PATH, exc)
+    _scores, _saved_at = scores, now
+
+
+def configured_keys():
+    """``[(endpoint, params)]`` from ``WARM_KEYS_PATH``."""
+    if not KEYS_PATH:
+        return []
+    try:
+        with open(KEYS_PATH, encoding="utf-8") as keys_file:
+            listed = json.load(keys_file)
+    except (OSError, ValueError) as exc:
+        logger.warning("Could not load warm keys %s: %s", KEYS_PATH, exc)
+        return []
+    return [
+        (endpoint, clean_params(endpoint, params))
+        for endpoint in ENDPOINTS
+        for params in listed.get(endpoint, [])
+        if isinstance(params, dict)
+    ]
+
+
+def hottest(endpoint, limit=TOP_N):
+    entries = [entry for entry in _scores.values() if entry["endpoint"] == endpoint]
+    return sorted(entries, key=lambda entry: entry["score"], reverse=True)[:limit]
+
+
+def plan():
+    """Keys to warm, configured ones first, then the ``TOP_N`` hottest per endpoint."""
+    keys = {}
+    for endpoint, params in configured_keys():
+        keys.setdefault(key_id(endpoint, params), (endpoint, params))
+    for endpoint in ENDPOINTS:
+        for entry in hottest(endpoint):
+            keys.setdefault(key_id(endpoint, entry["params"]), (endpoint, entry["params"]))
+    if not weather_api_key:
+        keys = {key: value for key, value in keys.items() if value[0] != "weather-crop-advisory"}
+    return list(keys.items())
+
+
+def _weather_flow(params):
+    # Imported here: handlers imports this module.
+    import handlers
+
+    query = ",".join(part for part in [params["city"], params["state"], params["country"] or "IN"] if part)
+    forecast = yield handlers.forecast_call(query)
+    if forecast.get("forecast", {}).get("forecastday"):
+        weather_cache.store(query, forecast)
+    result = yield from handlers.fetch_weather_crop_advisory(
+        params["city"], params["state"], params["country"] or "IN", query
+    )
+    return result, (cache.normalize(query),)
+
+
+def _market_flow(params):
+    import handlers
+
+    location, commodity = params["location"] or "India", params["commodity"]
+    cache_key = (cache.normalize(location), cache.normalize(commodity))
+    result = yield from handlers.fetch_market_prices(location, commodity, cache_key)
+    return result, cache_key
+
+
+FLOWS = {"market-prices": _market_flow, "weather-crop-advisory": _weather_flow}
+
+
+def warm(key, endpoint, params):
+    """Refresh one key; returns "warmed", "skipped" or "failed"."""
+    import handlers
+
+    metrics.endpoint.set("job:warmer")
+    if claims.get((key,), count=False) is not None:
+        return "skipped"
+    if endpoint == "market-prices" and price_store.covers(params["location"] or "India", params["commodity"]):
+        return "skipped"
+    claims.set((key,), {"claimed_at": time.time()})
+    try:
+        result, stale_key = handlers.run(FLOWS[endpoint](params))
+    except circuit.Unavailable:
+        claims.delete((key,))
+        raise
+    except Exception as exc:
+        logger.warning("Warming %s failed: %s", key, exc)
+        return "failed"
+    if not stale.good(result):
+        logger.info("Warming %s failed: %s", key, str(result[0].get("detail", ""))[:200])
+        return "failed"
+    stale.remember(endpoint, stale_key, result[0])
+    _warmed[key] = time.time()
+    return "warmed"
+
+
+def _busy():
+    """Whether Gemini is too loaded (or down) to start another warm call."""
+    if health.down("gemini"):
+        return True
+    state = governor.stats()
+    if not state["enabled"]:
+        return False
+    return state["queue_depth"] > 0 or state["next_slot_s"] > 0 or state["in_flight"] >= state["limit"] * MAX_SHARE
+
+
+def run(trigger="manual"):
+    """Warm every planned key with bounded concurrency; returns the run's summary."""
+    save()
+    keys = plan()
+    deadline = time.monotonic() + MAX_RUN_SECONDS
+    summary = {"trigger": trigger, "started_at": time.time(), "total": len(keys),
+               "warmed": 0, "skipped": 0, "failed": 0, "deferred": 0}
+    progress.update(running=True, trigger=trigger, started_at=summary["started_at"], total=len(keys), done=0)
+    hold_until = 0.0
+    with ThreadPoolExecutor(max_workers=max(1, CONCURRENCY), thread_name_prefix="warmer") as pool:
+        pending = set()
+        queue = list(keys)
+        while queue or pending:
+            if pending:
+                finished, pending = wait(pending, timeout=BUSY_PAUSE, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    try:
+                        outcome = future.result()
+                    except circuit.Unavailable as exc:
+                        # Quota or circuit refusal: back off before the next key.
+                        outcome = "deferred"
+                        hold_until = time.monotonic() + exc.retry_after
+                    summary[outcome] += 1
+                    counters[outcome] += 1
+                    progress["done"] += 1
+            if not queue:
+                continue
+            if time.monotonic() > deadline:
+                summary["deferred"] += len(queue)
+                counters["deferred"] += len(queue)
+                queue.clear()
+                continue
+            if len(pending) >= CONCURRENCY or time.monotonic() < hold_until or _busy():
+                if not pending:
+                    time.sleep(BUSY_PAUSE)
+                continue
+            key, (endpoint, params) = queue.pop(0)
+            pending.add(pool.submit(warm, key, endpoint, params))
+    summary["finished_at"] = time.time()
+    summary["duration_s"] = round(summary["finished_at"] - summary["started_at"], 1)
+    counters["runs"] += 1
+    progress["running"] = False
+    last_run.clear()
+    last_run.update(summary)
+    logger.info("Cache warm (%s): %s", trigger, summary)
+    return summary
+
+
+def next_run_at(now=None):
+    """Epoch seconds of the next ``WARM_AT`` time (local at ``UTC_OFFSET``)."""
+    local_zone = timezone(UTC_OFFSET)
+    local_now = datetime.fromtimestamp(now or time.time(), local_zone)
+    candidates = []
+    for clock in WARM_AT:
+        try:
+            hour, minute = (int(part) for part in clock.split(":"))
+        except ValueError:
+            continue
+        at = local_now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if at <= local_now:
+            at += timedelta(days=1)
+        candidates.append(at.timestamp())
+    return min(candidates, default=None)
+
+
+def _loop():
+    metrics.endpoint.set("job:warmer")
+    scheduled = next_run_at()
+    if START_DELAY >= 0:
+        _wake.wait(START_DELAY)
+        run("startup")
+    while True:
+        now = time.time()
+        if scheduled is not None and now >= scheduled:
+            run("schedule")
+            scheduled = next_run_at()
+            continue
+        if now - (_saved_at or 0) >= SAVE_INTERVAL:
+            save()
+        timeout = SAVE_INTERVAL if scheduled is None else min(SAVE_INTERVAL, scheduled - now)
+        _wake.wait(max(1.0, timeout))
+        _wake.clear()
+
+
+def start():
+    """Start the warmer thread once per process (lazily, so it survives forking)."""
+    global _thread
+    if not (ENABLED and api_key) or _thread is not None:
+        return
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_loop, name="warmer", daemon=True)
+            _thread.start()
+
+
+def hit_rate(hits, requests):
+    return round(hits / requests, 3) if requests else None
+
+
+def stats():
+    upcoming = next_run_at() if ENABLED else None
+    return {
+        "enabled": ENABLED and bool(api_key),
+        "tracked_keys": len(_scores),
+        "hottest": {
+            name: [{**entry["params"], "score": round(entry["score"], 1)} for entry in hottest(name, 5)]
+            for name in ENDPOINTS
+        },
+        "next_run_at": datetime.fromtimestamp(upcoming, timezone.utc).isoformat(timespec="seconds") if upcoming else None,
+        "progress": dict(progress),
+        "last_run": dict(last_run),
+        "traffic": {
+            name: {
+                **row,
+                "hit_rate": hit_rate(row["hits"], row["requests"]),
+                "warm_hit_rate": hit_rate(row["warm_hits"], row["warm_requests"]),
+                "other_hit_rate": hit_rate(row["hits"] - row["warm_hits"], row["requests"] - row["warm_requests"]),
+            }
+            for name, row in traffic.items()
+        },
+        **counters,
+    }
@@ -0,0 +1,101 @@
+"""
+Forecast and advisory caches for /weather-crop-advisory.
+
+Forecasts are keyed by the resolved location rounded to a
+``WEATHER_CACHE_GEO_PRECISION`` grid, so different spellings of the same
+place (and neighbouring villages) share one entry; each normalized query is
+remembered as an alias of the grid cell it resolved to. Once an entry is
+older than ``WEATHER_REFRESH_AHEAD`` of its TTL, a hit schedules a
+background refresh, so hot locations are renewed before they expire.
+
+Advisories are cached per (grid cell, forecast hash): the same forecast
+always yields the same advice, so it is only generated once.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cache
+import upstream
+
+logger = logging.getLogger(__name__)
+
+FORECAST_TTL = cache.ttl_setting("weather-forecast", 3 * 3600)
+GEO_PRECISION = int(os.getenv("WEATHER_CACHE_GEO_PRECISION", "1"))
+REFRESH_AHEAD = float(os.getenv("WEATHER_REFRESH_AHEAD", "0.8"))
+REFRESH_WORKERS = int(os.getenv("WEATHER_REFRESH_WORKERS", "2"))
+
+forecasts = cache.register(cache.ResponseCache("weather-forecast", FORECAST_TTL))
+aliases = cache.ResponseCache("weather-alias", 7 * 24 * 3600)
+advisories = cache.register(
+    cache.ResponseCache("weather-advisory", cache.ttl_setting("weather-advisory", 12 * 3600))
+)
+
+_refresh_pool = ThreadPoolExecutor(max_workers=REFRESH_WORKERS, thread_name_prefix="weather-refresh")
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+refreshes = {"scheduled": 0, "ok": 0, "failed": 0}
+
+
+def cell(forecast_json):
+    location = forecast_json.get("location", {})
+    return cache.geo_key(location.get("lat"), location.get("lon"), GEO_PRECISION)
+
+
+def lookup(query, refresh_call):
+    """Return the cached forecast for ``query`` or None.
+
+    ``refresh_call`` is the WeatherAPI call to re-run in the background when
+    the entry is close to expiry.
+    """
+    alias = aliases.get((cache.normalize(query),), count=False)
+    if alias is None:
+        forecasts.record(False)
+        return None
+    entry = forecasts.get(tuple(alias["cell"]))
+    if entry is None:
+        return None
+    if time.time() - entry["fetched_at"] > FORECAST_TTL * REFRESH_AHEAD:
+        schedule_refresh(query, refresh_call)
+    # The cell may have been filled by a neighbouring place; report the
+    # location this query itself resolved to.
+    return {**entry["forecast"], "location": alias["location"]}
+
+
+def store(query, forecast_json):
+    key = cell(forecast_json)
+    forecasts.set(key, {"fetched_at": time.time(), "forecast": forecast_json})
+    aliases.set((cache.normalize(query),), {"cell": list(key), "location": forecast_json.get("location", {})})
+
+
+def schedule_refresh(query, call):
+    key = cache.normalize(query)
+    with _refreshing_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+        refreshes["scheduled"] += 1
+    _refresh_pool.submit(_refresh, key, query, call)
+
+
+def _refresh(key, query, call):
+    try:
+        store(query, upstream.execute(call))
+        refreshes["ok"] += 1
+    except Exception as exc:
+        refreshes["failed"] += 1
+        logger.warning("Background forecast refresh for %r failed: %s", query, exc)
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(key)
+
+
+def advisory_key(forecast_json, daily_forecast, location_label):
+    digest = hashlib.sha1(
+        json.dumps([location_label, daily_forecast], sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    return (*cell(forecast_json), digest)